@@ -0,0 +1,116 @@
+"""
+Micro-benchmark for encoding one room broadcast.
+
+Compares the old per-recipient path (every consumer rebuilds the frame
+and calls json.dumps) with the encode-once path (the sender runs
+rooms.protocol.prepare and every consumer forwards the ready text).
+
+Both include what the channel layer costs per recipient: channels_redis
+packs the event with MessagePack once and every receiving consumer
+unpacks its own copy, so a bigger event is paid for N times. The
+``both`` column is the event as it was before group events dropped the
+MessagePack copy and the pre-expanded legacy frames; ``bytes`` is the
+size of each event on the wire.
+
+    python benchmarks/broadcast_encode.py [--repeat 2000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import msgpack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rooms.protocol import encode_msgpack, prepare  # noqa: E402
+
+ROOM_SIZES = (10, 50, 200)
+
+STROKES = [
+    {
+        "points": [{"x": 100 + i, "y": 200 + i * 2} for i in range(32)],
+        "color": "#1f77b4",
+        "size": 4,
+    }
+]
+
+
+def pack(event):
+    return msgpack.packb(event, use_bin_type=True)
+
+
+def deliver(packed, members, handle):
+    for _ in range(members):
+        handle(msgpack.unpackb(packed, raw=False))
+
+
+def per_recipient(members):
+    packed = pack({"type": "draw_batch_event", "strokes": STROKES})
+    deliver(
+        packed,
+        members,
+        lambda event: json.dumps({"type": "draw_batch", "strokes": event["strokes"]}),
+    )
+
+
+def both_event():
+    frame = {"type": "draw_batch", "strokes": STROKES}
+    legacy = [
+        {"type": "draw", "from": a, "to": b, "color": s["color"], "size": s["size"]}
+        for s in STROKES
+        for a, b in zip(s["points"], s["points"][1:])
+    ]
+    return {
+        "type": "draw_batch_event",
+        "frame": {"text": json.dumps(frame), "bytes": encode_msgpack(frame)},
+        "legacy": [{"text": json.dumps(f), "bytes": encode_msgpack(f)} for f in legacy],
+    }
+
+
+def encode_both(members):
+    deliver(pack(both_event()), members, lambda event: event["frame"]["text"])
+
+
+def text_event():
+    return {
+        "type": "draw_batch_event",
+        "frame": prepare({"type": "draw_batch", "strokes": STROKES}),
+    }
+
+
+def encode_once(members):
+    deliver(pack(text_event()), members, lambda event: event["frame"]["text"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    sizes = {
+        "per-recipient": len(pack({"type": "draw_batch_event", "strokes": STROKES})),
+        "both": len(pack(both_event())),
+        "encode-once": len(pack(text_event())),
+    }
+    print("event bytes: " + ", ".join(f"{name} {size}" for name, size in sizes.items()))
+    print(
+        f"{'members':>8} {'per-recipient us':>18} {'both us':>10} "
+        f"{'encode-once us':>16} {'speedup':>8}"
+    )
+    for members in ROOM_SIZES:
+        timings = [
+            timeit.timeit(lambda: path(members), number=args.repeat) / args.repeat * 1e6
+            for path in (per_recipient, encode_both, encode_once)
+        ]
+        old_us, both_us, new_us = timings
+        print(
+            f"{members:>8} {old_us:>18.1f} {both_us:>10.1f} "
+            f"{new_us:>16.1f} {old_us / new_us:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Size and speed of canvas snapshots: plain JSON, zlib-compressed JSON (the
+old snapshot format) and the columnar rooms.canvas_codec format.
+
+Boards are random-walk strokes of 40 segments, with integer coordinates
+or with sub-pixel float coordinates as sent by high-DPI clients.
+
+    python benchmarks/canvas_codec.py [--segments 100000]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rooms import canvas_codec  # noqa: E402
+
+COLORS = ["#000000", "#e63946", "#1d3557", "#2a9d8f", "#f4a261"]
+
+
+def board(segments, subpixel):
+    rng = random.Random(1)
+    data = []
+    x = y = 500
+    for _ in range(segments // 40):
+        color = rng.choice(COLORS)
+        size = rng.choice([2, 4, 8])
+        for _ in range(40):
+            nx, ny = x + rng.randint(-6, 6), y + rng.randint(-6, 6)
+            if subpixel:
+                nx, ny = nx + rng.randint(0, 3) / 4, ny + rng.randint(0, 3) / 4
+            data.append(
+                {
+                    "from": {"x": x, "y": y},
+                    "to": {"x": nx, "y": ny},
+                    "color": color,
+                    "size": size,
+                }
+            )
+            x, y = nx, ny
+    return data
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--segments", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(
+        f"{'board':>9} {'json KB':>9} {'zlib json KB':>13} "
+        f"{'codec KB':>9} {'vs json':>8} {'vs zlib':>8} {'enc ms':>7} {'dec ms':>7}"
+    )
+    for subpixel in (False, True):
+        data = board(args.segments, subpixel)
+        plain = json.dumps(data).encode()
+        zjson = zlib.compress(json.dumps(data, separators=(",", ":")).encode())
+        blob, encode_ms = timed(canvas_codec.encode, data)
+        decoded, decode_ms = timed(canvas_codec.decode, blob)
+        assert decoded == data
+
+        print(
+            f"{'subpixel' if subpixel else 'integer':>9} "
+            f"{len(plain) / 1024:>9.0f} {len(zjson) / 1024:>13.0f} "
+            f"{len(blob) / 1024:>9.0f} {len(plain) / len(blob):>7.1f}x "
+            f"{len(zjson) / len(blob):>7.1f}x {encode_ms:>7.0f} {decode_ms:>7.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Cold-start benchmark: time from launching a server process to its first
+answered HTTP request.
+
+Every run starts a fresh server on a local port against a database that
+is already migrated, polls until the port accepts connections
+(``listen_ms``) and then until a request through the Django URLconf gets
+a response (``ready_ms``). Modes:
+
+* ``fast`` is ``python -m whiteboard_backend.server --workers 1``, the
+  image's default: a schema check, then one worker.
+* ``legacy`` is what the container did on every start before migrations
+  became a release step: makemigrations for both apps (here with
+  ``--dry-run`` so nothing gets written), migrate, then daphne.
+* ``daphne`` is bare daphne with no checks, the floor for the other two.
+
+``import_ms`` is the time a fresh interpreter takes to set up Django and
+import the ASGI application. Results are printed and written as JSON
+(``--output``, one line appended for ``.jsonl`` files).
+
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --mode fast --output startup.jsonl
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.ws_load import git_commit, percentile  # noqa: E402
+
+MODES = ("fast", "legacy", "daphne")
+
+IMPORT_SCRIPT = (
+    "import time; started = time.perf_counter();"
+    "import django; django.setup();"
+    "from whiteboard_backend.asgi import application;"
+    "print(time.perf_counter() - started)"
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def command(mode, port):
+    python = sys.executable
+    daphne = [
+        python,
+        "-m",
+        "daphne",
+        "-p",
+        str(port),
+        "whiteboard_backend.asgi:application",
+    ]
+    if mode == "fast":
+        return [
+            python,
+            "-m",
+            "whiteboard_backend.server",
+            "--bind",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            "1",
+        ]
+    if mode == "legacy":
+        steps = [
+            [python, "manage.py", "makemigrations", "users", "--dry-run"],
+            [python, "manage.py", "makemigrations", "rooms", "--dry-run"],
+            [python, "manage.py", "migrate"],
+        ]
+        script = " && ".join(" ".join(step) for step in steps)
+        return ["sh", "-c", f"{script} && exec {' '.join(daphne)}"]
+    return daphne
+
+
+def poll(check, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return check()
+        except OSError:
+            time.sleep(0.01)
+    raise RuntimeError("server did not start")
+
+
+def connects(port):
+    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+
+
+def responds(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        connection.request("GET", path)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def measure_boot(mode, path, timeout):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command(mode, port),
+        cwd=ROOT,
+        env=os.environ.copy(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        poll(lambda: connects(port), timeout)
+        listen = time.perf_counter() - started
+        status = poll(lambda: responds(port, path), timeout)
+        ready = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return listen, ready, status
+
+
+def measure_import():
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=ROOT,
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def stats(values):
+    return {
+        "p50": round(percentile(values, 0.50) * 1000, 1),
+        "min": round(min(values) * 1000, 1),
+        "max": round(max(values) * 1000, 1),
+    }
+
+
+def run(args):
+    imports = [measure_import() for _ in range(args.runs)]
+    modes = {}
+    for mode in args.mode or MODES:
+        listen, ready, statuses = [], [], set()
+        for _ in range(args.runs):
+            seconds, first, status = measure_boot(mode, args.path, args.timeout)
+            listen.append(seconds)
+            ready.append(first)
+            statuses.add(status)
+        modes[mode] = {
+            "listen_ms": stats(listen),
+            "ready_ms": stats(ready),
+            "status": sorted(statuses),
+        }
+
+    return {
+        "benchmark": "startup",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "params": {"runs": args.runs, "path": args.path},
+        "import_ms": stats(imports),
+        "modes": modes,
+    }
+
+
+def print_report(result):
+    imports = result["import_ms"]
+    params = result["params"]
+    print(f"{params['runs']} runs, first request GET {params['path']}")
+    print(f"  {'import':>7}: p50 {imports['p50']:.0f} ms")
+    for mode, times in result["modes"].items():
+        print(
+            f"  {mode:>7}: listening p50 {times['listen_ms']['p50']:.0f} ms"
+            f"  ready p50 {times['ready_ms']['p50']:.0f} ms"
+            f"  (max {times['ready_ms']['max']:.0f} ms)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mode", choices=MODES, action="append")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--path", default="/api/login/", help="first request, answered by Django"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="seconds for one server to start"
+    )
+    parser.add_argument("--output", help="JSON file; .jsonl files are appended to")
+    args = parser.parse_args()
+
+    os.environ["BENCH_LAYER"] = "memory"
+    os.environ["DJANGO_SETTINGS_MODULE"] = "benchmarks.ws_settings"
+    fresh_db = "BENCH_DB" not in os.environ
+    if fresh_db:
+        fd, os.environ["BENCH_DB"] = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+
+    try:
+        subprocess.run(
+            [sys.executable, "manage.py", "release", "-v", "0"],
+            cwd=ROOT,
+            env=os.environ.copy(),
+            check=True,
+        )
+        result = run(args)
+    finally:
+        if fresh_db:
+            os.unlink(os.environ["BENCH_DB"])
+    print_report(result)
+
+    if args.output:
+        if args.output.endswith(".jsonl"):
+            with open(args.output, "a") as fh:
+                fh.write(json.dumps(result) + "\n")
+        else:
+            with open(args.output, "w") as fh:
+                json.dump(result, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
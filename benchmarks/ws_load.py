@@ -0,0 +1,584 @@
+"""
+Load generator and latency benchmark for the room WebSocket consumer.
+
+K rooms with N users each join, then every user sends draw, chat and
+WebRTC offer traffic at the configured rates. Every frame carries the
+sender's index and a sequence number, so each delivery to another member
+yields one end-to-end latency sample.
+
+Two modes:
+
+* ``inprocess`` drives whiteboard_backend.asgi.application through
+  channels.testing.WebsocketCommunicator in this process.
+* ``daphne`` starts ``daphne`` on a local port (or uses ``--url``) and
+  connects real sockets with a minimal RFC 6455 client. With
+  ``--workers N`` it starts ``whiteboard_backend.server`` with N workers
+  instead, which needs ``--layer redis``.
+
+The channel layer is in-memory by default; ``--layer redis`` uses
+REDIS_URL. Results are printed and written as JSON (``--output``, one
+line appended for ``.jsonl`` files) to track regressions across commits.
+
+    python benchmarks/ws_load.py --rooms 10 --users 8 --duration 10
+    python benchmarks/ws_load.py --mode daphne --output bench.jsonl
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ROOM_PREFIX = "BENCH"
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+# =============================================================
+# CLIENTS
+# =============================================================
+
+
+class InProcessClient:
+    def __init__(self, communicator):
+        self.communicator = communicator
+
+    @classmethod
+    async def connect(cls, path):
+        from channels.testing import WebsocketCommunicator
+        from whiteboard_backend.asgi import application
+
+        communicator = WebsocketCommunicator(application, path)
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise ConnectionError(f"rejected: {path}")
+        return cls(communicator)
+
+    async def send(self, message):
+        await self.communicator.send_to(text_data=json.dumps(message))
+
+    async def recv(self):
+        output = await self.communicator.receive_output(timeout=3600)
+        if output["type"] != "websocket.send":
+            return None
+        return output.get("text")
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """
+    Just enough RFC 6455 for the benchmark: unfragmented masked text
+    frames out, text/ping/close frames in.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.close_code = None
+
+    @classmethod
+    async def connect(cls, base_url, path):
+        url = urlsplit(base_url)
+        reader, writer = await asyncio.open_connection(url.hostname, url.port)
+        key = base64.b64encode(os.urandom(16))
+        writer.write(
+            (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {url.netloc}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key.decode()}\r\n"
+                "Sec-WebSocket-Version: 13\r\n\r\n"
+            ).encode()
+        )
+        head = await reader.readuntil(b"\r\n\r\n")
+        if b" 101 " not in head.split(b"\r\n", 1)[0]:
+            raise ConnectionError(head.split(b"\r\n", 1)[0].decode())
+
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+        if accept not in head:
+            raise ConnectionError("bad Sec-WebSocket-Accept")
+        return cls(reader, writer)
+
+    def _write_frame(self, opcode, payload):
+        length = len(payload)
+        header = bytearray([0x80 | opcode])
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 1 << 16:
+            header.append(0x80 | 126)
+            header += struct.pack("!H", length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack("!Q", length)
+
+        mask = os.urandom(4)
+        key = (mask * (length // 4 + 1))[:length]
+        masked = int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")
+        self.writer.write(bytes(header) + mask + masked.to_bytes(length, "big"))
+
+    async def send(self, message):
+        self._write_frame(0x1, json.dumps(message).encode())
+        await self.writer.drain()
+
+    async def recv(self):
+        while True:
+            first, second = await self.reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                (length,) = struct.unpack("!H", await self.reader.readexactly(2))
+            elif length == 127:
+                (length,) = struct.unpack("!Q", await self.reader.readexactly(8))
+            payload = await self.reader.readexactly(length)
+
+            if opcode == 0x1:
+                return payload.decode()
+            if opcode == 0x8:
+                if len(payload) >= 2:
+                    (self.close_code,) = struct.unpack("!H", payload[:2])
+                return None
+            if opcode == 0x9:
+                self._write_frame(0xA, payload)
+
+    async def close(self):
+        try:
+            self._write_frame(0x8, struct.pack("!H", 1000))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+# =============================================================
+# LOAD
+# =============================================================
+
+
+class Recorder:
+    def __init__(self):
+        self.sent_at = {}
+        self.sent = defaultdict(int)
+        self.expected = defaultdict(int)
+        self.delivered = defaultdict(int)
+        self.latencies = defaultdict(list)
+
+    def on_send(self, kind, uid, seq, recipients):
+        self.sent_at[(kind, uid, seq)] = time.perf_counter()
+        self.sent[kind] += 1
+        self.expected[kind] += recipients
+
+    def on_receive(self, kind, uid, seq):
+        sent_at = self.sent_at.get((kind, uid, seq))
+        if sent_at is not None:
+            self.delivered[kind] += 1
+            self.latencies[kind].append(time.perf_counter() - sent_at)
+
+
+def identify(text):
+    """
+    Return ``(kind, sender uid, seq)`` for a benchmark frame, else None.
+    """
+    frame = json.loads(text)
+    kind = frame.get("type")
+    if kind == "draw":
+        return "draw", frame["from"]["y"], frame["from"]["x"]
+    if kind == "chat":
+        uid, seq = frame["text"].split(":")
+        return "chat", int(uid), int(seq)
+    if kind == "webrtc_offer":
+        uid, seq = frame["payload"]["bench"]
+        return "signal", uid, seq
+    return None
+
+
+async def reader(client, uid, recorder):
+    while True:
+        text = await client.recv()
+        if text is None:
+            return
+        found = identify(text)
+        if found is not None and found[1] != uid:
+            recorder.on_receive(*found)
+
+
+async def sender(client, uid, members, args, recorder, stop):
+    rates = {"draw": args.draw_rate, "chat": args.chat_rate, "signal": args.signal_rate}
+    kinds = [kind for kind, rate in rates.items() if rate > 0]
+    if not kinds:
+        return
+    total = sum(rates.values())
+    weights = [rates[kind] for kind in kinds]
+    peers = [peer for peer in members if peer != uid]
+
+    seq = 0
+    while not stop.is_set():
+        await asyncio.sleep(random.expovariate(total))
+        seq += 1
+        kind = random.choices(kinds, weights)[0]
+
+        if kind == "draw":
+            recorder.on_send(kind, uid, seq, len(peers))
+            await client.send(
+                {
+                    "type": "draw",
+                    "from": {"x": seq, "y": uid},
+                    "to": {"x": seq, "y": -1},
+                    "color": "#000000",
+                    "size": 4,
+                }
+            )
+        elif kind == "chat":
+            recorder.on_send(kind, uid, seq, len(peers))
+            await client.send(
+                {"type": "chat", "username": f"u{uid}", "text": f"{uid}:{seq}"}
+            )
+        elif peers:
+            recorder.on_send(kind, uid, seq, 1)
+            await client.send(
+                {
+                    "type": "webrtc_offer",
+                    "sender": f"u{uid}",
+                    "target": f"u{random.choice(peers)}",
+                    "payload": {"bench": [uid, seq]},
+                }
+            )
+
+
+def rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == "self":
+        # ru_maxrss is the peak, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+
+async def sample_memory(pid, samples, stop):
+    while not stop.is_set():
+        samples.append(rss_mb(pid))
+        await asyncio.sleep(0.5)
+
+
+async def run_load(connect, args, server_pid):
+    recorder = Recorder()
+    stop = asyncio.Event()
+    memory = {"start": rss_mb(server_pid)}
+    samples = []
+
+    rooms = [f"{ROOM_PREFIX}{index}" for index in range(args.rooms)]
+    started = time.perf_counter()
+    clients = []
+    for room_index, room in enumerate(rooms):
+        members = [room_index * args.users + i for i in range(args.users)]
+        for uid in members:
+            client = await connect(f"/ws/room/{room}/")
+            await client.send({"type": "join", "username": f"u{uid}"})
+            clients.append((client, uid, members))
+    connect_seconds = time.perf_counter() - started
+
+    readers = [
+        asyncio.ensure_future(reader(client, uid, recorder))
+        for client, uid, _ in clients
+    ]
+    # Let the join broadcasts settle before measuring
+    await asyncio.sleep(0.5)
+
+    sampler = asyncio.ensure_future(sample_memory(server_pid, samples, stop))
+    senders = [
+        asyncio.ensure_future(sender(client, uid, members, args, recorder, stop))
+        for client, uid, members in clients
+    ]
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*senders)
+    elapsed = time.perf_counter() - started
+
+    # Give in-flight frames time to arrive
+    await asyncio.sleep(args.drain)
+
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(*readers, sampler, return_exceptions=True)
+    for client, _, _ in clients:
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+    samples = [s for s in samples if s is not None]
+    memory.update(
+        {
+            "peak": max(samples, default=None),
+            "end": rss_mb(server_pid),
+            "connections": len(clients),
+        }
+    )
+    return recorder, elapsed, connect_seconds, memory
+
+
+# =============================================================
+# REPORT
+# =============================================================
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(recorder, elapsed):
+    latency = {}
+    for kind, values in recorder.latencies.items():
+        latency[kind] = {
+            "count": len(values),
+            "p50": round(percentile(values, 0.50) * 1000, 3),
+            "p90": round(percentile(values, 0.90) * 1000, 3),
+            "p99": round(percentile(values, 0.99) * 1000, 3),
+            "max": round(max(values) * 1000, 3),
+        }
+
+    sent = sum(recorder.sent.values())
+    delivered = sum(recorder.delivered.values())
+    return {
+        "sent": dict(recorder.sent),
+        "expected": dict(recorder.expected),
+        "delivered": dict(recorder.delivered),
+        "throughput": {
+            "sent_per_s": round(sent / elapsed, 1),
+            "delivered_per_s": round(delivered / elapsed, 1),
+        },
+        "latency_ms": latency,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result):
+    print(
+        f"{result['mode']}/{result['layer']}: "
+        f"{result['params']['rooms']} rooms x {result['params']['users']} users, "
+        f"{result['elapsed_s']}s"
+    )
+    print(
+        f"  sent {result['throughput']['sent_per_s']}/s, "
+        f"delivered {result['throughput']['delivered_per_s']}/s"
+    )
+    for kind, stats in sorted(result["latency_ms"].items()):
+        expected = result["expected"].get(kind, 0)
+        print(
+            f"  {kind:>7}: p50 {stats['p50']:.2f} ms  p99 {stats['p99']:.2f} ms"
+            f"  ({stats['count']}/{expected} delivered)"
+        )
+    memory = result["memory_mb"]
+    if memory["peak"] is not None:
+        print(f"  server rss: {memory['start']:.1f} -> peak {memory['peak']:.1f} MB")
+
+
+# =============================================================
+# SETUP
+# =============================================================
+
+
+def setup_rooms(count, users):
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+
+    from rooms.models import Room
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    owner, _ = get_user_model().objects.get_or_create(email="ws-bench@example.com")
+    Room.objects.filter(code__startswith=ROOM_PREFIX).delete()
+    Room.objects.bulk_create(
+        Room(
+            code=f"{ROOM_PREFIX}{index}",
+            name=f"bench {index}",
+            created_by=owner,
+            max_members=users,
+        )
+        for index in range(count)
+    )
+
+
+def start_daphne(port, workers=1):
+    if workers > 1:
+        command = [
+            "whiteboard_backend.server",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+        ]
+    else:
+        command = ["daphne", "-p", str(port), "whiteboard_backend.asgi:application"]
+    process = subprocess.Popen(
+        [sys.executable, "-m", *command],
+        cwd=ROOT,
+        env=os.environ.copy(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return process
+
+
+async def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"daphne did not listen on port {port}")
+
+
+async def main_async(args):
+    process = None
+    server_pid = "self"
+
+    if args.mode == "inprocess":
+        connect = InProcessClient.connect
+    else:
+        url = args.url
+        if url is None:
+            process = start_daphne(args.port, args.workers)
+            # The supervisor's memory says nothing about its workers'
+            server_pid = process.pid if args.workers == 1 else None
+            url = f"ws://127.0.0.1:{args.port}"
+            await wait_for_port(args.port)
+
+        async def connect(path):
+            return await SocketClient.connect(url, path)
+
+    try:
+        recorder, elapsed, connect_seconds, memory = await run_load(
+            connect, args, server_pid if args.url is None else None
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            # Workers drain their connections first
+            process.wait(timeout=30)
+
+    return {
+        "benchmark": "ws_load",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "mode": args.mode,
+        "layer": os.environ["BENCH_LAYER"],
+        "params": {
+            "rooms": args.rooms,
+            "users": args.users,
+            "workers": args.workers,
+            "duration": args.duration,
+            "draw_rate": args.draw_rate,
+            "chat_rate": args.chat_rate,
+            "signal_rate": args.signal_rate,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "connect_s": round(connect_seconds, 3),
+        "memory_mb": memory,
+        **summarize(recorder, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mode", choices=["inprocess", "daphne"], default="inprocess")
+    parser.add_argument("--layer", choices=["memory", "redis"], default="memory")
+    parser.add_argument("--url", help="existing server, e.g. ws://127.0.0.1:8000")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="server workers in daphne mode"
+    )
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument(
+        "--drain", type=float, default=1, help="seconds to wait for stragglers"
+    )
+    parser.add_argument(
+        "--draw-rate", type=float, default=20, help="per user per second"
+    )
+    parser.add_argument(
+        "--chat-rate", type=float, default=0.5, help="per user per second"
+    )
+    parser.add_argument(
+        "--signal-rate", type=float, default=0.2, help="per user per second"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file; .jsonl files are appended to")
+    args = parser.parse_args()
+    if args.workers > 1 and args.layer != "redis":
+        parser.error("--workers needs --layer redis to share rooms")
+
+    random.seed(args.seed)
+    os.environ["BENCH_LAYER"] = args.layer
+    os.environ["DJANGO_SETTINGS_MODULE"] = "benchmarks.ws_settings"
+    # A fresh database per run (migrate --run-syncdb cannot add columns to
+    # one left by an older checkout), shared with the daphne child
+    fresh_db = "BENCH_DB" not in os.environ
+    if fresh_db:
+        fd, os.environ["BENCH_DB"] = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+
+    import django
+
+    django.setup()
+    setup_rooms(args.rooms, args.users)
+
+    try:
+        result = asyncio.run(main_async(args))
+    finally:
+        if fresh_db:
+            os.unlink(os.environ["BENCH_DB"])
+    print_report(result)
+
+    if args.output:
+        if args.output.endswith(".jsonl"):
+            with open(args.output, "a") as fh:
+                fh.write(json.dumps(result) + "\n")
+        else:
+            with open(args.output, "w") as fh:
+                json.dump(result, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Settings for the benchmarks (ws_load.py, startup.py) and the servers
+they start.
+
+The project settings, with a throwaway SQLite database and either an
+in-memory channel layer (BENCH_LAYER=memory, the default) or the Redis
+one from REDIS_URL (BENCH_LAYER=redis).
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault("SECRET_KEY", "ws-bench")
+os.environ.setdefault("FRONTEND_URL", "http://localhost")
+
+from whiteboard_backend.settings import *  # noqa: E402,F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ["*"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.getenv(
+            "BENCH_DB", os.path.join(tempfile.gettempdir(), "ws_bench.sqlite3")
+        ),
+    }
+}
+
+if os.getenv("BENCH_LAYER", "memory") == "memory":
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+    PRESENCE = {
+        "BACKEND": "rooms.presence.InMemoryPresenceBackend",
+        "CONFIG": {"ttl": 30},
+    }
+    ROOM_CACHE = {"hosts": [], "size": 1024, "ttl": 60}
+
+# Keep the log handler out of the measurements
+WS_LOG_SAMPLING = {"default": 0.0}
+
+# Measure the message pipeline rather than the rate limits, unless asked
+WS_RATE_LIMIT = os.getenv("WS_RATE_LIMIT", "0") == "1"
+
+# Benchmark clients connect without access tokens
+WS_AUTH_REQUIRED = False
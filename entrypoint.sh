@@ -1,5 +1,20 @@
 #!/bin/bash
-python manage.py makemigrations users
-python manage.py makemigrations rooms
-python manage.py migrate 
-exec daphne -b 0.0.0.0 -p 8000 whiteboard_backend.asgi:application
+# web (default): serve; the database must already be migrated
+# release:       apply migrations, once per deploy
+# all:           release, then serve (single container setups)
+set -e
+case "${1:-web}" in
+    web)
+        exec python -m whiteboard_backend.server --bind 0.0.0.0 --port 8000
+        ;;
+    release)
+        exec python manage.py release
+        ;;
+    all)
+        python manage.py release
+        exec python -m whiteboard_backend.server --bind 0.0.0.0 --port 8000
+        ;;
+    *)
+        exec "$@"
+        ;;
+esac
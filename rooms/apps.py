@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class RoomsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rooms"
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from .models import Room
+        from .room_cache import invalidate_room
+
+        post_save.connect(invalidate_room, sender=Room)
+        post_delete.connect(invalidate_room, sender=Room)
@@ -0,0 +1,115 @@
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .timers import FlushTimer
+
+logger = logging.getLogger("rooms.canvas")
+
+
+class StrokeLogWriter:
+    """
+    Buffers draw segments per room and appends them to the StrokeLog table
+    as one row per room and flush interval, so persisting a canvas costs
+    O(new segments) instead of rewriting the whole CanvasState.
+
+    Rooms that accumulate ``compact_threshold`` log rows in this process
+    are compacted right after the write. Segments of rooms whose write
+    fails stay buffered, ahead of anything appended since, and are tried
+    again on the next flush; after ``max_retries`` failed flushes in a
+    row they are dropped, so a room that keeps failing cannot grow the
+    buffer without bound.
+    """
+
+    def __init__(self, interval_ms, compact_threshold, max_retries):
+        self.interval = interval_ms / 1000
+        self.compact_threshold = compact_threshold
+        self.max_retries = max_retries
+
+        self._pending: dict[str, list] = {}
+        self._rows: dict[str, int] = {}
+        self._failures: dict[str, int] = {}
+        self._timer = FlushTimer(self.interval, self.flush)
+
+    def append(self, room_code, segment):
+        self._pending.setdefault(room_code, []).append(segment)
+        self._timer.schedule()
+
+    async def flush(self):
+        self._timer.cancel()
+
+        if not self._pending:
+            return
+
+        pending = self._pending
+        self._pending = {}
+        try:
+            await self._write(pending)
+        except Exception:
+            logger.exception("Stroke log write failed")
+
+        # _write drops each room from ``pending`` once its row is in, so
+        # only what was never written goes back
+        for code, segments in pending.items():
+            failures = self._failures.get(code, 0) + 1
+            if failures > self.max_retries:
+                logger.error(
+                    "Dropping %d strokes of room %s after %d failed writes",
+                    len(segments),
+                    code,
+                    failures,
+                )
+                self._failures.pop(code, None)
+                continue
+            self._failures[code] = failures
+            self._pending[code] = segments + self._pending.get(code, [])
+        if self._pending:
+            self._timer.schedule()
+
+    @database_sync_to_async
+    def _write(self, pending):
+        from .models import CanvasState, Room
+
+        room_ids = dict(
+            Room.objects.filter(code__in=pending).values_list("code", "id")
+        )
+
+        for code, room_id in room_ids.items():
+            # One room failing must not hold back the others
+            try:
+                CanvasState.append(room_id, pending[code])
+            except Exception:
+                logger.exception("Stroke log write of room %s failed", code)
+                continue
+            del pending[code]
+            self._failures.pop(code, None)
+
+            rows = self._rows.get(code, 0) + 1
+            if rows >= self.compact_threshold:
+                # The segments are in; a failed compaction is retried
+                # after the room's next write
+                try:
+                    CanvasState.objects.get(room_id=room_id).compact()
+                    rows = 0
+                except Exception:
+                    logger.exception("Compaction of room %s failed", code)
+            self._rows[code] = rows
+
+        # Rooms deleted meanwhile have nowhere to go
+        for code in set(pending) - set(room_ids):
+            del pending[code]
+
+
+_writer = None
+
+
+def get_stroke_log_writer():
+    global _writer
+    if _writer is None:
+        _writer = StrokeLogWriter(
+            settings.CANVAS_LOG_FLUSH_MS,
+            settings.CANVAS_COMPACT_THRESHOLD,
+            settings.CANVAS_LOG_MAX_RETRIES,
+        )
+    return _writer
@@ -0,0 +1,283 @@
+"""
+Columnar binary encoding of canvas data (a list of draw segments and
+points), used for CanvasState snapshots and the binary canvas download.
+
+Layout: a 5 byte header (``MAGIC``, format version, compression) and a
+compressed body of sections. Records are split into columns:
+
+* kinds: one byte per record (segment, point or other)
+* x and y: every coordinate of every record, delta-encoded per axis as
+  int16/int32/int64 when all coordinates are integers, otherwise stored
+  as float32 when that is lossless and float64 when it is not. An axis
+  mixing integers and floats is stored as JSON so 3 does not come back
+  as 3.0
+* colors: a palette of the distinct colors and one index per record
+* sizes: run-length encoded
+* others: records of any other shape, as JSON
+
+Consecutive segments share endpoints, so most deltas are 0 and
+compress away.
+"""
+
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"WBC"
+FORMAT_VERSION = 1
+
+ZLIB = 1
+ZSTD = 2
+
+SEGMENT = 0
+POINT = 1
+OTHER = 2
+
+_SEGMENT_KEYS = {"from", "to", "color", "size"}
+_POINT_KEYS = {"x", "y", "color", "size"}
+
+
+class CanvasCodecError(ValueError):
+    pass
+
+
+def is_encoded(blob):
+    return bytes(blob[:3]) == MAGIC
+
+
+def _number(value):
+    if type(value) is int:
+        # Keeps every delta within int64
+        return -(2**62) < value < 2**62
+    return type(value) is float and math.isfinite(value)
+
+
+def _xy(point):
+    return (
+        isinstance(point, dict)
+        and point.keys() == {"x", "y"}
+        and _number(point["x"])
+        and _number(point["y"])
+    )
+
+
+def _kind(record):
+    if not isinstance(record, dict):
+        return OTHER
+    keys = record.keys()
+    if keys == _SEGMENT_KEYS and _xy(record["from"]) and _xy(record["to"]):
+        return SEGMENT
+    if keys == _POINT_KEYS and _number(record["x"]) and _number(record["y"]):
+        return POINT
+    return OTHER
+
+
+# =============================================================
+# SECTIONS
+# =============================================================
+
+
+def _pack_array(values):
+    """
+    Smallest lossless array for ``values``: ``(typecode, array)``.
+    """
+    if all(type(v) is int for v in values):
+        for typecode in "hiq":
+            try:
+                return typecode, array(typecode, values)
+            except OverflowError:
+                continue
+    try:
+        floats = array("f", values)
+    except OverflowError:
+        floats = None
+    if floats is not None and list(floats) == values:
+        return "f", floats
+    return "d", array("d", values)
+
+
+def _deltas(values):
+    previous = 0
+    out = []
+    for value in values:
+        out.append(value - previous)
+        previous = value
+    return out
+
+
+def _undelta(values):
+    total = 0
+    for value in values:
+        total += value
+        yield total
+
+
+def _section(typecode, payload):
+    if isinstance(payload, array):
+        if sys.byteorder == "big":
+            payload = array(payload.typecode, payload)
+            payload.byteswap()
+        payload = payload.tobytes()
+    return struct.pack("<cI", typecode.encode(), len(payload)) + payload
+
+
+def _read_sections(body):
+    offset = 0
+    while offset < len(body):
+        typecode, length = struct.unpack_from("<cI", body, offset)
+        offset += 5
+        payload = body[offset : offset + length]
+        offset += length
+
+        typecode = typecode.decode()
+        if typecode == "j":
+            yield json.loads(payload)
+            continue
+
+        values = array(typecode)
+        values.frombytes(payload)
+        if sys.byteorder == "big":
+            values.byteswap()
+        yield values
+
+
+def _json(value):
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+# =============================================================
+# ENCODE / DECODE
+# =============================================================
+
+
+def encode(records, compression=ZLIB, level=6):
+    """
+    Encode a list of canvas records. ``compression=ZSTD`` needs the
+    optional ``zstandard`` package.
+    """
+    kinds = bytearray()
+    xs, ys = [], []
+    palette, color_index, colors = {}, [], []
+    sizes, runs = [], []
+    others = []
+
+    for record in records:
+        kind = _kind(record)
+        kinds.append(kind)
+        if kind == OTHER:
+            others.append(record)
+            continue
+
+        if kind == SEGMENT:
+            xs += (record["from"]["x"], record["to"]["x"])
+            ys += (record["from"]["y"], record["to"]["y"])
+        else:
+            xs.append(record["x"])
+            ys.append(record["y"])
+
+        color = _json(record["color"])
+        if color not in palette:
+            palette[color] = len(colors)
+            colors.append(record["color"])
+        color_index.append(palette[color])
+
+        size = record["size"]
+        if runs and sizes[-1] == size and type(sizes[-1]) is type(size):
+            runs[-1] += 1
+        else:
+            sizes.append(size)
+            runs.append(1)
+
+    sections = [_section("B", array("B", kinds))]
+    for values in (xs, ys):
+        types = {type(v) for v in values}
+        if len(types) > 1:
+            sections.append(_section("j", _json(values)))
+            continue
+        if types <= {int}:
+            values = _deltas(values)
+        typecode, packed = _pack_array(values)
+        sections.append(_section(typecode, packed))
+    sections.append(_section("j", _json(colors)))
+    typecode = "B" if len(colors) <= 0xFF else "H" if len(colors) <= 0xFFFF else "I"
+    sections.append(_section(typecode, array(typecode, color_index)))
+    sections.append(_section("j", _json(sizes)))
+    sections.append(_section("I", array("I", runs)))
+    sections.append(_section("j", _json(others)))
+    body = b"".join(sections)
+
+    if compression == ZSTD:
+        import zstandard
+
+        body = zstandard.ZstdCompressor(level=level).compress(body)
+    else:
+        body = zlib.compress(body, level)
+
+    return MAGIC + struct.pack("<BB", FORMAT_VERSION, compression) + body
+
+
+def _coordinates(column):
+    # Integer columns are delta-encoded, float and JSON columns are not
+    if isinstance(column, array) and column.typecode in "hiq":
+        return _undelta(column)
+    return iter(column)
+
+
+def iter_decode(blob):
+    """
+    Yield the records of an encoded canvas one at a time. Only the
+    compact columns are held in memory, never the whole list of dicts.
+    """
+    blob = bytes(blob)
+    if not is_encoded(blob):
+        raise CanvasCodecError("Not an encoded canvas")
+    version, compression = struct.unpack_from("<BB", blob, 3)
+    if version != FORMAT_VERSION:
+        raise CanvasCodecError(f"Unsupported canvas format {version}")
+
+    body = blob[5:]
+    if compression == ZSTD:
+        import zstandard
+
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif compression == ZLIB:
+        body = zlib.decompress(body)
+    else:
+        raise CanvasCodecError(f"Unknown compression {compression}")
+
+    kinds, xs, ys, colors, color_index, sizes, runs, others = _read_sections(
+        body
+    )
+    xs, ys = _coordinates(xs), _coordinates(ys)
+    color_index = iter(color_index)
+    others = iter(others)
+    size_values = (size for size, run in zip(sizes, runs) for _ in range(run))
+
+    for kind in kinds:
+        if kind == OTHER:
+            yield next(others)
+            continue
+
+        if kind == SEGMENT:
+            from_x, to_x = next(xs), next(xs)
+            from_y, to_y = next(ys), next(ys)
+            yield {
+                "from": {"x": from_x, "y": from_y},
+                "to": {"x": to_x, "y": to_y},
+                "color": colors[next(color_index)],
+                "size": next(size_values),
+            }
+        else:
+            yield {
+                "x": next(xs),
+                "y": next(ys),
+                "color": colors[next(color_index)],
+                "size": next(size_values),
+            }
+
+
+def decode(blob):
+    return list(iter_decode(blob))
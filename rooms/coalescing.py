@@ -0,0 +1,145 @@
+import json
+from functools import lru_cache
+
+from django.conf import settings
+
+from whiteboard_backend import metrics
+
+from .protocol import CONVERTED_CACHE_SIZE, prepare
+from .timers import FlushTimer
+
+
+@lru_cache(maxsize=CONVERTED_CACHE_SIZE)
+def legacy_frames(batch_text):
+    """
+    Expand a prepared draw batch back into one "draw" frame per segment
+    for clients that did not opt into batches. Runs once per batch and
+    process, and only where such a client is connected.
+    """
+    frames = []
+    for stroke in json.loads(batch_text)["strokes"]:
+        points = stroke["points"]
+        for start, end in zip(points, points[1:]):
+            frames.append(
+                prepare(
+                    {
+                        "type": "draw",
+                        "from": start,
+                        "to": end,
+                        "color": stroke["color"],
+                        "size": stroke["size"],
+                    }
+                )
+            )
+    return tuple(frames)
+
+
+class DrawCoalescer:
+    """
+    Buffers the draw segments of one room for a short window and publishes
+    them to the group as a single ``draw_batch_event``.
+
+    Consecutive segments from the same sender that share color and size are
+    merged into a polyline, so a freehand stroke travels as a list of points
+    instead of one event per segment.
+    """
+
+    def __init__(self, channel_layer, group_name, window_ms, max_segments):
+        self.channel_layer = channel_layer
+        self.group_name = group_name
+        self.window = window_ms / 1000
+        self.max_segments = max_segments
+
+        self._strokes = []
+        self._open = {}  # sender -> last stroke still accepting points
+        self._segments = 0
+        self._timer = FlushTimer(self.window, self.flush)
+
+    async def add(self, sender, segment):
+        stroke = self._open.get(sender)
+
+        if (
+            stroke is not None
+            and stroke["color"] == segment["color"]
+            and stroke["size"] == segment["size"]
+            and stroke["points"][-1] == segment["from"]
+        ):
+            stroke["points"].append(segment["to"])
+        else:
+            stroke = {
+                "points": [segment["from"], segment["to"]],
+                "color": segment["color"],
+                "size": segment["size"],
+            }
+            self._strokes.append(stroke)
+            self._open[sender] = stroke
+
+        self._segments += 1
+
+        if self._segments >= self.max_segments:
+            await self.flush()
+        else:
+            self._timer.schedule()
+
+    async def flush(self):
+        self._timer.cancel()
+
+        if not self._strokes:
+            return
+
+        strokes = self._strokes
+        self._strokes = []
+        self._open = {}
+        self._segments = 0
+
+        await metrics.group_send(
+            self.channel_layer,
+            self.group_name,
+            {
+                "type": "draw_batch_event",
+                "frame": prepare({"type": "draw_batch", "strokes": strokes}),
+            },
+        )
+
+
+# One coalescer per room and process, shared by every local connection
+# of that room. The second item is the number of connections using it.
+_COALESCERS: dict[str, list] = {}
+
+
+def acquire(channel_layer, group_name):
+    """
+    Return the room's coalescer, or None when batching is disabled.
+    """
+    window_ms = settings.DRAW_BATCH_WINDOW_MS
+    if window_ms <= 0:
+        return None
+
+    entry = _COALESCERS.get(group_name)
+    if entry is None:
+        coalescer = DrawCoalescer(
+            channel_layer,
+            group_name,
+            window_ms,
+            settings.DRAW_BATCH_MAX_SEGMENTS,
+        )
+        entry = _COALESCERS[group_name] = [coalescer, 0]
+
+    entry[1] += 1
+    return entry[0]
+
+
+async def release(group_name):
+    entry = _COALESCERS.get(group_name)
+    if entry is None:
+        return
+
+    entry[1] -= 1
+    if entry[1] <= 0:
+        _COALESCERS.pop(group_name, None)
+        await entry[0].flush()
+
+
+async def flush_all():
+    for coalescer, _ in list(_COALESCERS.values()):
+        await coalescer.flush()
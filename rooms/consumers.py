@@ -1,24 +1,203 @@
+import asyncio
 import json
+import time
+import msgpack
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-
-#use redis instead of this
-ROOM_USERS: dict[str, set[str]] = {}
+from django.conf import settings
+
+from users.middleware import AUTH_SUBPROTOCOL
+from whiteboard_backend import metrics
+
+from . import (
+    coalescing,
+    drain,
+    eventlog,
+    lifecycle,
+    messages,
+    protocol,
+    ratelimit,
+    signaling,
+)
+from .canvas import get_stroke_log_writer
+from .outbound import OutboundQueue
+from .presence import get_presence_store
+from .room_cache import get_room_cache
+from .signaling import CandidateAggregator
+
+START_CALL_FRAME = protocol.prepare({"type": "start_call"})
+
+# Message type -> (handler, schema), filled in by the RoomConsumer
+# handlers below
+ROUTES = messages.Routes()
+
+
+def type_label(msg_type):
+    """
+    Routed message types are counted under their own metrics label;
+    anything else a client sends is "unknown", to keep label cardinality
+    fixed.
+    """
+    if type(msg_type) is str and msg_type in ROUTES:
+        return msg_type
+    return "unknown"
 
 
 class RoomConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_code = self.scope["url_route"]["kwargs"]["room_code"]
         self.group_name = f"room_{self.room_code}"
-
+        # Everything leave() looks at exists from here on, however far
+        # connect() gets before a rejection or an error
+        self.room = None
+        self.budgets = None
+        self.identity = None
         # Ensure the attribute exists even before a "join" message arrives
         self.username = None
+        self.presence = None
+        self.heartbeat_task = None
+        # Clients opt into batched draw/ICE frames in their "join" message
+        self.supports_draw_batch = False
+        self.supports_candidate_batch = False
+        self.draw_coalescer = None
+        self.candidates = None
+        self.binary = False
+        self.outbound = None
+        self.active = False
+
+        # This worker is shutting down; the client retries elsewhere
+        if drain.draining:
+            metrics.WS_CONNECTIONS.inc(event="draining")
+            await self.close(code=4012)
+            return
+
+        # Set by users.middleware.JWTAuthMiddleware from the access token
+        user = self.scope.get("user")
+        self.identity = (
+            user.username if user is not None and user.is_authenticated else None
+        )
+        if self.identity is None and settings.WS_AUTH_REQUIRED:
+            metrics.WS_CONNECTIONS.inc(event="unauthorized")
+            await self.close(code=4401)
+            return
+
+        # Loaded once per connection; usually served from the room cache
+        self.room = await get_room_cache().get(self.room_code)
+        if self.room is None:
+            metrics.WS_CONNECTIONS.inc(event="rejected")
+            await self.close(code=4404)
+            return
+
+        self.budgets = ratelimit.acquire(self.room_code, time.monotonic())
+        self.presence = get_presence_store()
+        self.draw_coalescer = coalescing.acquire(
+            self.channel_layer, self.group_name
+        )
+        if settings.ICE_BATCH_WINDOW_MS > 0:
+            self.candidates = CandidateAggregator(
+                self.deliver_candidates, settings.ICE_BATCH_WINDOW_MS
+            )
+
+        # Binary MessagePack frames when the client offers the subprotocol
+        subprotocols = self.scope.get("subprotocols", [])
+        self.binary = protocol.MSGPACK_SUBPROTOCOL in subprotocols
+        subprotocol = None
+        if self.binary:
+            subprotocol = protocol.MSGPACK_SUBPROTOCOL
+        elif AUTH_SUBPROTOCOL in subprotocols:
+            # Browsers fail the handshake unless one offered subprotocol
+            # is selected; the token itself is never echoed
+            subprotocol = AUTH_SUBPROTOCOL
 
         # Join the channel layer group for this room
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        await self.accept(subprotocol=subprotocol)
+
+        # Everything sent to the client goes through this queue, so a slow
+        # socket only ever backs up its own connection.
+        self.outbound = OutboundQueue(
+            self.write_prepared,
+            settings.WS_SEND_QUEUE_SIZE,
+            settings.WS_SEND_QUEUE_POLICY,
+            self.close_slow_consumer,
+            self.close_broken_socket,
+        )
+        self.outbound.start()
+        drain.register(self)
+
+        metrics.WS_CONNECTIONS.inc(event="connect")
+        metrics.WS_ACTIVE.inc()
+        self.active = True
+        lifecycle.start_sweeper()
+
+    async def close(self, code=None, reason=None):
+        # Let queued frames (e.g. the error explaining why) go out first
+        if self.outbound is not None:
+            await self.outbound.flush(timeout=1)
+        await super().close(code, reason)
+
+    async def reconnect(self, after_ms):
+        """
+        Tell the client to reconnect in ``after_ms`` and close with 4012,
+        the application-range twin of 1012 (service restart). Sent to every
+        connection of a draining worker.
+        """
+        await self.send_frame({"type": "reconnect", "after_ms": after_ms})
+        await self.close(code=4012)
+
+    async def close_slow_consumer(self):
+        await super().close(code=4008, reason="Send queue overflow")
+
+    async def close_broken_socket(self):
+        await super().close(code=1011)
+
+    async def write_prepared(self, prepared):
+        if self.binary:
+            await self.send(bytes_data=protocol.binary(prepared))
+        else:
+            await self.send(text_data=prepared["text"])
+
+    async def send_frame(self, frame):
+        """
+        Queue one outbound frame, encoded only for the protocol negotiated
+        at connect.
+        """
+        if frame["type"] == "error":
+            metrics.WS_ERRORS.inc(kind=frame.get("code", "bad_request"))
+
+        if self.binary:
+            self.outbound.put({"bytes": protocol.encode_msgpack(frame)})
+        else:
+            self.outbound.put({"text": protocol.encode_json(frame)})
 
     async def disconnect(self, close_code):
+        # Rejected in connect() before joining anything
+        if self.room is None:
+            return
+
+        try:
+            await self.leave()
+        finally:
+            drain.unregister(self)
+
+    async def leave(self):
+        metrics.WS_CONNECTIONS.inc(event="disconnect")
+        if self.active:
+            metrics.WS_ACTIVE.dec()
+        if self.budgets is not None:
+            ratelimit.release(self.room_code)
+
+        if self.outbound is not None:
+            self.outbound.stop()
+
+        # Publish any draw segments still waiting in this room's buffer
+        if self.draw_coalescer is not None:
+            await coalescing.release(self.group_name)
+
+        # Candidates for peers of a closed connection are useless
+        if self.candidates is not None:
+            self.candidates.cancel()
+
         # Leave the channel layer group
         await self.channel_layer.group_discard(
             self.group_name,
@@ -27,301 +206,439 @@ class RoomConsumer(AsyncWebsocketConsumer):
 
         # Remove user from room if they had joined
         if self.username:
-            users = ROOM_USERS.get(self.room_code, set())
-            users.discard(self.username)
+            if self.heartbeat_task is not None:
+                self.heartbeat_task.cancel()
 
-            # Safely remove empty room
-            if not users:
-                ROOM_USERS.pop(self.room_code, None)
+            users = await self.presence.leave(
+                self.room_code, self.username, self.channel_name
+            )
+            metrics.WS_FANOUT.observe(len(users))
 
-            await self.channel_layer.group_send(
+            await metrics.group_send(
+                self.channel_layer,
                 self.group_name,
                 {
                     "type": "user_list",
-                    "users": list(users),
+                    "frame": protocol.prepare(
+                        {"type": "user_list", "users": users}
+                    ),
                 },
             )
 
+    async def heartbeat(self):
+        """
+        Keep this member's presence entry alive while the socket is open.
+        Entries of crashed workers expire after ``PRESENCE["CONFIG"]["ttl"]``.
+        """
+        interval = self.presence.ttl / 3
+        while True:
+            await asyncio.sleep(interval)
+            await self.presence.heartbeat(
+                self.room_code, self.username, self.channel_name
+            )
+
     @database_sync_to_async
-    def get_room_max_members(self, room_code):
-        from .models import Room
+    def get_canvas_since(self, room_code, version):
+        from .models import CanvasState, Room
+
+        state = CanvasState.objects.filter(room__code=room_code).first()
+        if state is None:
+            # No canvas yet, or it sits in the archive until needed
+            room = Room.objects.filter(
+                code=room_code, canvas_archived_at__isnull=False
+            ).first()
+            if room is None:
+                return None
+            state = CanvasState.for_room(room.pk)
+        full, data = state.ops_since(version)
+        return {
+            "type": "canvas_sync",
+            "version": state.version,
+            "full": full,
+            "data": data,
+        }
 
-        try:
-            return Room.objects.get(code=room_code).max_members
-        except Room.DoesNotExist:
-            return 0  # 0 = unlimited
+    @database_sync_to_async
+    def erase_canvas(self, room_code, bbox):
+        from .models import CanvasState, Room
 
-    async def receive(self, text_data):
-        try:
-            print(f"Received data: {text_data}")
+        room_id = (
+            Room.objects.filter(code=room_code).values_list("id", flat=True).first()
+        )
+        if room_id is None:
+            return None
+        return CanvasState.erase(room_id, bbox)
 
-            # Parse JSON
+    async def send_signal(self, target, event):
+        """
+        Route a signaling event: straight to the target's channel, or to
+        the whole room when it has no target.
+        """
+        if not target:
+            await metrics.group_send(
+                self.channel_layer, self.group_name, event
+            )
+            return
+
+        channel = await self.presence.channel_for(self.room_code, target)
+        if channel is None:
+            await self.send_frame(
+                {
+                    "type": "error",
+                    "message": f"{target} is not in this room",
+                    "code": "unknown_target",
+                }
+            )
+            return
+
+        await metrics.send(self.channel_layer, channel, event)
+
+    async def deliver_candidates(self, sender, target, payloads):
+        await self.send_signal(
+            target,
+            {
+                "type": "webrtc_candidates_event",
+                "target": target,
+                "frame": protocol.prepare(
+                    {
+                        "type": "webrtc_candidates",
+                        "payloads": payloads,
+                        "sender": sender,
+                        "target": target,
+                    }
+                ),
+            },
+        )
+
+    async def within_budget(self, budget):
+        """
+        Charge one message to its rate limit budget. Returns False when the
+        message must not be handled.
+        """
+        wait = budget.acquire(time.monotonic())
+        if not wait:
+            return True
+
+        action = budget.action
+        metrics.WS_RATE_LIMITED.inc(kind=budget.kind, action=action)
+
+        if not budget.limited or action == "close":
+            budget.limited = True
+            await self.send_frame(
+                {
+                    "type": "error",
+                    "code": "rate_limited",
+                    "message": f"Too many {budget.kind} messages",
+                    "limit": budget.kind,
+                    "action": action,
+                    "retry_after": round(wait, 3),
+                }
+            )
+
+        if action == "close":
+            await self.close(code=4029)
+        return False
+
+    async def send_error(self, error):
+        """
+        Queue one of the static, pre-encoded error frames.
+        """
+        metrics.WS_ERRORS.inc(kind=error.code)
+        self.outbound.put(error.prepared)
+
+    async def reject(self, error):
+        """
+        Answer a frame that cannot be handled, within the connection's
+        "invalid" budget so a flood of garbage is not answered frame by
+        frame.
+        """
+        budget = self.budgets.get(ratelimit.INVALID)
+        if budget is None or await self.within_budget(budget):
+            await self.send_error(error)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        start = time.perf_counter()
+        label = "unknown"
+        try:
+            # Parse JSON (text frames) or MessagePack (binary frames)
             try:
-                data = json.loads(text_data)
+                if bytes_data is not None:
+                    data = protocol.decode_msgpack(bytes_data)
+                else:
+                    data = protocol.decode_json(text_data)
             except json.JSONDecodeError:
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "error",
-                            "message": (
-                                "Invalid JSON format. "
-                                "Expected a JSON object."
-                            ),
-                        }
-                    )
-                )
+                await self.reject(messages.INVALID_JSON)
+                return
+            except (ValueError, msgpack.UnpackException):
+                await self.reject(messages.INVALID_MSGPACK)
                 return
 
-            # Ensure object/dict
-            if not isinstance(data, dict):
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "error",
-                            "message": (
-                                f"Expected JSON object, got {type(data)}"
-                            ),
-                        }
-                    )
-                )
+            if type(data) is not dict:
+                await self.reject(messages.NOT_AN_OBJECT)
                 return
 
             msg_type = data.get("type")
+            label = type_label(msg_type)
+            metrics.WS_MESSAGES.inc(type=label)
 
             if not msg_type:
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "error",
-                            "message": "Message type is required",
-                        }
-                    )
-                )
+                await self.reject(messages.MISSING_TYPE)
                 return
 
-            # =========================================================
-            # JOIN
-            # =========================================================
-            if msg_type == "join":
-                if "username" not in data:
-                    await self.send(
-                        text_data=json.dumps(
-                            {
-                                "type": "error",
-                                "message": "Username is required for join",
-                            }
-                        )
-                    )
-                    return
-
-                self.username = data["username"]
-
-                users = ROOM_USERS.setdefault(
-                    self.room_code,
-                    set(),
-                )
-
-                # Enforce member limit
-                max_members = await self.get_room_max_members(
-                    self.room_code
-                )
-
-                if max_members > 0 and len(users) >= max_members:
-                    await self.send(
-                        text_data=json.dumps(
-                            {
-                                "type": "error",
-                                "message": (
-                                    f"Room is full "
-                                    f"({max_members} member limit reached)."
-                                ),
-                                "code": "room_full",
-                            }
-                        )
-                    )
-
-                    await self.close()
-                    return
-
-                users.add(self.username)
-
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "user_list",
-                        "users": list(users),
-                    },
-                )
-
-            # =========================================================
-            # DRAW
-            # =========================================================
-            elif msg_type == "draw":
-                required_fields = ["from", "to"]
-
-                if not all(field in data for field in required_fields):
-                    await self.send(
-                        text_data=json.dumps(
-                            {
-                                "type": "error",
-                                "message": (
-                                    "Missing required fields for draw: "
-                                    f"{required_fields}"
-                                ),
-                            }
-                        )
-                    )
-                    return
-
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "draw_line_event",
-                        "from": data["from"],
-                        "to": data["to"],
-                        "color": data.get("color", "#000000"),
-                        "size": data.get("size", 4),
-                    },
-                )
-
-            # =========================================================
-            # CHAT
-            # =========================================================
-            elif msg_type == "chat":
-                if "text" not in data or "username" not in data:
-                    await self.send(
-                        text_data=json.dumps(
-                            {
-                                "type": "error",
-                                "message": (
-                                    "Chat messages require "
-                                    "text and username"
-                                ),
-                            }
-                        )
-                    )
-                    return
-
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "chat_message",
-                        "username": data["username"],
-                        "text": data["text"],
-                    },
-                )
-
-            # =========================================================
-            # WEBRTC SIGNALING
-            # =========================================================
-            elif msg_type in (
-                "webrtc_offer",
-                "webrtc_answer",
-                "webrtc_candidate",
-            ):
-                if "payload" not in data or "sender" not in data:
-                    await self.send(
-                        text_data=json.dumps(
-                            {
-                                "type": "error",
-                                "message": (
-                                    f"Missing required fields "
-                                    f"for {msg_type}"
-                                ),
-                            }
-                        )
-                    )
-                    return
-
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "webrtc_signal",
-                        "signal_type": msg_type,
-                        "payload": data["payload"],
-                        "sender": data["sender"],
-                        "target": data.get("target"),
-                    },
-                )
-
-            # =========================================================
-            # UNKNOWN MESSAGE TYPE
-            # =========================================================
-            else:
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "error",
-                            "message": (
-                                f"Unknown message type: {msg_type}"
-                            ),
-                        }
-                    )
-                )
-
-        except Exception as e:
-            import traceback
-
-            print(f"Error in consumer: {str(e)}")
-            print(traceback.format_exc())
-
-            await self.send(
-                text_data=json.dumps(
-                    {
-                        "type": "error",
-                        "message": f"Server error: {str(e)}",
-                    }
-                )
+            route = ROUTES.get(label)
+            if route is None:
+                await self.reject(messages.UNKNOWN_TYPE)
+                return
+
+            # Over-budget messages are dropped before any work is done
+            budget = self.budgets.get(label)
+            if budget is not None and not await self.within_budget(budget):
+                return
+
+            eventlog.received(self.room_code, msg_type, data)
+            lifecycle.get_activity_tracker().touch(self.room_code)
+
+            handler, schema = route
+            error = schema.validate(data)
+            if error is not None:
+                await self.send_error(error)
+                return
+
+            await handler(self, data)
+
+        except Exception:
+            eventlog.logger.exception(
+                "ws.error", extra={"ws": {"room": self.room_code}}
+            )
+            await self.send_error(messages.SERVER_ERROR)
+
+        finally:
+            metrics.WS_RECEIVE_SECONDS.observe(
+                time.perf_counter() - start, type=label
             )
 
     # =============================================================
-    # GROUP EVENT HANDLERS
+    # MESSAGE HANDLERS
     # =============================================================
+    # Registered per message type in ROUTES; each gets the message after
+    # its rooms.messages schema has checked and normalized it.
+
+    @ROUTES.route(messages.JOIN)
+    async def on_join(self, data):
+        # The token's identity wins over any name the client claims
+        username = self.identity or data["username"]
+        if username is None:
+            await self.send_error(messages.JOIN.missing)
+            return
+        features = data["features"]
+        self.supports_draw_batch = "draw_batch" in features
+        self.supports_candidate_batch = "webrtc_candidates" in features
 
-    async def user_list(self, event):
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "user_list",
-                    "users": event["users"],
-                }
-            )
+        # Enforce member limit (checked and added atomically)
+        max_members = self.room["max_members"]
+
+        joined, users = await self.presence.join(
+            self.room_code,
+            username,
+            self.channel_name,
+            max_members,
+            replaces=self.username,
         )
 
-    async def start_call_event(self, event):
-        await self.send(
-            text_data=json.dumps(
+        if not joined:
+            await self.send_frame(
                 {
-                    "type": "start_call",
+                    "type": "error",
+                    "message": (
+                        f"Room is full "
+                        f"({max_members} member limit reached)."
+                    ),
+                    "code": "room_full",
                 }
             )
+
+            await self.close()
+            return
+
+        self.username = username
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+        await eventlog.load_debug(self.room_code)
+
+        metrics.WS_FANOUT.observe(len(users))
+        await metrics.group_send(
+            self.channel_layer,
+            self.group_name,
+            {
+                "type": "user_list",
+                "frame": protocol.prepare({"type": "user_list", "users": users}),
+            },
         )
 
-    async def draw_line_event(self, event):
-        print("Broadcasting draw event:", event)
+        # Rejoining clients catch up from their last canvas version. This
+        # worker's buffered segments are written first; those still
+        # buffered by other workers (at most CANVAS_LOG_FLUSH_MS worth) are
+        # only in the next catch-up
+        since = data["since"]
+        if since is not None:
+            await get_stroke_log_writer().flush()
+            sync = await self.get_canvas_since(self.room_code, since)
+            if sync is not None:
+                await self.send_frame(sync)
+
+    @ROUTES.route(messages.DRAW)
+    async def on_draw(self, data):
+        segment = {
+            "from": data["from"],
+            "to": data["to"],
+            "color": data["color"],
+            "size": data["size"],
+        }
+
+        # Persisted server-side in batches, independent of fan-out
+        get_stroke_log_writer().append(self.room_code, segment)
+
+        if self.draw_coalescer is not None:
+            await self.draw_coalescer.add(self.channel_name, segment)
+            return
 
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "draw",
-                    "from": event["from"],
-                    "to": event["to"],
-                    "color": event["color"],
-                    "size": event["size"],
-                }
-            )
+        await metrics.group_send(
+            self.channel_layer,
+            self.group_name,
+            {
+                "type": "draw_line_event",
+                "frame": protocol.prepare({"type": "draw", **segment}),
+            },
         )
 
-    async def chat_message(self, event):
-        await self.send(
-            text_data=json.dumps(
+    @ROUTES.route(messages.ERASE)
+    async def on_erase(self, data):
+        bbox = data["bbox"]
+
+        # Segments drawn before the erase must be in the log, and on
+        # everyone's screen, before it is applied. Segments still buffered
+        # by other workers' writers (at most CANVAS_LOG_FLUSH_MS old) land
+        # after the erase and stay on the canvas until erased again.
+        if self.draw_coalescer is not None:
+            await self.draw_coalescer.flush()
+        await get_stroke_log_writer().flush()
+
+        result = await self.erase_canvas(self.room_code, bbox)
+        if result is None:
+            # Deleted while this connection was open
+            await self.send_error(messages.ROOM_NOT_FOUND)
+            return
+        version, erased = result
+        if not erased:
+            return
+
+        await metrics.group_send(
+            self.channel_layer,
+            self.group_name,
+            {
+                "type": "canvas_erase_event",
+                "frame": protocol.prepare(
+                    {
+                        "type": "erase",
+                        "bbox": list(bbox),
+                        "version": version,
+                        "count": erased,
+                    }
+                ),
+            },
+        )
+
+    @ROUTES.route(messages.CHAT)
+    async def on_chat(self, data):
+        username = self.identity or data["username"]
+        if username is None:
+            await self.send_error(messages.CHAT.missing)
+            return
+
+        await metrics.group_send(
+            self.channel_layer,
+            self.group_name,
+            {
+                "type": "chat_message",
+                "frame": protocol.prepare(
+                    {
+                        "type": "chat",
+                        "username": username,
+                        "text": data["text"],
+                    }
+                ),
+            },
+        )
+
+    @ROUTES.route(*messages.SIGNALS)
+    async def on_signal(self, data):
+        msg_type = data["type"]
+        target = data["target"]
+        sender = self.identity or data["sender"]
+        if sender is None:
+            await self.send_error(ROUTES[msg_type][1].missing)
+            return
+
+        if msg_type == "webrtc_candidate" and self.candidates is not None:
+            await self.candidates.add(sender, target, data["payload"])
+            return
+
+        event = {
+            "type": "webrtc_signal",
+            "target": target,
+            "frame": protocol.prepare(
                 {
-                    "type": "chat",
-                    "username": event["username"],
-                    "text": event["text"],
+                    "type": msg_type,
+                    "payload": data["payload"],
+                    "sender": sender,
+                    "target": target,
                 }
-            )
-        )
+            ),
+        }
+
+        await self.send_signal(target, event)
+
+    # =============================================================
+    # GROUP EVENT HANDLERS
+    # =============================================================
+    # Senders encode each frame once (protocol.prepare) and put it in the
+    # event, so handlers only forward the copy for this connection. Other
+    # forms of it are derived here, once per process, when a connection
+    # needs them.
+
+    async def send_prepared(self, prepared, droppable=False):
+        self.outbound.put(prepared, droppable)
+
+    async def user_list(self, event):
+        await self.send_prepared(event["frame"])
+
+    async def start_call_event(self, event):
+        await self.send_prepared(START_CALL_FRAME)
+
+    async def draw_line_event(self, event):
+        eventlog.broadcast(self.room_code, event["frame"]["text"])
+        await self.send_prepared(event["frame"], droppable=True)
+
+    async def draw_batch_event(self, event):
+        eventlog.broadcast(self.room_code, event["frame"]["text"])
+
+        if self.supports_draw_batch:
+            await self.send_prepared(event["frame"], droppable=True)
+            return
+
+        # Legacy clients get one "draw" frame per segment of each polyline
+        for frame in coalescing.legacy_frames(event["frame"]["text"]):
+            await self.send_prepared(frame, droppable=True)
+
+    async def canvas_erase_event(self, event):
+        eventlog.broadcast(self.room_code, event["frame"]["text"])
+        await self.send_prepared(event["frame"])
+
+    async def log_control(self, event):
+        eventlog.set_debug(self.room_code, event["ttl"])
+
+    async def chat_message(self, event):
+        await self.send_prepared(event["frame"])
 
     async def webrtc_signal(self, event):
         """
@@ -336,13 +653,16 @@ class RoomConsumer(AsyncWebsocketConsumer):
         if target and target != self.username:
             return
 
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": event["signal_type"],
-                    "payload": event["payload"],
-                    "sender": event["sender"],
-                    "target": target,
-                }
-            )
-        )
\ No newline at end of file
+        await self.send_prepared(event["frame"])
+
+    async def webrtc_candidates_event(self, event):
+        target = event.get("target")
+        if target and target != self.username:
+            return
+
+        if self.supports_candidate_batch:
+            await self.send_prepared(event["frame"])
+            return
+
+        for frame in signaling.legacy_frames(event["frame"]["text"]):
+            await self.send_prepared(frame)
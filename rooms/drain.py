@@ -0,0 +1,69 @@
+"""
+Graceful drain of a worker's room connections before it exits.
+
+Every accepted RoomConsumer is registered here. ``drain`` asks each one
+to reconnect after a random delay of up to WS_RECONNECT_JITTER_MS, so the
+clients of a stopping worker spread over the others (or the restarted
+one) instead of arriving at once, closes them with 4012 (service restart)
+and waits for their disconnect handlers. Then it writes out whatever this
+worker still buffers: coalesced draw batches, the stroke log and room
+activity. Room membership already lives in the presence backend, which
+the disconnect handlers update.
+"""
+
+import asyncio
+import random
+import time
+
+from django.conf import settings
+
+from whiteboard_backend import metrics
+
+from . import coalescing, lifecycle
+from .canvas import get_stroke_log_writer
+
+_consumers = set()
+
+# Set once a drain starts; new connections are turned away
+draining = False
+
+
+def register(consumer):
+    _consumers.add(consumer)
+
+
+def unregister(consumer):
+    _consumers.discard(consumer)
+
+
+async def _hint(consumer, jitter_ms):
+    try:
+        await consumer.reconnect(random.randint(0, jitter_ms))
+    except Exception:
+        # Already closing; its disconnect handler still runs
+        pass
+
+
+async def drain(timeout):
+    """
+    Close this worker's room connections and flush their buffered state.
+    Returns the number of connections that were still open at the end.
+    """
+    global draining
+    draining = True
+    deadline = time.monotonic() + timeout
+
+    consumers = list(_consumers)
+    metrics.WS_CONNECTIONS.inc(len(consumers), event="drained")
+    await asyncio.gather(
+        *(_hint(consumer, settings.WS_RECONNECT_JITTER_MS) for consumer in consumers)
+    )
+
+    while _consumers and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    # Rooms whose connections did not disconnect in time
+    await coalescing.flush_all()
+    await get_stroke_log_writer().flush()
+    await lifecycle.get_activity_tracker().flush()
+    return len(_consumers)
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+logger = logging.getLogger("rooms.consumers")
+
+# Rooms whose frames are all logged with full payloads instead of
+# sampled summaries, mapped to when that ends (time.monotonic()). The
+# toggle lives in Redis for WS_DEBUG_LOG_TTL seconds: workers serving the
+# room hear about it through the "log_control" group event, the others
+# read it when a connection joins the room.
+DEBUG_ROOMS: dict[str, float] = {}
+DEBUG_KEY = "wsdebug:{}"
+
+# Rooms whose stored toggle was read recently, mapped to when to read it
+# again. Workers already serving a room get toggles through "log_control",
+# so only their first joins need to look, not every one.
+LOAD_DEBUG_TTL = 5
+LOAD_DEBUG_SIZE = 4096
+_loaded: dict[str, float] = {}
+
+_redis = None
+_redis_loop = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: level, logger, message and every field
+    passed through ``extra={"ws": {...}}``.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "ws", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hands records to a queue drained by a listener thread, so formatting
+    and stdout I/O never run on the event loop.
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        target = logging.StreamHandler()
+        target.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, target)
+        self.listener.start()
+
+    def prepare(self, record):
+        # Formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # never block the event loop on logging
+
+    def close(self):
+        self.listener.stop()
+        super().close()
+
+
+def _sampled(msg_type):
+    rates = settings.WS_LOG_SAMPLING
+    default = rates.get("default", 1.0)
+    rate = rates.get(msg_type, default) if isinstance(msg_type, str) else default
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def _debugging(room_code):
+    until = DEBUG_ROOMS.get(room_code)
+    if until is None:
+        return False
+    if until <= time.monotonic():
+        del DEBUG_ROOMS[room_code]
+        return False
+    return True
+
+
+def received(room_code, msg_type, data):
+    """
+    Log one inbound frame: the whole payload for rooms in DEBUG_ROOMS,
+    otherwise a sampled summary. Nothing is built when it is filtered out.
+    """
+    if _debugging(room_code):
+        logger.info(
+            "ws.receive",
+            extra={"ws": {"room": room_code, "type": msg_type, "data": data}},
+        )
+    elif logger.isEnabledFor(logging.INFO) and _sampled(msg_type):
+        logger.info(
+            "ws.receive",
+            extra={"ws": {"room": room_code, "type": msg_type}},
+        )
+
+
+def broadcast(room_code, frame):
+    if _debugging(room_code):
+        logger.info(
+            "ws.broadcast",
+            extra={"ws": {"room": room_code, "frame": frame}},
+        )
+
+
+def set_debug(room_code, ttl):
+    """
+    Log the room's full payloads in this process for ``ttl`` seconds;
+    0 turns it off.
+    """
+    if ttl > 0:
+        DEBUG_ROOMS[room_code] = time.monotonic() + ttl
+    else:
+        DEBUG_ROOMS.pop(room_code, None)
+
+
+def _redis_url():
+    hosts = settings.CHANNEL_LAYERS["default"].get("CONFIG", {}).get("hosts", ())
+    hosts = [host for host in hosts if isinstance(host, str)]
+    return hosts[0] if hosts else None
+
+
+def store_debug(room_code, ttl):
+    """
+    Keep the toggle in Redis for ``ttl`` seconds (0 removes it), for
+    workers that only get a connection to the room later.
+    """
+    url = _redis_url()
+    if url is None:
+        return
+
+    import redis
+
+    with redis.Redis.from_url(url) as client:
+        if ttl > 0:
+            client.set(DEBUG_KEY.format(room_code), 1, ex=ttl)
+        else:
+            client.delete(DEBUG_KEY.format(room_code))
+
+
+async def load_debug(room_code):
+    """
+    Apply the toggle stored by ``store_debug`` in this process. Called
+    when a connection joins the room, at most once per LOAD_DEBUG_TTL
+    seconds per room; a Redis error only costs the debug logs.
+    """
+    global _redis, _redis_loop
+
+    now = time.monotonic()
+    if _loaded.get(room_code, 0) > now:
+        return
+    if len(_loaded) >= LOAD_DEBUG_SIZE:
+        for code, until in list(_loaded.items()):
+            if until <= now:
+                del _loaded[code]
+    _loaded[room_code] = now + LOAD_DEBUG_TTL
+
+    import redis.asyncio as redis
+
+    loop = asyncio.get_running_loop()
+    if _redis_loop is not loop:
+        url = _redis_url()
+        _redis = redis.Redis.from_url(url) if url else None
+        _redis_loop = loop
+    if _redis is None:
+        return
+
+    try:
+        ttl_ms = await _redis.pttl(DEBUG_KEY.format(room_code))
+    except redis.RedisError:
+        logger.warning("Could not read the debug toggle of room %s", room_code)
+        return
+    set_debug(room_code, ttl_ms / 1000 if ttl_ms > 0 else 0)
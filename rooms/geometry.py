@@ -0,0 +1,41 @@
+"""
+Geometry of canvas records, shared by rasterization (rooms.raster) and
+the spatial index (rooms.spatial).
+"""
+
+import math
+
+
+def shape(record):
+    """
+    ``(ax, ay, bx, by, size, color)`` of a segment or point record, or
+    None for records that draw nothing.
+    """
+    if not isinstance(record, dict):
+        return None
+    try:
+        if "from" in record:
+            a, b = record["from"], record["to"]
+            ax, ay, bx, by = a["x"], a["y"], b["x"], b["y"]
+        else:
+            ax = bx = record["x"]
+            ay = by = record["y"]
+        size = float(record.get("size", 4))
+        ax, ay, bx, by = float(ax), float(ay), float(bx), float(by)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not all(math.isfinite(v) for v in (ax, ay, bx, by, size)):
+        return None
+    return ax, ay, bx, by, size, record.get("color")
+
+
+def record_bounds(record):
+    """
+    ``(x0, y0, x1, y1)`` covered by a record's stroke, or None.
+    """
+    drawn = shape(record)
+    if drawn is None:
+        return None
+    ax, ay, bx, by, size, _ = drawn
+    r = size / 2
+    return (min(ax, bx) - r, min(ay, by) - r, max(ax, bx) + r, max(ay, by) + r)
@@ -0,0 +1,268 @@
+"""
+Room lifecycle: activity tracking, canvas archival and room expiry.
+
+Rooms idle for ``ROOM_ARCHIVE_AFTER_DAYS`` have their canvas written to a
+gzipped JSON file under ``ROOM_ARCHIVE_DIR`` and removed from the
+CanvasState/StrokeLog tables; ``CanvasState.for_room`` restores it the
+next time anyone needs it. Rooms idle for ``ROOM_EXPIRE_AFTER_DAYS`` are
+deleted together with their archive.
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import timedelta
+from functools import partial
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .timers import FlushTimer
+
+logger = logging.getLogger("rooms.lifecycle")
+
+
+class ActivityTracker:
+    """
+    Remembers which rooms saw traffic and writes their ``last_activity_at``
+    with one UPDATE per flush interval, instead of one per message.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._rooms: set[str] = set()
+        self._timer = FlushTimer(interval, self.flush)
+
+    def touch(self, room_code):
+        self._rooms.add(room_code)
+        self._timer.schedule()
+
+    async def flush(self):
+        self._timer.cancel()
+
+        if not self._rooms:
+            return
+
+        rooms = self._rooms
+        self._rooms = set()
+        await self._write(rooms)
+
+    @database_sync_to_async
+    def _write(self, rooms):
+        from .models import Room
+
+        Room.objects.filter(code__in=rooms).update(last_activity_at=timezone.now())
+
+
+_tracker = None
+
+
+def get_activity_tracker():
+    global _tracker
+    if _tracker is None:
+        _tracker = ActivityTracker(settings.ROOM_ACTIVITY_FLUSH_SECONDS)
+    return _tracker
+
+
+# =============================================================
+# COLD STORAGE
+# =============================================================
+
+
+class ArchiveMissing(Exception):
+    """
+    A room is marked as archived but its archive file is not there.
+    """
+
+
+def archive_path(room_id):
+    return os.path.join(settings.ROOM_ARCHIVE_DIR, f"{room_id}.json.gz")
+
+
+def archive_room(room_id):
+    """
+    Move one room's canvas to cold storage. Returns False if it was
+    archived already (e.g. by another worker) or has no canvas.
+    """
+    from .models import CanvasState, Room, StrokeLog
+
+    with transaction.atomic():
+        room = (
+            Room.objects.select_for_update()
+            .filter(pk=room_id, canvas_archived_at__isnull=True)
+            .first()
+        )
+        state = (
+            CanvasState.objects.select_for_update().filter(room_id=room_id).first()
+        )
+        if room is None or state is None:
+            return False
+
+        os.makedirs(settings.ROOM_ARCHIVE_DIR, exist_ok=True)
+        path = archive_path(room_id)
+        with gzip.open(f"{path}.tmp", "wt") as fh:
+            json.dump({"version": state.version, "data": state.load_data()}, fh)
+        os.replace(f"{path}.tmp", path)
+
+        StrokeLog.objects.filter(room_id=room_id).delete()
+        state.delete()
+        Room.objects.filter(pk=room_id).update(canvas_archived_at=timezone.now())
+    return True
+
+
+def restore_canvas(state):
+    """
+    Fill a freshly created CanvasState from the room's archive, if the
+    room has one. Runs inside CanvasState.for_room.
+
+    Raises ArchiveMissing when the file cannot be read; the room stays
+    marked as archived, so its canvas is restored once the file is back
+    instead of being replaced by an empty one.
+    """
+    from .models import Room, encode_snapshot
+
+    rooms = Room.objects.filter(pk=state.room_id, canvas_archived_at__isnull=False)
+    if not rooms.exists():
+        return
+
+    path = archive_path(state.room_id)
+    try:
+        with gzip.open(path, "rt") as fh:
+            archive = json.load(fh)
+    except FileNotFoundError:
+        raise ArchiveMissing(f"Archived canvas of room {state.room_id} is missing")
+
+    with transaction.atomic():
+        if not rooms.update(canvas_archived_at=None):
+            return
+
+        # Continue the version sequence so clients holding an old version
+        # get a full canvas instead of a bogus diff
+        state.version = state.snapshot_version = archive["version"] + 1
+        state.snapshot = encode_snapshot(archive["data"])
+        state.save()
+        transaction.on_commit(lambda: _remove(path))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# =============================================================
+# SWEEPS
+# =============================================================
+
+
+def _batches(queryset, batch_size):
+    """
+    Yield the matching ids in ascending batches, paging by id so rows left
+    in place (e.g. skipped by archive_room) are not read again.
+    """
+    last_id = 0
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last_id)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return
+        last_id = ids[-1]
+        yield ids
+
+
+def archive_idle_rooms(idle_for, batch_size=500):
+    """
+    Archive the canvas of every room idle for longer than ``idle_for``.
+    Returns the number of canvases archived.
+    """
+    from .models import Room
+
+    idle = Room.objects.filter(
+        last_activity_at__lt=timezone.now() - idle_for,
+        canvas_archived_at__isnull=True,
+        canvas_state__isnull=False,
+    )
+
+    archived = 0
+    for ids in _batches(idle, batch_size):
+        archived += sum(archive_room(room_id) for room_id in ids)
+    return archived
+
+
+def delete_expired_rooms(expire_after, batch_size=500):
+    """
+    Delete rooms idle for longer than ``expire_after`` in batches of
+    ``batch_size``, archive files included. Returns the number of rooms.
+    """
+    from .models import Room
+
+    expired = Room.objects.filter(
+        last_activity_at__lt=timezone.now() - expire_after
+    )
+
+    deleted = 0
+    for ids in _batches(expired, batch_size):
+        with transaction.atomic():
+            archived = Room.objects.filter(
+                pk__in=ids, canvas_archived_at__isnull=False
+            ).values_list("pk", flat=True)
+            # Files only go once the rows are gone for good
+            for room_id in archived:
+                transaction.on_commit(partial(_remove, archive_path(room_id)))
+            Room.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+    return deleted
+
+
+def sweep(batch_size=500):
+    """
+    One lifecycle pass with the configured ages. Returns
+    ``(archived, deleted)``.
+    """
+    # Expired rooms go first so their canvases are not archived in vain
+    archived = deleted = 0
+    if settings.ROOM_EXPIRE_AFTER_DAYS:
+        deleted = delete_expired_rooms(
+            timedelta(days=settings.ROOM_EXPIRE_AFTER_DAYS), batch_size
+        )
+    if settings.ROOM_ARCHIVE_AFTER_DAYS:
+        archived = archive_idle_rooms(
+            timedelta(days=settings.ROOM_ARCHIVE_AFTER_DAYS), batch_size
+        )
+    return archived, deleted
+
+
+_sweeper = None
+
+
+def start_sweeper():
+    """
+    Run ``sweep`` every ``ROOM_LIFECYCLE_INTERVAL`` seconds on this
+    worker's event loop. Disabled (0) by default in favour of
+    ``manage.py room_lifecycle`` from cron.
+    """
+    global _sweeper
+    if _sweeper is None and settings.ROOM_LIFECYCLE_INTERVAL > 0:
+        _sweeper = asyncio.ensure_future(_sweep_forever())
+
+
+async def _sweep_forever():
+    while True:
+        await asyncio.sleep(settings.ROOM_LIFECYCLE_INTERVAL)
+        try:
+            archived, deleted = await database_sync_to_async(sweep)()
+            if archived or deleted:
+                logger.info(
+                    "room lifecycle sweep",
+                    extra={"ws": {"archived": archived, "deleted": deleted}},
+                )
+        except Exception:
+            logger.exception("room lifecycle sweep failed")
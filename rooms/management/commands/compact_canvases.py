@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from rooms.models import CanvasState, StrokeLog
+
+
+class Command(BaseCommand):
+    help = "Fold pending stroke log rows into each room's canvas snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-rows",
+            type=int,
+            default=1,
+            help="Only compact rooms with at least this many log rows.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep running, compacting every INTERVAL seconds.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.compact_once(options["min_rows"])
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
+
+    def compact_once(self, min_rows):
+        room_ids = (
+            StrokeLog.objects.values("room_id")
+            .annotate(rows=Count("id"))
+            .filter(rows__gte=min_rows)
+            .values_list("room_id", flat=True)
+        )
+
+        folded = 0
+        for room_id in room_ids:
+            state = CanvasState.for_room(room_id)
+            folded += state.compact()
+
+        self.stdout.write(f"Compacted {len(room_ids)} rooms ({folded} log rows)")
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from whiteboard_backend.release import LockTimeout, migration_lock, pending_migrations
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply database migrations once per deploy, under a lock shared by "
+        "every replica. Run it before starting the servers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only list pending migrations; exit with status 1 if any.",
+        )
+        parser.add_argument(
+            "--lock-timeout",
+            type=float,
+            default=settings.RELEASE_LOCK_TIMEOUT,
+            help="Seconds to wait for another release to finish.",
+        )
+
+    def handle(self, *args, **options):
+        pending = pending_migrations()
+        if options["check"]:
+            for name in pending:
+                self.stdout.write(name)
+            if pending:
+                raise CommandError(f"{len(pending)} migrations pending")
+            return
+
+        # Replicas starting together mostly find the work already done
+        if not pending:
+            if options["verbosity"]:
+                self.stdout.write("No migrations to apply.")
+            return
+
+        try:
+            with migration_lock(options["lock_timeout"]) as lock:
+                if options["verbosity"]:
+                    self.stdout.write(f"Migrating under {lock or 'no'} lock.")
+                call_command(
+                    "migrate", interactive=False, verbosity=options["verbosity"]
+                )
+        except LockTimeout as e:
+            raise CommandError(f"Timed out waiting for the {e}")
@@ -0,0 +1,83 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rooms.lifecycle import ArchiveMissing, archive_idle_rooms, delete_expired_rooms
+from rooms.models import CanvasState, Room
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive the canvases of idle rooms to disk and delete expired "
+        "rooms, or restore one archived canvas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--archive-after",
+            type=int,
+            default=settings.ROOM_ARCHIVE_AFTER_DAYS,
+            help="Archive canvases of rooms idle for this many days (0: off).",
+        )
+        parser.add_argument(
+            "--expire-after",
+            type=int,
+            default=settings.ROOM_EXPIRE_AFTER_DAYS,
+            help="Delete rooms idle for this many days (0: off).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rooms handled per query.",
+        )
+        parser.add_argument(
+            "--restore",
+            metavar="CODE",
+            help="Restore the archived canvas of this room and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep running, sweeping every INTERVAL seconds.",
+        )
+
+    def handle(self, *args, **options):
+        if options["restore"]:
+            self.restore(options["restore"])
+            return
+
+        while True:
+            self.sweep_once(options)
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
+
+    def sweep_once(self, options):
+        archived = deleted = 0
+        if options["expire_after"]:
+            deleted = delete_expired_rooms(
+                timedelta(days=options["expire_after"]), options["batch_size"]
+            )
+        if options["archive_after"]:
+            archived = archive_idle_rooms(
+                timedelta(days=options["archive_after"]), options["batch_size"]
+            )
+        self.stdout.write(f"Archived {archived} canvases, deleted {deleted} rooms")
+
+    def restore(self, code):
+        room = Room.objects.filter(code=code).first()
+        if room is None:
+            raise CommandError(f"Room {code} does not exist")
+        if room.canvas_archived_at is None:
+            self.stdout.write(f"Room {code} is not archived")
+            return
+
+        try:
+            state = CanvasState.for_room(room.pk)
+        except ArchiveMissing as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(f"Restored room {code} at version {state.version}")
@@ -0,0 +1,237 @@
+"""
+Inbound room WebSocket messages: a schema per message type, the routing
+table from type to consumer handler, and the static error frames sent
+back, encoded once at import.
+
+A new message type is a Schema here plus a handler on RoomConsumer
+registered with ``@ROUTES.route(schema)``.
+"""
+
+import re
+
+from . import protocol
+from .spatial import parse_bbox
+
+MAX_COORDINATE = 2**31
+MAX_SIZE = 512
+MAX_USERNAME = 150
+MAX_CHAT = 4000
+MAX_FEATURES = 16
+
+_NUMBERS = (int, float)
+_ARRAYS = (list, tuple)
+_color = re.compile(
+    r"#(?:[0-9a-fA-F]{3}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})|[a-z]{3,20}"
+).fullmatch
+
+
+class ErrorFrame:
+    __slots__ = ("code", "prepared")
+
+    def __init__(self, code, message):
+        self.code = code
+        self.prepared = protocol.prepare(
+            {"type": "error", "message": message, "code": code}
+        )
+
+
+INVALID_JSON = ErrorFrame("bad_json", "Invalid JSON format. Expected a JSON object.")
+INVALID_MSGPACK = ErrorFrame(
+    "bad_msgpack", "Invalid MessagePack frame. Expected a map."
+)
+NOT_AN_OBJECT = ErrorFrame("bad_request", "Expected a JSON object.")
+MISSING_TYPE = ErrorFrame("bad_request", "Message type is required")
+UNKNOWN_TYPE = ErrorFrame("unknown_type", "Unknown message type")
+SERVER_ERROR = ErrorFrame("server_error", "Server error")
+ROOM_NOT_FOUND = ErrorFrame("not_found", "This room no longer exists")
+
+
+# =============================================================
+# FIELD CHECKS
+# =============================================================
+# Each check returns the value to use and raises ValueError, TypeError or
+# KeyError when it is not acceptable. Exact type() tests keep bools out
+# of numbers and reject subclasses cheaply.
+
+
+def coordinate(value):
+    if type(value) not in _NUMBERS or not -MAX_COORDINATE <= value <= MAX_COORDINATE:
+        raise ValueError(value)
+    return value
+
+
+def point(value):
+    """
+    ``{"x": .., "y": ..}``, also accepted as an ``[x, y]`` array (the
+    shape binary clients send).
+    """
+    if type(value) is dict:
+        if len(value) != 2:
+            raise ValueError(value)
+        coordinate(value["x"])
+        coordinate(value["y"])
+        return value
+    if type(value) in _ARRAYS and len(value) == 2:
+        return {"x": coordinate(value[0]), "y": coordinate(value[1])}
+    raise ValueError(value)
+
+
+def color(value):
+    if type(value) is not str or len(value) > 20 or not _color(value):
+        raise ValueError(value)
+    return value
+
+
+def size(value):
+    if type(value) not in _NUMBERS or not 0 < value <= MAX_SIZE:
+        raise ValueError(value)
+    return value
+
+
+def username(value):
+    if type(value) is not str or not 0 < len(value) <= MAX_USERNAME:
+        raise ValueError(value)
+    return value
+
+
+def chat_text(value):
+    if type(value) is not str or len(value) > MAX_CHAT:
+        raise ValueError(value)
+    return value
+
+
+def features(value):
+    if type(value) not in _ARRAYS or len(value) > MAX_FEATURES:
+        raise ValueError(value)
+    for feature in value:
+        if type(feature) is not str:
+            raise ValueError(value)
+    return value
+
+
+def version(value):
+    if type(value) is not int:
+        raise ValueError(value)
+    return value
+
+
+def target(value):
+    if type(value) is not str:
+        raise ValueError(value)
+    return value
+
+
+def bbox(value):
+    return parse_bbox(value)
+
+
+def anything(value):
+    return value
+
+
+# =============================================================
+# SCHEMAS
+# =============================================================
+
+
+class Schema:
+    """
+    Required and optional fields of one message type. Optional fields
+    that are missing or null get their default.
+    """
+
+    __slots__ = ("type", "required", "optional", "missing", "invalid")
+
+    def __init__(self, type, required, optional=None, missing=None):
+        optional = optional or {}
+        self.type = type
+        self.required = tuple(required.items())
+        self.optional = tuple(
+            (field, check, default) for field, (check, default) in optional.items()
+        )
+        self.missing = ErrorFrame(
+            "bad_request",
+            missing or f"Missing required fields for {type}: {list(required)}",
+        )
+        self.invalid = {
+            field: ErrorFrame("invalid_field", f"Invalid {field} for {type}")
+            for field in (*required, *optional)
+        }
+
+    def validate(self, data):
+        """
+        Check ``data`` and normalize it in place. Returns the ErrorFrame
+        to answer with, or None when the message is valid.
+        """
+        for field, check in self.required:
+            if field not in data:
+                return self.missing
+            try:
+                data[field] = check(data[field])
+            except (KeyError, TypeError, ValueError):
+                return self.invalid[field]
+
+        for field, check, default in self.optional:
+            value = data.get(field)
+            if value is None:
+                data[field] = default
+                continue
+            try:
+                data[field] = check(value)
+            except (KeyError, TypeError, ValueError):
+                return self.invalid[field]
+        return None
+
+
+# Authenticated connections are named by their token; "username" and
+# "sender" only matter to anonymous ones, so the handlers check for them.
+JOIN = Schema(
+    "join",
+    {},
+    {
+        "username": (username, None),
+        "features": (features, ()),
+        "since": (version, None),
+    },
+    missing="Username is required for join",
+)
+DRAW = Schema(
+    "draw",
+    {"from": point, "to": point},
+    {"color": (color, "#000000"), "size": (size, 4)},
+)
+ERASE = Schema("erase", {"bbox": bbox})
+CHAT = Schema(
+    "chat",
+    {"text": chat_text},
+    {"username": (username, None)},
+    missing="Chat messages require text and username",
+)
+SIGNALS = [
+    Schema(
+        signal,
+        {"payload": anything},
+        {"sender": (username, None), "target": (target, None)},
+        missing=f"Missing required fields for {signal}",
+    )
+    for signal in ("webrtc_offer", "webrtc_answer", "webrtc_candidate")
+]
+
+
+# =============================================================
+# ROUTING
+# =============================================================
+
+
+class Routes(dict):
+    """
+    Message type -> ``(handler, schema)``.
+    """
+
+    def route(self, *schemas):
+        def register(handler):
+            for schema in schemas:
+                self[schema.type] = (handler, schema)
+            return handler
+
+        return register
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rooms", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="room",
+            name="max_members",
+            field=models.PositiveIntegerField(default=10),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:28
+
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def data_to_snapshot(apps, schema_editor):
+    CanvasState = apps.get_model("rooms", "CanvasState")
+    for state in CanvasState.objects.iterator():
+        state.snapshot = zlib.compress(
+            json.dumps(state.data, separators=(",", ":")).encode()
+        )
+        state.save(update_fields=["snapshot"])
+
+
+def snapshot_to_data(apps, schema_editor):
+    CanvasState = apps.get_model("rooms", "CanvasState")
+    for state in CanvasState.objects.iterator():
+        state.data = (
+            json.loads(zlib.decompress(state.snapshot)) if state.snapshot else []
+        )
+        state.save(update_fields=["data"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rooms", "0002_room_max_members"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="canvasstate",
+            name="snapshot",
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.RunPython(data_to_snapshot, snapshot_to_data),
+        migrations.RemoveField(
+            model_name="canvasstate",
+            name="data",
+        ),
+        migrations.CreateModel(
+            name="StrokeLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("segments", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stroke_log",
+                        to="rooms.room",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["room", "id"], name="rooms_strok_room_id_bf8859_idx"
+                    )
+                ],
+            },
+        ),
+    ]
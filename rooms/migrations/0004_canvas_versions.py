@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+def number_log_rows(apps, schema_editor):
+    CanvasState = apps.get_model("rooms", "CanvasState")
+    StrokeLog = apps.get_model("rooms", "StrokeLog")
+
+    room_ids = StrokeLog.objects.values_list("room_id", flat=True).distinct()
+    for room_id in room_ids:
+        version = 0
+        for row in StrokeLog.objects.filter(room_id=room_id).order_by("id"):
+            version += 1
+            row.version = version
+            row.save(update_fields=["version"])
+        CanvasState.objects.update_or_create(
+            room_id=room_id, defaults={"version": version}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rooms", "0003_canvas_stroke_log"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="strokelog",
+            name="rooms_strok_room_id_bf8859_idx",
+        ),
+        migrations.AddField(
+            model_name="canvasstate",
+            name="snapshot_version",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="canvasstate",
+            name="version",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="strokelog",
+            name="version",
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_log_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="strokelog",
+            constraint=models.UniqueConstraint(
+                fields=("room", "version"), name="unique_stroke_log_version"
+            ),
+        ),
+    ]
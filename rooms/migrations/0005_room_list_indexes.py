@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rooms", "0004_canvas_versions"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(fields=["-created_at", "-id"], name="room_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(
+                fields=["created_by", "-created_at", "-id"],
+                name="room_owner_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(
+                fields=["is_private", "-created_at", "-id"],
+                name="room_private_created_idx",
+            ),
+        ),
+    ]
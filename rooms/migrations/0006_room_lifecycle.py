@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:42
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def activity_from_created_at(apps, schema_editor):
+    Room = apps.get_model("rooms", "Room")
+    Room.objects.update(last_activity_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rooms", "0005_room_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="room",
+            name="canvas_archived_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="room",
+            name="last_activity_at",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now
+            ),
+        ),
+        migrations.RunPython(activity_from_created_at, migrations.RunPython.noop),
+    ]
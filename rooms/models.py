@@ -1,7 +1,11 @@
-import uuid, secrets
-from django.db import models
+import json, uuid, secrets, zlib
+from itertools import chain
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import timezone
+
+from . import canvas_codec
 
 
 def generate_room_code():
@@ -12,6 +16,32 @@ def generate_password():
     return secrets.token_urlsafe(6)  # ~8 chars
 
 
+def encode_snapshot(data):
+    return canvas_codec.encode(data, compression=settings.CANVAS_COMPRESSION)
+
+
+def iter_snapshot(blob):
+    if not blob:
+        return iter(())
+    if canvas_codec.is_encoded(blob):
+        return canvas_codec.iter_decode(blob)
+    # Snapshots written before the columnar format: zlib-compressed JSON
+    return iter(json.loads(zlib.decompress(blob)))
+
+
+def decode_snapshot(blob):
+    return list(iter_snapshot(blob))
+
+
+def is_erase(record):
+    """
+    Erase operations sit in the stroke log as ``{"erase": [ids]}``, where
+    the ids are positions of earlier records on the canvas. Compaction
+    drops both the operation and the records it erased.
+    """
+    return isinstance(record, dict) and record.keys() == {"erase"}
+
+
 class Room(models.Model):
     code = models.CharField(max_length=10, unique=True, default=generate_room_code)
     name = models.CharField(max_length=100)
@@ -20,6 +50,33 @@ class Room(models.Model):
     password = models.CharField(max_length=64, blank=True, null=True)
     max_members = models.PositiveIntegerField(default=10)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped in batches by rooms.lifecycle.ActivityTracker
+    last_activity_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # Set while the canvas lives in the cold storage archive
+    canvas_archived_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # Keyset pagination of the room list (rooms.pagination), plain and
+        # filtered by owner or visibility
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="room_created_idx"),
+            models.Index(
+                fields=["created_by", "-created_at", "-id"],
+                name="room_owner_created_idx",
+            ),
+            models.Index(
+                fields=["is_private", "-created_at", "-id"],
+                name="room_private_created_idx",
+            ),
+            # The list's name prefix filter (LIKE 'abc%'); the operator
+            # class lets PostgreSQL use it under any collation, other
+            # databases ignore it
+            models.Index(
+                fields=["name"],
+                name="room_name_prefix_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if self.is_private and not self.password:
@@ -33,8 +90,200 @@ class Room(models.Model):
 
 
 class CanvasState(models.Model):
+    """
+    Compacted canvas of a room. The full canvas is the decoded snapshot
+    followed by every StrokeLog row of the room not yet folded into it.
+
+    ``version`` grows by one for every log row appended (and on every full
+    replace), so clients can ask for the operations after a version.
+    """
+
     room = models.OneToOneField(
         Room, on_delete=models.CASCADE, related_name="canvas_state"
     )
-    data = models.JSONField(default=list)  # list of { x, y, color, size }
+    # List of draw segments / points in the rooms.canvas_codec format
+    # (zlib-compressed JSON in rows not rewritten since)
+    snapshot = models.BinaryField(default=bytes)
+    snapshot_version = models.BigIntegerField(default=0)
+    version = models.BigIntegerField(default=0)
     updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def etag(self):
+        return f'"{self.room_id}-{self.version}"'
+
+    @classmethod
+    def for_room(cls, room_id, lock=False):
+        """
+        Return the room's state row, creating it if needed. A room whose
+        canvas was archived gets it restored from cold storage first;
+        when that fails (rooms.lifecycle.ArchiveMissing) no row is created.
+        """
+        from .lifecycle import restore_canvas
+
+        objects = cls.objects.select_for_update() if lock else cls.objects
+        with transaction.atomic():
+            state, created = objects.get_or_create(room_id=room_id)
+            if created:
+                restore_canvas(state)
+        return state
+
+    @classmethod
+    def append(cls, room_id, segments):
+        """
+        Append one batch of segments to the room's log and return the new
+        canvas version. The state row lock keeps versions gap-free and in
+        commit order per room.
+        """
+        with transaction.atomic():
+            state = cls.for_room(room_id, lock=True)
+            state.version += 1
+            state.save(update_fields=["version", "updated_at"])
+            StrokeLog.objects.create(
+                room_id=room_id, version=state.version, segments=segments
+            )
+        return state.version
+
+    @classmethod
+    def erase(cls, room_id, bbox):
+        """
+        Erase every record touching ``bbox`` and return ``(version,
+        count)``; the version is unchanged when nothing was hit.
+        """
+        from .spatial import get_spatial_index
+
+        # Build the index before taking the row lock, so drawing in the
+        # room is not held up by it; under the lock the index only catches
+        # up on rows appended in between (or is rebuilt after a compaction)
+        index = get_spatial_index()
+        index.warm(cls.for_room(room_id))
+        with transaction.atomic():
+            # Positions only shift on compaction, which takes this lock too
+            state = cls.for_room(room_id, lock=True)
+            hits = index.hit(state, bbox)
+            if not hits:
+                return state.version, 0
+            state.version += 1
+            state.save(update_fields=["version", "updated_at"])
+            StrokeLog.objects.create(
+                room_id=room_id, version=state.version, segments=[{"erase": hits}]
+            )
+        return state.version, len(hits)
+
+    def _tail(self, since):
+        return (
+            StrokeLog.objects.filter(room_id=self.room_id, version__gt=since)
+            .order_by("version")
+            .values_list("segments", flat=True)
+            .iterator()
+        )
+
+    def iter_records(self):
+        """
+        Yield every record since the snapshot, erase operations and the
+        records they erased included, so positions stay stable until the
+        next compaction.
+        """
+        yield from iter_snapshot(self.snapshot)
+        for segments in self._tail(self.snapshot_version):
+            yield from segments
+
+    def iter_data(self):
+        """
+        Yield the canvas record by record, for streaming large boards.
+        """
+        # The log tail is small (compaction folds it), so erased positions
+        # are collected from it before the snapshot is streamed.
+        tail = [
+            record
+            for segments in self._tail(self.snapshot_version)
+            for record in segments
+        ]
+        erased = {i for record in tail if is_erase(record) for i in record["erase"]}
+        if not erased:
+            yield from iter_snapshot(self.snapshot)
+            yield from tail
+            return
+
+        position = 0
+        for record in chain(iter_snapshot(self.snapshot), tail):
+            if position not in erased and not is_erase(record):
+                yield record
+            position += 1
+
+    def load_data(self):
+        return list(self.iter_data())
+
+    def ops_since(self, version):
+        """
+        Return ``(full, data)``: only the operations after ``version`` when
+        the log still holds them, otherwise the whole canvas.
+        """
+        if version < self.snapshot_version or version > self.version:
+            return True, self.load_data()
+
+        data = []
+        for segments in self._tail(version):
+            data.extend(segments)
+        # Clients replay operations as drawing; an erase needs a redraw
+        if any(is_erase(record) for record in data):
+            return True, self.load_data()
+        return False, data
+
+    def replace_data(self, data):
+        with transaction.atomic():
+            state = CanvasState.objects.select_for_update().get(pk=self.pk)
+            StrokeLog.objects.filter(room_id=self.room_id).delete()
+            state.version += 1
+            state.snapshot_version = state.version
+            state.snapshot = encode_snapshot(data)
+            state.save()
+
+        self.snapshot = state.snapshot
+        self.version = self.snapshot_version = state.version
+        self.updated_at = state.updated_at
+
+    def compact(self):
+        """
+        Fold the pending stroke log into the snapshot.
+        """
+        with transaction.atomic():
+            state = CanvasState.objects.select_for_update().get(pk=self.pk)
+            folded = StrokeLog.objects.filter(
+                room_id=self.room_id, version__gt=state.snapshot_version
+            ).count()
+            if not folded:
+                return 0
+
+            data = list(state.iter_data())
+
+            StrokeLog.objects.filter(
+                room_id=self.room_id, version__lte=state.version
+            ).delete()
+            state.snapshot = encode_snapshot(data)
+            state.snapshot_version = state.version
+            state.save(update_fields=["snapshot", "snapshot_version"])
+
+        self.snapshot = state.snapshot
+        self.snapshot_version = state.snapshot_version
+        return folded
+
+
+class StrokeLog(models.Model):
+    """
+    Append-only batch of draw segments received over the room WebSocket.
+    """
+
+    room = models.ForeignKey(
+        Room, on_delete=models.CASCADE, related_name="stroke_log"
+    )
+    version = models.BigIntegerField()
+    segments = models.JSONField()  # list of { from, to, color, size }
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["room", "version"], name="unique_stroke_log_version"
+            )
+        ]
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import deque
+
+from whiteboard_backend import metrics
+
+from .protocol import prepare
+from .timers import spawn
+
+logger = logging.getLogger("rooms.outbound")
+
+# Overflow policies
+COALESCE = "coalesce"
+DROP = "drop"
+DISCONNECT = "disconnect"
+
+# Sent in place of the draw frames a coalescing queue threw away; the
+# client catches up through GET .../canvas/?since=<version>.
+RESYNC_FRAME = prepare({"type": "canvas_resync", "reason": "slow_consumer"})
+
+# Process-wide counters, aggregated over every connection
+STATS = {"dropped": 0, "coalesced": 0, "disconnected": 0}
+
+_QUEUES = weakref.WeakSet()
+
+
+class OutboundQueue:
+    """
+    Bounded send queue of one WebSocket connection, drained by its own
+    writer task so group handlers never wait on a slow client.
+
+    Items are ``(droppable, prepared, queued_at)`` tuples where ``prepared`` is a
+    ``protocol.prepare`` result. Only droppable (draw) frames are ever
+    dropped or coalesced; chat, signaling and presence frames are always
+    delivered. When the queue is full of frames that may not be dropped,
+    or the policy is ``disconnect``, ``on_overflow`` is called instead.
+    If ``send`` raises, the queue stops and ``on_error`` is called.
+    """
+
+    def __init__(self, send, maxsize, policy, on_overflow, on_error=None):
+        self.send = send
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_overflow = on_overflow
+        self.on_error = on_error
+
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water = 0
+
+        self._items = deque()
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer = None
+        self._closed = False
+        _QUEUES.add(self)
+
+    def __len__(self):
+        return len(self._items)
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        self._closed = True
+        if self._writer is not None:
+            self._writer.cancel()
+
+    def put(self, prepared, droppable=False):
+        if self._closed:
+            return
+
+        if len(self._items) >= self.maxsize and not self._make_room():
+            self._closed = True
+            STATS["disconnected"] += 1
+            spawn(self.on_overflow())
+            return
+
+        self._items.append((droppable, prepared, time.perf_counter()))
+        self.high_water = max(self.high_water, len(self._items))
+        self._idle.clear()
+        self._ready.set()
+
+    def _make_room(self):
+        if self.policy == DISCONNECT:
+            return False
+
+        if self.policy == COALESCE:
+            kept = deque(item for item in self._items if not item[0])
+            removed = len(self._items) - len(kept)
+            if removed:
+                if not kept or kept[-1][1] is not RESYNC_FRAME:
+                    kept.append((False, RESYNC_FRAME, time.perf_counter()))
+                self.coalesced += removed
+                STATS["coalesced"] += removed
+                self._items = kept
+            return len(self._items) < self.maxsize
+
+        # DROP: discard the oldest stale draw frame
+        for index, item in enumerate(self._items):
+            if item[0]:
+                del self._items[index]
+                self.dropped += 1
+                STATS["dropped"] += 1
+                return True
+        return False
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self._items:
+                _, prepared, queued_at = self._items.popleft()
+                try:
+                    await self.send(prepared)
+                except Exception:
+                    logger.exception("Send failed, closing the connection")
+                    self._fail()
+                    return
+                metrics.WS_SEND_SECONDS.observe(time.perf_counter() - queued_at)
+            self._ready.clear()
+            self._idle.set()
+
+    def _fail(self):
+        # Nothing queued can be sent any more; let flush and drain return
+        self._closed = True
+        self._items.clear()
+        self._ready.clear()
+        self._idle.set()
+        if self.on_error is not None:
+            spawn(self.on_error())
+
+    async def flush(self, timeout):
+        """
+        Wait up to ``timeout`` seconds for everything queued to be sent.
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def queue_stats():
+    """
+    Current depth over all live queues plus the lifetime drop counters.
+    """
+    queues = list(_QUEUES)
+    return {
+        "connections": len(queues),
+        "depth": sum(len(queue) for queue in queues),
+        "max_depth": max((len(queue) for queue in queues), default=0),
+        **STATS,
+    }
+
+
+def _collect_queue_stats():
+    for stat, value in queue_stats().items():
+        metrics.WS_SEND_QUEUE.set(value, stat=stat)
+
+
+metrics.COLLECTORS.append(_collect_queue_stats)
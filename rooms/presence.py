@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import time
+import zlib
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger("rooms.presence")
+
+INVALIDATE_CHANNEL = "presence:invalidate"
+
+# Seconds before resubscribing to invalidations after losing Redis,
+# doubling per failed attempt up to the maximum
+LISTEN_RETRY = 0.5
+LISTEN_RETRY_MAX = 30
+
+# KEYS[1] = members zset (username -> expiry in ms)
+# KEYS[2] = channels hash (username -> channel name)
+# ARGV = now_ms, expires_ms, max_members, username, channel_name,
+#        name the connection joined under before ("" if none)
+JOIN_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local expires = tonumber(ARGV[2])
+local max_members = tonumber(ARGV[3])
+local username = ARGV[4]
+local previous = ARGV[6]
+
+redis.call("ZREMRANGEBYSCORE", key, "-inf", now)
+
+-- A connection joining again under another name gives up the old one
+if previous ~= "" and previous ~= username
+    and redis.call("HGET", KEYS[2], previous) == ARGV[5] then
+    redis.call("ZREM", key, previous)
+    redis.call("HDEL", KEYS[2], previous)
+end
+
+if max_members > 0
+    and not redis.call("ZSCORE", key, username)
+    and redis.call("ZCARD", key) >= max_members then
+    return {0, redis.call("ZRANGE", key, 0, -1)}
+end
+
+redis.call("ZADD", key, expires, username)
+redis.call("PEXPIREAT", key, expires)
+redis.call("HSET", KEYS[2], username, ARGV[5])
+redis.call("PEXPIREAT", KEYS[2], expires)
+return {1, redis.call("ZRANGE", key, 0, -1)}
+"""
+
+# KEYS[1] = members zset, KEYS[2] = channels hash
+# ARGV = now_ms, username, channel_name
+LEAVE_SCRIPT = """
+local key = KEYS[1]
+redis.call("ZREMRANGEBYSCORE", key, "-inf", tonumber(ARGV[1]))
+
+-- A client that reconnected before its old socket closed has joined
+-- again on a new channel; the old one leaving must not remove it
+if redis.call("HGET", KEYS[2], ARGV[2]) == ARGV[3] then
+    redis.call("ZREM", key, ARGV[2])
+    redis.call("HDEL", KEYS[2], ARGV[2])
+end
+return redis.call("ZRANGE", key, 0, -1)
+"""
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class InMemoryPresenceBackend:
+    """
+    Process-local stand-in for the Redis backend, with the same TTL and
+    capacity semantics. Only suitable for tests and single-worker setups.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._rooms: dict[str, dict[str, int]] = {}
+        self._channels: dict[str, dict[str, str]] = {}
+
+    def _live(self, room_code):
+        members = self._rooms.get(room_code, {})
+        now = _now_ms()
+        for username, expires in list(members.items()):
+            if expires <= now:
+                del members[username]
+        if not members:
+            self._rooms.pop(room_code, None)
+            self._channels.pop(room_code, None)
+        return members
+
+    async def join(
+        self, room_code, username, channel_name, max_members=0, replaces=None
+    ):
+        members = self._live(room_code)
+        channels = self._channels.setdefault(room_code, {})
+        if (
+            replaces
+            and replaces != username
+            and channels.get(replaces) == channel_name
+        ):
+            members.pop(replaces, None)
+            del channels[replaces]
+
+        if (
+            max_members > 0
+            and username not in members
+            and len(members) >= max_members
+        ):
+            return False, list(members)
+
+        members[username] = _now_ms() + self.ttl * 1000
+        self._rooms[room_code] = members
+        channels[username] = channel_name
+        return True, list(members)
+
+    async def leave(self, room_code, username, channel_name):
+        members = self._live(room_code)
+        channels = self._channels.get(room_code, {})
+        if channels.get(username) == channel_name:
+            members.pop(username, None)
+            del channels[username]
+        return list(self._live(room_code))
+
+    async def heartbeat(self, room_code, username, channel_name):
+        members = self._live(room_code)
+        members[username] = _now_ms() + self.ttl * 1000
+        self._rooms[room_code] = members
+        self._channels.setdefault(room_code, {}).setdefault(username, channel_name)
+
+    async def members(self, room_code):
+        return list(self._live(room_code))
+
+    async def counts(self, room_codes):
+        return self.counts_sync(room_codes)
+
+    def counts_sync(self, room_codes):
+        return {code: len(self._live(code)) for code in room_codes}
+
+    async def channel_for(self, room_code, username):
+        if username not in self._live(room_code):
+            return None
+        return self._channels.get(room_code, {}).get(username)
+
+    async def flush(self):
+        self._rooms.clear()
+        self._channels.clear()
+
+
+class RedisPresenceBackend:
+    """
+    Room membership stored in Redis sorted sets, one per room, scored by
+    the member's expiry time. Rooms are sharded over ``hosts`` by a stable
+    hash of the room code, and every write publishes the room code so each
+    worker can drop its cached member list.
+
+    Next to the members, a hash per room maps usernames to the channel
+    name of their connection, so targeted messages can be sent straight to
+    one consumer instead of the whole group.
+    """
+
+    def __init__(self, hosts=None, ttl=30, prefix="presence"):
+        if not hosts:
+            hosts = settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"]
+        self.hosts = hosts
+        self.ttl = ttl
+        self.prefix = prefix
+
+        self._loop = None
+        self._clients = []
+        self._join = None
+        self._leave = None
+        self._listener = None
+        self._sync_clients = []
+        self._cache: dict[str, tuple[float, list]] = {}
+        self._channel_cache: dict[str, tuple[float, dict]] = {}
+
+    def _key(self, room_code, kind="members"):
+        # The hash tag keeps a room's keys on one Redis Cluster slot
+        return f"{self.prefix}:{{{room_code}}}:{kind}"
+
+    def _keys(self, room_code):
+        return [self._key(room_code), self._key(room_code, "channels")]
+
+    def _connect(self, url):
+        import redis.asyncio as redis
+
+        return redis.Redis.from_url(url)
+
+    def _connect_sync(self, url):
+        import redis
+
+        return redis.Redis.from_url(url)
+
+    def _by_shard(self, room_codes):
+        by_shard: dict[int, list[str]] = {}
+        for code in room_codes:
+            shard = zlib.crc32(code.encode()) % len(self.hosts)
+            by_shard.setdefault(shard, []).append(code)
+        return by_shard
+
+    def _client(self, room_code):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._clients = [self._connect(url) for url in self.hosts]
+            self._join = [c.register_script(JOIN_SCRIPT) for c in self._clients]
+            self._leave = [c.register_script(LEAVE_SCRIPT) for c in self._clients]
+            self._cache.clear()
+            self._channel_cache.clear()
+            self._listener = loop.create_task(self._listen())
+
+        shard = zlib.crc32(room_code.encode()) % len(self._clients)
+        return shard, self._clients[shard]
+
+    async def _listen(self):
+        """
+        Drop cached member lists whenever any worker changes a room.
+
+        When Redis goes away the subscription is retried with backoff.
+        Invalidations sent meanwhile are lost, so every cached list is
+        dropped once it is back.
+        """
+        import redis.asyncio as redis
+
+        delay = LISTEN_RETRY
+        while True:
+            pubsub = self._clients[0].pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                self._cache.clear()
+                self._channel_cache.clear()
+                delay = LISTEN_RETRY
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        room_code = message["data"].decode()
+                        self._cache.pop(room_code, None)
+                        self._channel_cache.pop(room_code, None)
+            except (redis.RedisError, OSError):
+                logger.warning(
+                    "Presence invalidations lost, resubscribing in %.1fs", delay
+                )
+            finally:
+                await pubsub.aclose()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LISTEN_RETRY_MAX)
+
+    async def _changed(self, room_code, users):
+        self._cache.pop(room_code, None)
+        self._channel_cache.pop(room_code, None)
+        await self._clients[0].publish(INVALIDATE_CHANNEL, room_code)
+        return [u.decode() for u in users]
+
+    async def join(
+        self, room_code, username, channel_name, max_members=0, replaces=None
+    ):
+        """
+        Add ``username`` to the room unless it is full. ``replaces`` is the
+        name this connection joined under before, if any; it is dropped.
+        Returns ``(joined, members)``.
+        """
+        shard, _ = self._client(room_code)
+        now = _now_ms()
+        joined, users = await self._join[shard](
+            keys=self._keys(room_code),
+            args=[
+                now,
+                now + self.ttl * 1000,
+                max_members,
+                username,
+                channel_name,
+                replaces or "",
+            ],
+        )
+        users = await self._changed(room_code, users)
+        return bool(joined), users
+
+    async def leave(self, room_code, username, channel_name):
+        shard, _ = self._client(room_code)
+        users = await self._leave[shard](
+            keys=self._keys(room_code),
+            args=[_now_ms(), username, channel_name],
+        )
+        return await self._changed(room_code, users)
+
+    async def heartbeat(self, room_code, username, channel_name):
+        """
+        Extend the member's entry, or add it back if it expired while the
+        connection is still open (a stalled worker, a Redis failover).
+        The channel is only filled in if no newer connection owns the name.
+        """
+        _, client = self._client(room_code)
+        expires = _now_ms() + self.ttl * 1000
+        key, channels_key = self._keys(room_code)
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {username: expires})
+            pipe.hsetnx(channels_key, username, channel_name)
+            pipe.pexpireat(key, expires)
+            pipe.pexpireat(channels_key, expires)
+            await pipe.execute()
+
+    async def members(self, room_code):
+        cached = self._cache.get(room_code)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        _, client = self._client(room_code)
+        users = await client.zrangebyscore(self._key(room_code), _now_ms(), "+inf")
+        users = [u.decode() for u in users]
+
+        # Members can also expire silently, so cached lists never outlive
+        # one heartbeat interval even without an invalidation message.
+        self._cache[room_code] = (time.monotonic() + self.ttl / 3, users)
+        return users
+
+    async def counts(self, room_codes):
+        """
+        Live member count of every room in ``room_codes``, with one
+        pipelined round trip per shard.
+        """
+        if not room_codes:
+            return {}
+
+        self._client(room_codes[0])
+        now = _now_ms()
+        counts = {}
+        for shard, codes in self._by_shard(room_codes).items():
+            async with self._clients[shard].pipeline(transaction=False) as pipe:
+                for code in codes:
+                    pipe.zcount(self._key(code), now, "+inf")
+                results = await pipe.execute()
+            counts.update(zip(codes, results))
+        return counts
+
+    def counts_sync(self, room_codes):
+        """
+        ``counts`` for synchronous code such as the room list view, on
+        blocking clients of its own instead of a nested event loop.
+        """
+        if not room_codes:
+            return {}
+
+        if not self._sync_clients:
+            self._sync_clients = [self._connect_sync(url) for url in self.hosts]
+        now = _now_ms()
+        counts = {}
+        for shard, codes in self._by_shard(room_codes).items():
+            with self._sync_clients[shard].pipeline(transaction=False) as pipe:
+                for code in codes:
+                    pipe.zcount(self._key(code), now, "+inf")
+                counts.update(zip(codes, pipe.execute()))
+        return counts
+
+    async def channel_for(self, room_code, username):
+        """
+        Return the channel name of ``username``'s connection in the room,
+        or None if they are not connected.
+
+        Cached with each member's expiry, which a live member's heartbeats
+        keep further ahead than the cache lives.
+        """
+        cached = self._channel_cache.get(room_code)
+        if cached is None or cached[0] <= time.monotonic():
+            _, client = self._client(room_code)
+            key, channels_key = self._keys(room_code)
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.zrangebyscore(key, _now_ms(), "+inf", withscores=True)
+                pipe.hgetall(channels_key)
+                live, channels = await pipe.execute()
+            entries = {
+                member.decode(): (expires, channels[member].decode())
+                for member, expires in live
+                if member in channels
+            }
+            cached = (time.monotonic() + self.ttl / 3, entries)
+            self._channel_cache[room_code] = cached
+
+        entry = cached[1].get(username)
+        if entry is None or entry[0] <= _now_ms():
+            return None
+        return entry[1]
+
+    async def flush(self):
+        for client in self._clients:
+            async for key in client.scan_iter(f"{self.prefix}:*"):
+                await client.delete(key)
+        self._cache.clear()
+        self._channel_cache.clear()
+
+
+_store = None
+
+
+def get_presence_store():
+    """
+    Return the process-wide presence backend configured in ``PRESENCE``.
+    """
+    global _store
+    if _store is None:
+        config = settings.PRESENCE
+        _store = import_string(config["BACKEND"])(**config.get("CONFIG", {}))
+    return _store
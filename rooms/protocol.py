@@ -0,0 +1,109 @@
+import json
+from functools import lru_cache
+
+import msgpack
+
+# Negotiated through Sec-WebSocket-Protocol; frames are MessagePack maps
+# sent as binary WebSocket messages.
+MSGPACK_SUBPROTOCOL = "wb.msgpack.v1"
+
+# Broadcast frames converted for the clients that need another form
+# (MessagePack, or unbatched frames for old clients), per process. Every
+# recipient of one broadcast looks up the same text, so this only needs
+# to hold the frames in flight.
+CONVERTED_CACHE_SIZE = 256
+
+
+def _is_xy(point):
+    return (
+        isinstance(point, dict)
+        and len(point) == 2
+        and "x" in point
+        and "y" in point
+    )
+
+
+def pack_point(point):
+    if _is_xy(point):
+        return [point["x"], point["y"]]
+    return point
+
+
+def pack_points(points):
+    """
+    Flatten a polyline to ``[x0, y0, x1, y1, ...]``, or leave it untouched
+    if any point carries more than coordinates.
+    """
+    if not all(_is_xy(point) for point in points):
+        return points
+
+    flat = []
+    for point in points:
+        flat.append(point["x"])
+        flat.append(point["y"])
+    return flat
+
+
+def _compact(frame):
+    frame_type = frame.get("type")
+
+    if frame_type == "draw":
+        return {
+            **frame,
+            "from": pack_point(frame["from"]),
+            "to": pack_point(frame["to"]),
+        }
+
+    if frame_type == "draw_batch":
+        return {
+            **frame,
+            "strokes": [
+                {**stroke, "points": pack_points(stroke["points"])}
+                for stroke in frame["strokes"]
+            ],
+        }
+
+    return frame
+
+
+def encode_json(frame):
+    return json.dumps(frame)
+
+
+def encode_msgpack(frame):
+    return msgpack.packb(_compact(frame), use_bin_type=True)
+
+
+def prepare(frame):
+    """
+    Encode a broadcast frame once. Group events carry the JSON text only,
+    which most recipients forward as is; binary recipients get theirs
+    from ``binary``.
+    """
+    return {"text": encode_json(frame)}
+
+
+@lru_cache(maxsize=CONVERTED_CACHE_SIZE)
+def _msgpack_from_json(text):
+    return encode_msgpack(json.loads(text))
+
+
+def binary(prepared):
+    """
+    MessagePack encoding of a prepared frame, converted from its text at
+    most once per process while the frame is in flight.
+    """
+    data = prepared.get("bytes")
+    if data is None:
+        data = _msgpack_from_json(prepared["text"])
+    return data
+
+
+def decode_json(text_data):
+    return json.loads(text_data)
+
+
+def decode_msgpack(bytes_data):
+    # [x, y] points from binary clients are expanded by the draw schema
+    # (rooms.messages.point)
+    return msgpack.unpackb(bytes_data, raw=False)
@@ -0,0 +1,314 @@
+"""
+Server-side rasterization of canvases into PNG tiles.
+
+Tiles are TILE_SIZE pixels square. At zoom level ``z`` one tile pixel
+covers ``2**z`` canvas units, so level 0 is full resolution and every
+level above halves it. Tiles are rendered on request and kept in a
+per-process LRU cache together with the canvas version they show; a
+cached tile that fell behind is brought up to date by drawing only the
+stroke log rows appended since, and is rebuilt only when those rows
+were compacted away or erased, from the records the spatial index finds
+under the tile.
+"""
+
+import math
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .geometry import record_bounds, shape
+from .spatial import get_spatial_index
+
+TILE_SIZE = 256
+_STRIDE = TILE_SIZE * 4
+
+_DEFAULT_COLOR = b"\x00\x00\x00\xff"
+
+
+def parse_color(value):
+    """
+    RGBA bytes of a ``#rgb``, ``#rrggbb`` or ``#rrggbbaa`` color; black
+    for anything else.
+    """
+    if not isinstance(value, str) or not value.startswith("#"):
+        return _DEFAULT_COLOR
+    digits = value[1:]
+    if len(digits) == 3:
+        digits = "".join(c * 2 for c in digits)
+    if len(digits) == 6:
+        digits += "ff"
+    try:
+        return bytes.fromhex(digits) if len(digits) == 8 else _DEFAULT_COLOR
+    except ValueError:
+        return _DEFAULT_COLOR
+
+
+def _row_span(corners, yc):
+    """
+    x range where the horizontal line ``y = yc`` crosses a convex polygon.
+    """
+    xs = []
+    count = len(corners)
+    for i in range(count):
+        px, py = corners[i]
+        qx, qy = corners[(i + 1) % count]
+        if py == qy:
+            if py == yc:
+                xs += (px, qx)
+        elif min(py, qy) <= yc <= max(py, qy):
+            xs.append(px + (yc - py) * (qx - px) / (qy - py))
+    return (min(xs), max(xs)) if xs else None
+
+
+class Tile:
+    __slots__ = ("z", "tx", "ty", "version", "pixels", "png", "empty", "lock")
+
+    def __init__(self, z, tx, ty):
+        self.z = z
+        self.tx = tx
+        self.ty = ty
+        self.version = -1
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.pixels = bytearray(TILE_SIZE * _STRIDE)
+        self.png = None
+        self.empty = True
+
+    @property
+    def scale(self):
+        return 1 << self.z
+
+    @property
+    def bbox(self):
+        """
+        Canvas area the tile shows, grown by the half pixel every stroke
+        is widened to.
+        """
+        scale = self.scale
+        x0, y0 = self.tx * TILE_SIZE * scale, self.ty * TILE_SIZE * scale
+        size = TILE_SIZE * scale
+        return (x0 - scale, y0 - scale, x0 + size + scale, y0 + size + scale)
+
+    def draw(self, record):
+        """
+        Paint one segment (a round-capped line) or point (a disc) onto the
+        tile. Returns False if it lies outside the tile.
+        """
+        drawn = shape(record)
+        if drawn is None:
+            return False
+        ax, ay, bx, by, size, color = drawn
+
+        # Canvas units to tile pixels
+        scale = self.scale
+        ox, oy = self.tx * TILE_SIZE, self.ty * TILE_SIZE
+        ax, ay = ax / scale - ox, ay / scale - oy
+        bx, by = bx / scale - ox, by / scale - oy
+        # Never thinner than one pixel, so zoomed out strokes stay visible
+        r = max(0.5, size / scale / 2)
+
+        if (
+            max(ax, bx) + r < 0
+            or min(ax, bx) - r > TILE_SIZE
+            or max(ay, by) + r < 0
+            or min(ay, by) - r > TILE_SIZE
+        ):
+            return False
+
+        # The stroke is the union of two end discs and the rectangle
+        # between them; each pixel row crosses it in a single span.
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+        corners = None
+        if length:
+            nx, ny = -dy / length * r, dx / length * r
+            corners = [
+                (ax + nx, ay + ny),
+                (bx + nx, by + ny),
+                (bx - nx, by - ny),
+                (ax - nx, ay - ny),
+            ]
+
+        fill = parse_color(color)
+        row_from = max(0, math.ceil(min(ay, by) - r - 0.5))
+        row_to = min(TILE_SIZE - 1, math.floor(max(ay, by) + r - 0.5))
+        painted = False
+        for row in range(row_from, row_to + 1):
+            yc = row + 0.5
+            spans = []
+            for cx, cy in ((ax, ay), (bx, by)):
+                if abs(yc - cy) <= r:
+                    half = math.sqrt(r * r - (yc - cy) ** 2)
+                    spans.append((cx - half, cx + half))
+            if corners is not None:
+                span = _row_span(corners, yc)
+                if span is not None:
+                    spans.append(span)
+            if not spans:
+                continue
+
+            left = max(0, math.ceil(min(s[0] for s in spans) - 0.5))
+            right = min(TILE_SIZE - 1, math.floor(max(s[1] for s in spans) - 0.5))
+            if left > right:
+                continue
+            start = row * _STRIDE + left * 4
+            self.pixels[start : start + (right - left + 1) * 4] = fill * (
+                right - left + 1
+            )
+            painted = True
+
+        if painted:
+            self.png = None
+            self.empty = False
+        return painted
+
+    def to_png(self):
+        if self.png is None:
+            self.png = encode_png(self.pixels, TILE_SIZE, TILE_SIZE)
+        return self.png
+
+
+def _chunk(kind, data):
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def encode_png(pixels, width, height):
+    """
+    Minimal RGBA PNG encoder (no filtering, one IDAT chunk).
+    """
+    stride = width * 4
+    raw = b"".join(
+        b"\x00" + bytes(pixels[row * stride : (row + 1) * stride])
+        for row in range(height)
+    )
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _chunk(b"IHDR", header)
+        + _chunk(b"IDAT", zlib.compress(raw, 6))
+        + _chunk(b"IEND", b"")
+    )
+
+
+def _union(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class _Bounds:
+    __slots__ = ("version", "box", "lock")
+
+    def __init__(self):
+        self.version = -1
+        self.box = None
+        self.lock = threading.Lock()
+
+
+class TileCache:
+    """
+    LRUs of rendered tiles and of the drawing bounds of each room (``size``
+    entries each), both kept current from the stroke log tail.
+
+    The cache lock only guards the lookups. Rendering holds the lock of
+    the one tile (or room bounds) being brought up to date, so different
+    tiles render in parallel while concurrent requests for the same tile
+    wait for a single render.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._tiles: OrderedDict[tuple, Tile] = OrderedDict()
+        self._bounds: OrderedDict[int, _Bounds] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _catch_up(self, state, version, rebuild, apply, visible=None):
+        """
+        Bring something rendered at ``version`` up to ``state.version``.
+        A rebuild draws ``visible()`` instead of the whole canvas when
+        given.
+        """
+        if version == state.version:
+            return
+        if version < 0 or version > state.version:
+            full, records = True, None
+        else:
+            full, records = state.ops_since(version)
+        if full:
+            rebuild()
+            if visible is not None:
+                records = visible()
+            elif records is None:
+                records = state.iter_data()
+        for record in records:
+            apply(record)
+
+    def png(self, state, z, tx, ty):
+        """
+        PNG bytes of one tile at ``state.version``.
+        """
+        key = (state.room_id, z, tx, ty)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                tile = self._tiles[key] = Tile(z, tx, ty)
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.size:
+                self._tiles.popitem(last=False)
+
+        with tile.lock:
+            self._catch_up(
+                state,
+                tile.version,
+                tile.clear,
+                tile.draw,
+                lambda: get_spatial_index().within(state, tile.bbox),
+            )
+            tile.version = state.version
+            return tile.to_png()
+
+    def bounds(self, state):
+        """
+        ``[x0, y0, x1, y1]`` of everything drawn in the room, or None.
+        """
+        with self._lock:
+            entry = self._bounds.get(state.room_id)
+            if entry is None:
+                entry = self._bounds[state.room_id] = _Bounds()
+            self._bounds.move_to_end(state.room_id)
+            while len(self._bounds) > self.size:
+                self._bounds.popitem(last=False)
+
+        with entry.lock:
+
+            def rebuild():
+                entry.box = None
+
+            def apply(record):
+                entry.box = _union(entry.box, record_bounds(record))
+
+            self._catch_up(state, entry.version, rebuild, apply)
+            entry.version = state.version
+            return list(entry.box) if entry.box else None
+
+
+_cache = None
+
+
+def get_tile_cache():
+    global _cache
+    if _cache is None:
+        _cache = TileCache(settings.CANVAS_TILE_CACHE_SIZE)
+    return _cache
@@ -0,0 +1,143 @@
+"""
+Token bucket rate limits for inbound room WebSocket messages.
+
+Every connection has a bucket per message kind (``settings.WS_RATE_LIMITS``)
+and shares a second one with the other connections of its room in this
+worker. A message spends one token from both; buckets refill continuously
+at "rate" tokens per second up to "burst". Buckets and budgets are built
+once per connection, so checking a message only does float arithmetic on
+slotted objects.
+
+Frames that cannot be handled at all (malformed, without a type or of an
+unknown type) are charged to the ``INVALID`` budget before any error
+reply is sent.
+"""
+
+from django.conf import settings
+
+INVALID = "invalid"
+
+# Message types sharing one budget
+KINDS = {
+    INVALID: INVALID,
+    "join": "join",
+    "draw": "draw",
+    "erase": "erase",
+    "chat": "chat",
+    "webrtc_offer": "webrtc",
+    "webrtc_answer": "webrtc",
+    "webrtc_candidate": "webrtc",
+}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def delay(self, now):
+        """
+        Seconds until one token is available (0.0 when one is now).
+        """
+        tokens = self.tokens + (now - self.updated) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def spend(self):
+        self.tokens -= 1
+
+
+class Budget:
+    """
+    A connection's budget for one kind of message: its own bucket and,
+    when the room is limited too, the room's.
+    """
+
+    __slots__ = ("kind", "action", "connection", "room", "limited")
+
+    def __init__(self, kind, action, connection, room):
+        self.kind = kind
+        self.action = action
+        self.connection = connection
+        self.room = room
+        # Set while messages are being limited, so clients hear about it
+        # once per burst instead of once per message
+        self.limited = False
+
+    def acquire(self, now):
+        """
+        Spend a token and return 0.0, or return how many seconds the
+        caller would have to wait for one, spending nothing.
+        """
+        wait = self.connection.delay(now)
+        if self.room is not None:
+            room_wait = self.room.delay(now)
+            if room_wait > wait:
+                wait = room_wait
+        if not wait:
+            self.spend()
+            self.limited = False
+        return wait
+
+    def spend(self):
+        self.connection.spend()
+        if self.room is not None:
+            self.room.spend()
+
+
+# Room buckets of this worker, per room and kind, with the number of
+# connections using them
+_ROOMS: dict[str, list] = {}
+
+
+def acquire(room_code, now):
+    """
+    Return the budgets of a new connection to ``room_code``, keyed by
+    message type; types without a configured limit are missing.
+    """
+    if not settings.WS_RATE_LIMIT:
+        return {}
+
+    entry = _ROOMS.get(room_code)
+    if entry is None:
+        entry = _ROOMS[room_code] = [{}, 0]
+    entry[1] += 1
+    room_buckets = entry[0]
+
+    budgets = {}
+    for kind, limit in settings.WS_RATE_LIMITS.items():
+        room = None
+        if limit.get("room_rate"):
+            room = room_buckets.get(kind)
+            if room is None:
+                room = room_buckets[kind] = TokenBucket(
+                    limit["room_rate"], limit["room_burst"], now
+                )
+        budgets[kind] = Budget(
+            kind,
+            limit["action"],
+            TokenBucket(limit["rate"], limit["burst"], now),
+            room,
+        )
+
+    return {
+        msg_type: budgets[kind]
+        for msg_type, kind in KINDS.items()
+        if kind in budgets
+    }
+
+
+def release(room_code):
+    entry = _ROOMS.get(room_code)
+    if entry is None:
+        return
+    entry[1] -= 1
+    if entry[1] <= 0:
+        _ROOMS.pop(room_code, None)
@@ -0,0 +1,23 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from . import canvas_codec
+
+
+class CanvasCodecRenderer(BaseRenderer):
+    """
+    Canvas data as a rooms.canvas_codec blob, selected with
+    ``Accept: application/x-whiteboard-canvas`` or ``?format=wbc``.
+    Anything other than canvas data (errors) is rendered as JSON.
+    """
+
+    media_type = "application/x-whiteboard-canvas"
+    format = "wbc"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and isinstance(data.get("data"), list):
+            return canvas_codec.encode(data["data"])
+        return json.dumps(data).encode()
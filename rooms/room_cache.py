@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger("rooms.room_cache")
+
+INVALIDATE_CHANNEL = "roommeta:invalidate"
+
+# Missing rooms are cached too, so connect floods for bogus codes stay
+# off the database.
+MISSING = {"exists": False}
+
+
+class RoomMetaCache:
+    """
+    Two-level cache of the room fields the WebSocket path needs
+    (existence and ``max_members``).
+
+    Lookups hit a bounded in-process LRU first, then a Redis key shared by
+    all workers, and only then the database. ``Room`` saves and deletes
+    drop the Redis key and publish the room code so every worker evicts
+    its local copy, once the transaction that made them commits.
+    """
+
+    def __init__(self, hosts=None, size=1024, ttl=60, prefix="roommeta"):
+        if hosts is None:
+            hosts = settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"]
+        self.hosts = hosts
+        self.size = size
+        self.ttl = ttl
+        self.prefix = prefix
+
+        self._local: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._loop = None
+        self._redis = None
+        self._sync_redis = None
+        self._listener = None
+        # Codes invalidated by the current thread's open transaction
+        self._dirty = threading.local()
+
+    def _key(self, room_code):
+        return f"{self.prefix}:{room_code}"
+
+    def _remember(self, room_code, meta):
+        self._local[room_code] = (time.monotonic() + self.ttl, meta)
+        self._local.move_to_end(room_code)
+        while len(self._local) > self.size:
+            self._local.popitem(last=False)
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return self._redis
+
+        self._loop = loop
+        self._local.clear()
+        if self.hosts:
+            import redis.asyncio as redis
+
+            self._redis = redis.Redis.from_url(self.hosts[0])
+            self._listener = loop.create_task(self._listen())
+        return self._redis
+
+    async def _listen(self):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(INVALIDATE_CHANNEL)
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                self._local.pop(message["data"].decode(), None)
+
+    async def get(self, room_code):
+        """
+        Return the cached metadata dict of a room, or None if it does not
+        exist.
+        """
+        cached = self._local.get(room_code)
+        if cached is not None and cached[0] > time.monotonic():
+            self._local.move_to_end(room_code)
+            meta = cached[1]
+            return meta if meta["exists"] else None
+
+        client = self._client()
+        meta = None
+        if client is not None:
+            raw = await client.get(self._key(room_code))
+            if raw is not None:
+                meta = json.loads(raw)
+
+        if meta is None:
+            meta = await self._load(room_code)
+            if client is not None:
+                await client.set(
+                    self._key(room_code), json.dumps(meta), ex=self.ttl
+                )
+
+        self._remember(room_code, meta)
+        return meta if meta["exists"] else None
+
+    @database_sync_to_async
+    def _load(self, room_code):
+        from .models import Room
+
+        room = (
+            Room.objects.filter(code=room_code)
+            .values("max_members")
+            .first()
+        )
+        if room is None:
+            return MISSING
+        return {"exists": True, **room}
+
+    def invalidate(self, room_code):
+        """
+        Drop a room from every cache level when the current transaction
+        commits (at once outside one). Called from model signals, so this
+        runs in a worker thread.
+
+        Codes are collected per thread until the commit, so deleting many
+        rooms in one transaction costs a single Redis round trip.
+        """
+        codes = getattr(self._dirty, "codes", None)
+        if codes is None:
+            codes = self._dirty.codes = set()
+        codes.add(room_code)
+        # Later callbacks of the same commit find the set already empty
+        transaction.on_commit(self._flush_invalidations)
+
+    def _flush_invalidations(self):
+        codes = getattr(self._dirty, "codes", None)
+        if not codes:
+            return
+        self._dirty.codes = set()
+
+        for room_code in codes:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._local.pop, room_code, None)
+            else:
+                self._local.pop(room_code, None)
+
+        if not self.hosts:
+            return
+
+        import redis
+
+        # The Redis keys expire after ``ttl`` anyway; a failed invalidation
+        # must not fail the request that saved the room
+        try:
+            if self._sync_redis is None:
+                self._sync_redis = redis.Redis.from_url(self.hosts[0])
+            pipe = self._sync_redis.pipeline(transaction=False)
+            pipe.delete(*(self._key(room_code) for room_code in codes))
+            for room_code in codes:
+                pipe.publish(INVALIDATE_CHANNEL, room_code)
+            pipe.execute()
+        except redis.RedisError:
+            logger.exception("Could not invalidate %d cached rooms", len(codes))
+
+
+_cache = None
+
+
+def get_room_cache():
+    global _cache
+    if _cache is None:
+        _cache = RoomMetaCache(**settings.ROOM_CACHE)
+    return _cache
+
+
+def invalidate_room(sender, instance, **kwargs):
+    get_room_cache().invalidate(instance.code)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Room, CanvasState
+from .models import Room, CanvasState, is_erase
 
 
 class RoomSerializer(serializers.ModelSerializer):
@@ -18,6 +18,34 @@ class RoomSerializer(serializers.ModelSerializer):
 
 
 class CanvasStateSerializer(serializers.ModelSerializer):
+    data = serializers.JSONField(default=list)
+
     class Meta:
         model = CanvasState
-        fields = ["data", "updated_at"]
+        fields = ["data", "version", "updated_at"]
+        read_only_fields = ["version"]
+
+    def to_representation(self, instance):
+        return {
+            "data": instance.load_data(),
+            "version": instance.version,
+            "updated_at": serializers.DateTimeField().to_representation(
+                instance.updated_at
+            ),
+        }
+
+    def validate_data(self, value):
+        if not isinstance(value, list):
+            raise serializers.ValidationError("Expected a list.")
+        if any(is_erase(record) for record in value):
+            raise serializers.ValidationError("Erase operations cannot be stored.")
+        return value
+
+    def update(self, instance, validated_data):
+        if "data" in validated_data:
+            instance.replace_data(validated_data["data"])
+        return instance
+
+
+class DebugLoggingSerializer(serializers.Serializer):
+    enabled = serializers.BooleanField()
@@ -0,0 +1,102 @@
+import json
+from functools import lru_cache
+
+from .protocol import CONVERTED_CACHE_SIZE, prepare
+from .timers import FlushTimer
+
+
+def is_end_of_candidates(payload):
+    """
+    Browsers signal the end of gathering with a null candidate or one whose
+    ``candidate`` string is empty.
+    """
+    if payload is None:
+        return True
+    return isinstance(payload, dict) and not payload.get("candidate")
+
+
+def candidate_key(payload):
+    if isinstance(payload, dict) and isinstance(payload.get("candidate"), str):
+        return payload["candidate"]
+    return json.dumps(payload, sort_keys=True)
+
+
+@lru_cache(maxsize=CONVERTED_CACHE_SIZE)
+def legacy_frames(batch_text):
+    """
+    One "webrtc_candidate" frame per payload of a prepared candidate
+    batch, for clients that did not opt into batches.
+    """
+    batch = json.loads(batch_text)
+    return tuple(
+        prepare(
+            {
+                "type": "webrtc_candidate",
+                "payload": payload,
+                "sender": batch["sender"],
+                "target": batch["target"],
+            }
+        )
+        for payload in batch["payloads"]
+    )
+
+
+class CandidateAggregator:
+    """
+    Collects the ICE candidates one connection trickles to each peer and
+    hands them to ``deliver(sender, target, payloads)`` as one batch per
+    window. Duplicate candidate strings are dropped until the
+    end-of-candidates marker, which also flushes immediately.
+    """
+
+    def __init__(self, deliver, window_ms):
+        self.deliver = deliver
+        self.window = window_ms / 1000
+
+        # (sender, target) -> {"payloads": [...], "seen": set, "timer": ..}
+        self._pending: dict[tuple, dict] = {}
+
+    async def add(self, sender, target, payload):
+        key = (sender, target)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {
+                "payloads": [],
+                "seen": set(),
+                "timer": FlushTimer(self.window, self.flush, key),
+            }
+
+        if is_end_of_candidates(payload):
+            entry["payloads"].append(payload)
+            await self.flush(key)
+            # Gathering restarts from scratch after an ICE restart
+            self._pending.pop(key, None)
+            return
+
+        candidate = candidate_key(payload)
+        if candidate in entry["seen"]:
+            return
+        entry["seen"].add(candidate)
+        entry["payloads"].append(payload)
+
+        entry["timer"].schedule()
+
+    async def flush(self, key):
+        entry = self._pending.get(key)
+        if entry is None:
+            return
+
+        entry["timer"].cancel()
+
+        payloads = entry["payloads"]
+        if not payloads:
+            return
+        entry["payloads"] = []
+
+        sender, target = key
+        await self.deliver(sender, target, payloads)
+
+    def cancel(self):
+        for entry in self._pending.values():
+            entry["timer"].cancel()
+        self._pending.clear()
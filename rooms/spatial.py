@@ -0,0 +1,248 @@
+"""
+Per-room spatial index over canvas records, for viewport-scoped loading
+and erase hit-testing.
+
+Records are identified by their position on the canvas (snapshot first,
+then the stroke log), which only changes when the log is compacted. The
+index is a uniform grid: each cell of CANVAS_INDEX_CELL_SIZE canvas units
+lists the positions of the records whose bounds overlap it, so a query
+costs the cells it covers plus the records found there, however large
+the board grows. Indexes live in a per-process LRU and follow the stroke
+log tail the same way rendered tiles do, and are rebuilt when a
+compaction or replace renumbers the records.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import is_erase
+from .geometry import record_bounds, shape
+
+# Records spanning more cells than this are kept aside and checked on
+# every query instead of being listed in each cell
+_MAX_CELLS = 1024
+
+
+def parse_bbox(value):
+    """
+    ``(x0, y0, x1, y1)`` from ``"x0,y0,x1,y1"`` or a list of four numbers,
+    with the corners in either order. Raises ValueError.
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)) or len(value) != 4:
+        raise ValueError("bbox must be four numbers: x0,y0,x1,y1")
+    try:
+        x0, y0, x1, y1 = (float(v) for v in value)
+    except (TypeError, ValueError):
+        raise ValueError("bbox must be four numbers: x0,y0,x1,y1")
+    if not all(math.isfinite(v) for v in (x0, y0, x1, y1)):
+        raise ValueError("bbox must be finite")
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def _overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _touches(record, bbox):
+    """
+    Whether the stroke itself, not just its bounds, reaches ``bbox``: the
+    segment is clipped against the box grown by the stroke radius.
+    """
+    ax, ay, bx, by, size, _ = shape(record)
+    r = size / 2
+    x0, y0, x1, y1 = bbox[0] - r, bbox[1] - r, bbox[2] + r, bbox[3] + r
+    dx, dy = bx - ax, by - ay
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, ax - x0), (dx, x1 - ax), (-dy, ay - y0), (dy, y1 - ay)):
+        if p == 0:
+            if q < 0:
+                return False
+        elif p < 0:
+            t0 = max(t0, q / p)
+        else:
+            t1 = min(t1, q / p)
+        if t0 > t1:
+            return False
+    return True
+
+
+class GridIndex:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.version = -1
+        self.snapshot_version = -1
+        self.records = []  # by position; None once erased
+        self.bounds = {}  # position -> bounds of live drawable records
+        self.cells = {}  # (cx, cy) -> set of positions
+        self.oversized = set()
+
+    def _cells(self, box):
+        size = self.cell_size
+        cx0, cy0 = math.floor(box[0] / size), math.floor(box[1] / size)
+        cx1, cy1 = math.floor(box[2] / size), math.floor(box[3] / size)
+        return cx0, cy0, cx1, cy1, (cx1 - cx0 + 1) * (cy1 - cy0 + 1)
+
+    def add(self, record):
+        position = len(self.records)
+        if is_erase(record):
+            self.records.append(None)
+            for erased in record["erase"]:
+                self.remove(erased)
+            return
+
+        self.records.append(record)
+        box = record_bounds(record)
+        if box is None:
+            return
+        self.bounds[position] = box
+        cx0, cy0, cx1, cy1, count = self._cells(box)
+        if count > _MAX_CELLS:
+            self.oversized.add(position)
+            return
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self.cells.setdefault((cx, cy), set()).add(position)
+
+    def remove(self, position):
+        box = self.bounds.pop(position, None)
+        if 0 <= position < len(self.records):
+            self.records[position] = None
+        if box is None:
+            return
+        if position in self.oversized:
+            self.oversized.discard(position)
+            return
+        cx0, cy0, cx1, cy1, _ = self._cells(box)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(position)
+                    if not cell:
+                        del self.cells[(cx, cy)]
+
+    def query(self, bbox):
+        """
+        Sorted positions of the records whose bounds overlap ``bbox``.
+        """
+        cx0, cy0, cx1, cy1, count = self._cells(bbox)
+        found = set()
+        if count > len(self.cells):
+            # Zoomed far out: walking the occupied cells is cheaper
+            for (cx, cy), positions in self.cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found |= positions
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    positions = self.cells.get((cx, cy))
+                    if positions:
+                        found |= positions
+        found |= self.oversized
+        return sorted(p for p in found if _overlaps(self.bounds[p], bbox))
+
+    def hit(self, bbox):
+        """
+        Positions of the records whose strokes touch ``bbox``.
+        """
+        return [p for p in self.query(bbox) if _touches(self.records[p], bbox)]
+
+    def within(self, bbox):
+        return [self.records[p] for p in self.query(bbox)]
+
+
+class _Room:
+    __slots__ = ("grid", "lock")
+
+    def __init__(self):
+        self.grid = None
+        self.lock = threading.Lock()
+
+
+class SpatialIndex:
+    """
+    LRU of per-room grid indexes, each kept current from the stroke log.
+
+    The index lock only guards the LRU; building or querying a room's
+    grid holds that room's lock, so rooms never wait on each other.
+    """
+
+    def __init__(self, size, cell_size):
+        self.size = size
+        self.cell_size = cell_size
+        self._rooms: OrderedDict[int, _Room] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _room(self, room_id):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = _Room()
+            self._rooms.move_to_end(room_id)
+            while len(self._rooms) > self.size:
+                self._rooms.popitem(last=False)
+            return room
+
+    def _grid(self, room, state):
+        grid = room.grid
+        if (
+            grid is None
+            or grid.snapshot_version != state.snapshot_version
+            or grid.version > state.version
+        ):
+            grid = GridIndex(self.cell_size)
+            records = state.iter_records()
+        elif grid.version == state.version:
+            records = ()
+        else:
+            records = (
+                record for segments in state._tail(grid.version) for record in segments
+            )
+        for record in records:
+            grid.add(record)
+        grid.version = state.version
+        grid.snapshot_version = state.snapshot_version
+        room.grid = grid
+        return grid
+
+    def warm(self, state):
+        """
+        Build or catch up the room's grid to ``state`` without querying it.
+        """
+        room = self._room(state.room_id)
+        with room.lock:
+            self._grid(room, state)
+
+    def within(self, state, bbox):
+        """
+        The records of ``state`` whose bounds overlap ``bbox``, in canvas
+        order.
+        """
+        room = self._room(state.room_id)
+        with room.lock:
+            return self._grid(room, state).within(bbox)
+
+    def hit(self, state, bbox):
+        """
+        Positions of the records of ``state`` whose strokes touch ``bbox``.
+        """
+        room = self._room(state.room_id)
+        with room.lock:
+            return self._grid(room, state).hit(bbox)
+
+
+_index = None
+
+
+def get_spatial_index():
+    global _index
+    if _index is None:
+        _index = SpatialIndex(
+            settings.CANVAS_INDEX_CACHE_SIZE, settings.CANVAS_INDEX_CELL_SIZE
+        )
+    return _index
@@ -1,3 +1,1658 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import fakeredis
+import msgpack
+import redis
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from benchmarks import ws_load
+from benchmarks.ws_load import SocketClient, wait_for_port
+from rooms import (
+    canvas,
+    canvas_codec,
+    coalescing,
+    eventlog,
+    lifecycle,
+    messages,
+    outbound,
+    presence,
+    protocol,
+    ratelimit,
+    raster,
+    room_cache,
+    signaling,
+    spatial,
+    timers,
+)
+from rooms.consumers import RoomConsumer
+from rooms.models import CanvasState, Room
+from rooms.routing import websocket_urlpatterns
+from users.middleware import JWTAuthMiddleware
+from whiteboard_backend import metrics
+
+ROOT = settings.BASE_DIR
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _summary(frames):
+    """
+    What one member saw, independent of arrival order.
+    """
+    users = None
+    draws, chats, offers, sync = set(), [], [], []
+    for frame in frames:
+        kind = frame["type"]
+        if kind == "user_list":
+            users = frame["users"]
+        elif kind == "draw":
+            draws.add((frame["from"]["x"], frame["to"]["x"]))
+        elif kind == "chat":
+            chats.append((frame["username"], frame["text"]))
+        elif kind == "webrtc_offer":
+            offers.append((frame["sender"], frame["payload"]))
+        elif kind == "canvas_sync":
+            sync.extend((r["from"]["x"], r["to"]["x"]) for r in frame["data"])
+    return {
+        "users": sorted(users or ()),
+        "draws": sorted(draws),
+        "chats": chats,
+        "offers": offers,
+        "sync": sorted(sync),
+    }
+
+
+async def _collect(client, frames):
+    while True:
+        text = await client.recv()
+        if text is None:
+            return
+        frames.append(json.loads(text))
+
+
+def _segment(x0, x1, color="#000000", size=4):
+    return {
+        "from": {"x": x0, "y": 0},
+        "to": {"x": x1, "y": 0},
+        "color": color,
+        "size": size,
+    }
+
+
+async def _group_events(layer, group, count):
+    """
+    Subscribe a channel to ``group``; returns it and a coroutine that
+    collects the next ``count`` events.
+    """
+    channel = await layer.new_channel()
+    await layer.group_add(group, channel)
+
+    async def receive():
+        return [await asyncio.wait_for(layer.receive(channel), 1) for _ in range(count)]
+
+    return channel, receive
+
+
+class WsLoadSummaryTests(SimpleTestCase):
+    def test_percentiles_pick_the_nearest_rank(self):
+        values = [0.004, 0.001, 0.003, 0.002, 0.005]
+        self.assertEqual(ws_load.percentile(values, 0.0), 0.001)
+        self.assertEqual(ws_load.percentile(values, 0.5), 0.003)
+        self.assertEqual(ws_load.percentile(values, 0.99), 0.005)
+        self.assertEqual(ws_load.percentile([0.2], 0.9), 0.2)
+
+    def test_summary_counts_what_was_delivered_of_what_was_expected(self):
+        recorder = ws_load.Recorder()
+        recorder.on_send("draw", 1, 7, recipients=2)
+        recorder.on_send("chat", 1, 0, recipients=2)
+        # Draw frames carry the sender in y and the sequence number in x
+        draw = {"type": "draw", "from": {"x": 7, "y": 1}, "to": {"x": 8, "y": 1}}
+        chat = {"type": "chat", "text": "1:0"}
+        for frame in (draw, chat):
+            recorder.on_receive(*ws_load.identify(json.dumps(frame)))
+        # Frames the benchmark did not send are not counted
+        recorder.on_receive("chat", 2, 0)
+        self.assertIsNone(ws_load.identify(json.dumps({"type": "user_list"})))
+
+        summary = ws_load.summarize(recorder, elapsed=2)
+        self.assertEqual(summary["sent"], {"draw": 1, "chat": 1})
+        self.assertEqual(summary["expected"], {"draw": 2, "chat": 2})
+        self.assertEqual(summary["delivered"], {"draw": 1, "chat": 1})
+        self.assertEqual(
+            summary["throughput"], {"sent_per_s": 1.0, "delivered_per_s": 1.0}
+        )
+        self.assertEqual(summary["latency_ms"]["draw"]["count"], 1)
+        self.assertEqual(
+            set(summary["latency_ms"]["chat"]), {"count", "p50", "p90", "p99", "max"}
+        )
+
+
+class ProtocolTests(SimpleTestCase):
+    def test_draw_points_travel_as_arrays_in_msgpack_only(self):
+        frame = {"type": "draw", **_segment(0, 1)}
+
+        self.assertEqual(protocol.decode_json(protocol.encode_json(frame)), frame)
+        packed = msgpack.unpackb(protocol.encode_msgpack(frame))
+        self.assertEqual(packed["from"], [0, 0])
+        self.assertEqual(packed["to"], [1, 0])
+        self.assertLess(
+            len(protocol.encode_msgpack(frame)), len(protocol.encode_json(frame))
+        )
+
+    def test_polylines_flatten_unless_a_point_has_extra_fields(self):
+        points = [{"x": 0, "y": 1}, {"x": 2, "y": 3}]
+        self.assertEqual(protocol.pack_points(points), [0, 1, 2, 3])
+
+        pressure = points + [{"x": 4, "y": 5, "p": 0.5}]
+        self.assertIs(protocol.pack_points(pressure), pressure)
+
+        frame = {"type": "draw_batch", "strokes": [{"points": points}]}
+        packed = msgpack.unpackb(protocol.encode_msgpack(frame))
+        self.assertEqual(packed["strokes"][0]["points"], [0, 1, 2, 3])
+
+    def test_binary_clients_send_points_as_pairs(self):
+        data = protocol.decode_msgpack(
+            msgpack.packb({"type": "draw", "from": [0, 0], "to": [1.5, 2]})
+        )
+        self.assertEqual(messages.point(data["to"]), {"x": 1.5, "y": 2})
+
+    def test_binary_copies_are_converted_once_from_the_text(self):
+        frame = {"type": "draw", **_segment(0, 1)}
+        prepared = protocol.prepare(frame)
+        self.assertEqual(set(prepared), {"text"})
+
+        # Recipients get their own copy of the event, with an equal text
+        copy = {"text": "".join(prepared["text"])}
+        self.assertEqual(protocol.binary(prepared), protocol.encode_msgpack(frame))
+        self.assertIs(protocol.binary(copy), protocol.binary(prepared))
+        self.assertEqual(protocol.binary({"bytes": b"ready"}), b"ready")
+
+    def test_other_frames_are_not_rewritten(self):
+        frame = {"type": "chat", "message": "hi", "from": [0, 0]}
+        self.assertEqual(msgpack.unpackb(protocol.encode_msgpack(frame)), frame)
+
+
+def _types(value):
+    if isinstance(value, dict):
+        return {key: _types(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_types(item) for item in value]
+    return type(value)
+
+
+class MessageSchemaTests(SimpleTestCase):
+    def test_missing_required_fields(self):
+        self.assertIs(messages.DRAW.validate({"from": [0, 0]}), messages.DRAW.missing)
+        self.assertIs(messages.CHAT.validate({}), messages.CHAT.missing)
+        self.assertIsNone(messages.JOIN.validate({}))
+
+    def test_optional_fields_default_when_missing_or_null(self):
+        data = {"from": [0, 0], "to": {"x": 1, "y": 2}, "color": None}
+        self.assertIsNone(messages.DRAW.validate(data))
+        self.assertEqual(
+            data,
+            {
+                "from": {"x": 0, "y": 0},
+                "to": {"x": 1, "y": 2},
+                "color": "#000000",
+                "size": 4,
+            },
+        )
+
+        join = {"since": None}
+        self.assertIsNone(messages.JOIN.validate(join))
+        self.assertEqual(join, {"since": None, "username": None, "features": ()})
+
+    def test_invalid_draw_fields(self):
+        invalid = messages.DRAW.invalid
+        cases = [
+            ({"from": [True, 0]}, "from"),
+            ({"from": [0, 2**31 + 1]}, "from"),
+            ({"from": [0, float("nan")]}, "from"),
+            ({"from": {"x": 0, "y": 0, "p": 1}}, "from"),
+            ({"from": {"x": 0}}, "from"),
+            ({"from": [0, 0, 0]}, "from"),
+            ({"to": "0,0"}, "to"),
+            ({"color": "url(x)"}, "color"),
+            ({"color": "#12345"}, "color"),
+            ({"size": 0}, "size"),
+            ({"size": messages.MAX_SIZE + 1}, "size"),
+        ]
+        for fields, field in cases:
+            with self.subTest(fields=fields):
+                data = {"from": [0, 0], "to": [1, 1], **fields}
+                self.assertIs(messages.DRAW.validate(data), invalid[field])
+
+    def test_erase_bbox_is_normalized(self):
+        data = {"bbox": "10,20,0,5"}
+        self.assertIsNone(messages.ERASE.validate(data))
+        self.assertEqual(data["bbox"], (0, 5, 10, 20))
+
+        for bbox in ([0, 0, 1], "a,b,c,d", [0, 0, 1, float("inf")], None):
+            with self.subTest(bbox=bbox):
+                self.assertIs(
+                    messages.ERASE.validate({"bbox": bbox}),
+                    messages.ERASE.invalid["bbox"],
+                )
+
+    def test_text_fields(self):
+        invalid = messages.JOIN.invalid
+        cases = [
+            ({"username": ""}, invalid["username"]),
+            ({"username": "x" * (messages.MAX_USERNAME + 1)}, invalid["username"]),
+            ({"features": ["draw_batch", 1]}, invalid["features"]),
+            ({"features": ["f"] * (messages.MAX_FEATURES + 1)}, invalid["features"]),
+            ({"since": "3"}, invalid["since"]),
+        ]
+        for data, error in cases:
+            with self.subTest(data=data):
+                self.assertIs(messages.JOIN.validate(data), error)
+
+        too_long = {"text": "x" * (messages.MAX_CHAT + 1)}
+        self.assertIs(messages.CHAT.validate(too_long), messages.CHAT.invalid["text"])
+
+
+class CanvasCodecTests(SimpleTestCase):
+    def assertRoundTrips(self, records):
+        decoded = canvas_codec.decode(canvas_codec.encode(records))
+        self.assertEqual(decoded, records)
+        # 3 == 3.0, so compare the types too
+        self.assertEqual(_types(decoded), _types(records))
+
+    def test_integer_and_float_columns(self):
+        self.assertRoundTrips([_segment(n, n + 1) for n in range(50)])
+        self.assertRoundTrips(
+            [{"x": 0.5, "y": 1e300, "color": "#fff", "size": 2.5}]
+        )
+
+    def test_mixed_columns_keep_their_number_types(self):
+        self.assertRoundTrips(
+            [
+                _segment(0, 3),
+                {"x": 3.0, "y": 0.25, "color": "#000000", "size": 4},
+                {"x": 7, "y": 2**40, "color": "#000000", "size": 4.0},
+            ]
+        )
+
+    def test_other_records_are_kept_as_they_are(self):
+        self.assertRoundTrips(
+            [{"type": "text", "x": 1}, _segment(0, 1), None, [1, 2]]
+        )
+
+
+class DrawCoalescerTests(SimpleTestCase):
+    async def test_contiguous_segments_merge_into_one_polyline(self):
+        layer = InMemoryChannelLayer()
+        _, receive = await _group_events(layer, "room_A", 1)
+        coalescer = coalescing.DrawCoalescer(layer, "room_A", 10, 64)
+
+        await coalescer.add("a", _segment(0, 1))
+        await coalescer.add("a", _segment(1, 2))
+        await coalescer.add("b", _segment(5, 6))
+        await coalescer.add("a", _segment(2, 3, color="#ff0000"))
+        await coalescer.flush()
+
+        (event,) = await receive()
+        frame = json.loads(event["frame"]["text"])
+        self.assertEqual(frame["type"], "draw_batch")
+        self.assertEqual(
+            [
+                ([p["x"] for p in stroke["points"]], stroke["color"])
+                for stroke in frame["strokes"]
+            ],
+            [([0, 1, 2], "#000000"), ([5, 6], "#000000"), ([2, 3], "#ff0000")],
+        )
+
+    async def test_window_and_segment_cap_flush(self):
+        layer = InMemoryChannelLayer()
+        _, receive = await _group_events(layer, "room_A", 2)
+        coalescer = coalescing.DrawCoalescer(layer, "room_A", 10, 2)
+
+        # The cap publishes at once, the window publishes the rest later
+        await coalescer.add("a", _segment(0, 1))
+        await coalescer.add("a", _segment(1, 2))
+        await coalescer.add("a", _segment(2, 3))
+        first, second = await receive()
+
+        self.assertEqual(len(json.loads(first["frame"]["text"])["strokes"]), 1)
+        strokes = json.loads(second["frame"]["text"])["strokes"]
+        self.assertEqual([p["x"] for p in strokes[0]["points"]], [2, 3])
+
+    async def test_events_carry_the_batch_text_only(self):
+        layer = InMemoryChannelLayer()
+        _, receive = await _group_events(layer, "room_A", 1)
+        coalescer = coalescing.DrawCoalescer(layer, "room_A", 10, 64)
+
+        await coalescer.add("a", _segment(0, 1))
+        await coalescer.flush()
+
+        (event,) = await receive()
+        self.assertEqual(set(event), {"type", "frame"})
+        self.assertEqual(set(event["frame"]), {"text"})
+
+    def test_legacy_frames_are_one_draw_per_segment(self):
+        batch = protocol.prepare(
+            {
+                "type": "draw_batch",
+                "strokes": [
+                    {
+                        "points": [
+                            {"x": 0, "y": 0},
+                            {"x": 1, "y": 0},
+                            {"x": 2, "y": 0},
+                        ],
+                        "color": "#000000",
+                        "size": 4,
+                    }
+                ],
+            }
+        )
+        frames = coalescing.legacy_frames(batch["text"])
+        self.assertEqual(
+            [json.loads(frame["text"]) for frame in frames],
+            [{"type": "draw", **_segment(0, 1)}, {"type": "draw", **_segment(1, 2)}],
+        )
+        # Every legacy recipient of the batch shares one expansion
+        self.assertIs(coalescing.legacy_frames(batch["text"]), frames)
+
+    def test_rooms_share_one_coalescer_until_released(self):
+        with self.settings(DRAW_BATCH_WINDOW_MS=10):
+            first = coalescing.acquire(None, "room_shared")
+            second = coalescing.acquire(None, "room_shared")
+            self.assertIs(first, second)
+            asyncio.run(coalescing.release("room_shared"))
+            asyncio.run(coalescing.release("room_shared"))
+            self.assertIsNot(coalescing.acquire(None, "room_shared"), first)
+            asyncio.run(coalescing.release("room_shared"))
+
+        with self.settings(DRAW_BATCH_WINDOW_MS=0):
+            self.assertIsNone(coalescing.acquire(None, "room_off"))
+
+
+def _candidate(n):
+    return {"candidate": f"candidate:{n} 1 udp 2122 10.0.0.{n} 5000 typ host"}
+
+
+class CandidateAggregatorTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+
+        async def deliver(sender, target, payloads):
+            self.batches.append((sender, target, payloads))
+
+        self.aggregator = signaling.CandidateAggregator(deliver, 10)
+
+    async def test_one_batch_per_window_without_duplicates(self):
+        for n in (1, 2, 1, 3):
+            await self.aggregator.add("ann", "bob", _candidate(n))
+        await self.aggregator.add("ann", "cat", _candidate(1))
+        self.assertEqual(self.batches, [])
+
+        await asyncio.sleep(0.05)
+        self.assertCountEqual(
+            self.batches,
+            [
+                ("ann", "bob", [_candidate(1), _candidate(2), _candidate(3)]),
+                ("ann", "cat", [_candidate(1)]),
+            ],
+        )
+
+    async def test_end_of_candidates_flushes_and_starts_over(self):
+        await self.aggregator.add("ann", "bob", _candidate(1))
+        await self.aggregator.add("ann", "bob", {"candidate": ""})
+        self.assertEqual(
+            self.batches, [("ann", "bob", [_candidate(1), {"candidate": ""}])]
+        )
+
+        # After an ICE restart the same candidate is news again
+        await self.aggregator.add("ann", "bob", _candidate(1))
+        await self.aggregator.add("ann", "bob", None)
+        self.assertEqual(self.batches[1], ("ann", "bob", [_candidate(1), None]))
+
+    async def test_cancel_drops_what_is_pending(self):
+        await self.aggregator.add("ann", "bob", _candidate(1))
+        self.aggregator.cancel()
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.batches, [])
+
+    def test_legacy_frames_are_one_candidate_each(self):
+        batch = protocol.prepare(
+            {
+                "type": "webrtc_candidates",
+                "payloads": [_candidate(1), None],
+                "sender": "ann",
+                "target": "bob",
+            }
+        )
+        frames = [
+            json.loads(frame["text"])
+            for frame in signaling.legacy_frames(batch["text"])
+        ]
+        self.assertEqual(
+            frames,
+            [
+                {
+                    "type": "webrtc_candidate",
+                    "payload": payload,
+                    "sender": "ann",
+                    "target": "bob",
+                }
+                for payload in (_candidate(1), None)
+            ],
+        )
+
+
+def _frame(n):
+    return {"text": str(n)}
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def make_queue(self, policy, maxsize=3):
+        self.overflows = 0
+
+        async def on_overflow():
+            self.overflows += 1
+
+        async def send(prepared):
+            pass
+
+        return outbound.OutboundQueue(send, maxsize, policy, on_overflow)
+
+    def texts(self, queue):
+        return [prepared["text"] for _, prepared, _ in queue._items]
+
+    def test_drop_discards_the_oldest_draw_frame(self):
+        queue = self.make_queue(outbound.DROP)
+        queue.put(_frame("chat"))
+        queue.put(_frame(1), droppable=True)
+        queue.put(_frame(2), droppable=True)
+        queue.put(_frame(3), droppable=True)
+
+        self.assertEqual(self.texts(queue), ["chat", "2", "3"])
+        self.assertEqual(queue.dropped, 1)
+
+    def test_coalesce_replaces_draw_frames_with_one_resync(self):
+        queue = self.make_queue(outbound.COALESCE)
+        queue.put(_frame(1), droppable=True)
+        queue.put(_frame("chat"))
+        queue.put(_frame(2), droppable=True)
+        queue.put(_frame(3), droppable=True)
+
+        resync = outbound.RESYNC_FRAME["text"]
+        self.assertEqual(self.texts(queue), ["chat", resync, "3"])
+        self.assertEqual(queue.coalesced, 2)
+
+    async def test_overflow_without_draw_frames_disconnects_once(self):
+        for policy in (outbound.DROP, outbound.DISCONNECT):
+            queue = self.make_queue(policy, maxsize=1)
+            queue.put(_frame("chat"))
+            queue.put(_frame("chat"))
+            queue.put(_frame("chat"))
+            await asyncio.sleep(0)
+            self.assertEqual(self.overflows, 1)
+            self.assertEqual(len(queue), 1)
+
+    async def test_writer_sends_in_order_and_flush_waits_for_it(self):
+        sent = []
+
+        async def send(prepared):
+            await asyncio.sleep(0)
+            sent.append(prepared["text"])
+
+        queue = outbound.OutboundQueue(send, 10, outbound.DROP, None)
+        queue.start()
+        for n in range(5):
+            queue.put(_frame(n), droppable=n % 2)
+        await queue.flush(timeout=1)
+        queue.stop()
+
+        self.assertEqual(sent, ["0", "1", "2", "3", "4"])
+        self.assertEqual(queue.high_water, 5)
+
+    async def test_a_failed_send_stops_the_queue_and_closes(self):
+        closed = asyncio.Event()
+
+        async def send(prepared):
+            raise OSError("connection reset")
+
+        async def on_error():
+            closed.set()
+
+        queue = outbound.OutboundQueue(send, 10, outbound.DROP, None, on_error)
+        queue.start()
+        queue.put(_frame(1))
+        queue.put(_frame(2))
+
+        with self.assertLogs("rooms.outbound", "ERROR"):
+            await asyncio.wait_for(closed.wait(), 1)
+        self.assertTrue(queue._writer.done())
+        self.assertEqual(len(queue), 0)
+        await asyncio.wait_for(queue.flush(timeout=5), 0.1)
+
+        queue.put(_frame(3))
+        self.assertEqual(len(queue), 0)
+
+
+class DebugLoggingTests(SimpleTestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        for patcher in (
+            mock.patch.dict(eventlog.DEBUG_ROOMS, clear=True),
+            mock.patch.dict(eventlog._loaded, clear=True),
+            mock.patch.object(eventlog, "_redis_loop", None),
+            mock.patch.object(eventlog, "_redis_url", lambda: "redis://debug"),
+            mock.patch(
+                "redis.Redis.from_url",
+                lambda url: fakeredis.FakeRedis(server=server),
+            ),
+            mock.patch(
+                "redis.asyncio.Redis.from_url",
+                lambda url: fakeredis.FakeAsyncRedis(server=server),
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_toggle_runs_out(self):
+        eventlog.set_debug("R", 60)
+        self.assertTrue(eventlog._debugging("R"))
+        eventlog.DEBUG_ROOMS["R"] = time.monotonic() - 1
+        self.assertFalse(eventlog._debugging("R"))
+        self.assertNotIn("R", eventlog.DEBUG_ROOMS)
+
+    async def test_workers_read_the_stored_toggle_on_join(self):
+        eventlog.store_debug("R", 60)
+        await eventlog.load_debug("R")
+        self.assertAlmostEqual(
+            eventlog.DEBUG_ROOMS["R"], time.monotonic() + 60, delta=1
+        )
+
+        # Joins within LOAD_DEBUG_TTL do not go back to Redis
+        eventlog.store_debug("R", 0)
+        await eventlog.load_debug("R")
+        self.assertTrue(eventlog._debugging("R"))
+
+        eventlog._loaded["R"] = time.monotonic()
+        await eventlog.load_debug("R")
+        self.assertFalse(eventlog._debugging("R"))
+
+
+class RoomDebugLoggingViewTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            "admin@example.com", is_staff=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.url = reverse("room_debug_logging", args=["R"])
+
+    def test_enabled_must_be_a_boolean(self):
+        layer = mock.Mock(group_send=mock.AsyncMock())
+        with (
+            mock.patch.object(eventlog, "store_debug") as store,
+            mock.patch("rooms.views.get_channel_layer", return_value=layer),
+        ):
+            for body in ({}, {"enabled": "maybe"}, {"enabled": [1]}):
+                with self.subTest(body=body):
+                    response = self.client.post(self.url, body, format="json")
+                    self.assertEqual(response.status_code, 400)
+            store.assert_not_called()
+
+            response = self.client.post(self.url, {"enabled": False}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["debug"], False)
+        store.assert_called_once_with("R", 0)
+        layer.group_send.assert_called_once_with(
+            "room_R", {"type": "log_control", "ttl": 0}
+        )
+
+
+class FlushTimerTests(SimpleTestCase):
+    async def test_flush_runs_once_per_round_and_its_error_is_logged(self):
+        calls = []
+
+        async def flush(key):
+            calls.append(key)
+            raise ValueError(key)
+
+        timer = timers.FlushTimer(0.001, flush, "room_A")
+        with self.assertLogs("rooms.timers", "ERROR") as logs:
+            timer.schedule()
+            timer.schedule()
+            self.assertTrue(timer.scheduled)
+            await asyncio.sleep(0.01)
+            while timers._tasks:
+                await asyncio.sleep(0)
+
+        self.assertEqual(calls, ["room_A"])
+        self.assertFalse(timer.scheduled)
+        self.assertIn("ValueError: room_A", logs.output[0])
+
+
+class StrokeLogWriterTests(SimpleTestCase):
+    async def test_failed_write_keeps_what_was_not_written(self):
+        writer = canvas.StrokeLogWriter(10, 100, 3)
+        written = []
+
+        async def write(pending):
+            # The first room gets its row, then the database goes away
+            code = next(iter(pending))
+            written.append((code, pending.pop(code)))
+            writer.append("B", "late")
+            raise OSError("database is down")
+
+        writer.append("A", "a1")
+        writer.append("B", "b1")
+        with (
+            mock.patch.object(writer, "_write", write),
+            self.assertLogs("rooms.canvas", "ERROR"),
+        ):
+            await writer.flush()
+
+        self.assertEqual(written, [("A", ["a1"])])
+        self.assertEqual(writer._pending, {"B": ["b1", "late"]})
+        self.assertTrue(writer._timer.scheduled)
+        writer._timer.cancel()
+
+    async def test_rooms_that_keep_failing_are_dropped(self):
+        writer = canvas.StrokeLogWriter(10, 100, 2)
+        write = mock.AsyncMock(side_effect=OSError("database is down"))
+        writer.append("A", "a1")
+
+        with mock.patch.object(writer, "_write", write):
+            with self.assertLogs("rooms.canvas", "ERROR"):
+                for _ in range(2):
+                    await writer.flush()
+            self.assertEqual(writer._pending, {"A": ["a1"]})
+
+            with self.assertLogs("rooms.canvas", "ERROR") as logs:
+                await writer.flush()
+
+        self.assertEqual(writer._pending, {})
+        self.assertIn("Dropping 1 strokes of room A", logs.output[-1])
+        self.assertFalse(writer._timer.scheduled)
+
+
+class StrokeLogWriterDatabaseTests(TestCase):
+    def test_a_failing_room_does_not_hold_back_the_others(self):
+        user = get_user_model().objects.create_user("owner@example.com")
+        broken, fine = (
+            Room.objects.create(name=name, created_by=user) for name in "AB"
+        )
+        append = CanvasState.append
+
+        def fail_for_broken(room_id, segments):
+            if room_id == broken.pk:
+                raise DatabaseError("archive missing")
+            return append(room_id, segments)
+
+        writer = canvas.StrokeLogWriter(10, 100, 3)
+        pending = {
+            broken.code: [_segment(0, 1)],
+            fine.code: [_segment(1, 2)],
+            "deleted": [_segment(2, 3)],
+        }
+        # The function behind database_sync_to_async, on this thread
+        write = canvas.StrokeLogWriter.__dict__["_write"].func
+        with (
+            mock.patch.object(CanvasState, "append", side_effect=fail_for_broken),
+            self.assertLogs("rooms.canvas", "ERROR"),
+        ):
+            write(writer, pending)
+
+        self.assertEqual(pending, {broken.code: [_segment(0, 1)]})
+        self.assertEqual(CanvasState.objects.get(room=fine).version, 1)
+
+    def test_a_failing_compaction_does_not_hold_back_the_others(self):
+        user = get_user_model().objects.create_user("owner@example.com")
+        rooms = [Room.objects.create(name=name, created_by=user) for name in "AB"]
+        compact = CanvasState.compact
+
+        def fail_first(state):
+            if state.room_id == rooms[0].pk:
+                raise DatabaseError("disk full")
+            return compact(state)
+
+        writer = canvas.StrokeLogWriter(10, 1, 3)
+        pending = {room.code: [_segment(0, 1)] for room in rooms}
+        write = canvas.StrokeLogWriter.__dict__["_write"].func
+        with (
+            mock.patch.object(CanvasState, "compact", fail_first),
+            self.assertLogs("rooms.canvas", "ERROR"),
+        ):
+            write(writer, pending)
+
+        self.assertEqual(pending, {})
+        for room in rooms:
+            self.assertEqual(CanvasState.objects.get(room=room).version, 1)
+        self.assertEqual(writer._rows, {rooms[0].code: 1, rooms[1].code: 0})
+
+
+class CanvasStateViewTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user("owner@example.com")
+        self.room = Room.objects.create(name="Sketches", created_by=user)
+        CanvasState.append(self.room.pk, [_segment(0, 1)])
+        CanvasState.append(self.room.pk, [_segment(1, 2)])
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.url = reverse("canvas_state", args=[self.room.code])
+
+    def test_partial_responses_have_their_own_etag(self):
+        full = self.client.get(self.url)
+        since = self.client.get(self.url, {"since": 1})
+        bbox = self.client.get(self.url, {"bbox": "0,0,1,1"})
+
+        self.assertEqual(since.data["data"], [_segment(1, 2)])
+        etags = {full["ETag"], since["ETag"], bbox["ETag"]}
+        self.assertEqual(len(etags), 3)
+
+        # Only the same query with the same ETag is not modified
+        again = self.client.get(
+            self.url, {"since": 1}, HTTP_IF_NONE_MATCH=since["ETag"]
+        )
+        self.assertEqual(again.status_code, 304)
+        other = self.client.get(self.url, HTTP_IF_NONE_MATCH=since["ETag"])
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(len(other.data["data"]), 2)
+
+
+class TileCacheTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user("owner@example.com")
+        self.room = Room.objects.create(name="Sketches", created_by=user)
+        CanvasState.append(self.room.pk, [_segment(10, 20)])
+        CanvasState.append(self.room.pk, [_segment(5000, 5010)])
+
+        # Room ids come back after each test's rollback
+        self.index = spatial.SpatialIndex(8, 256)
+        patcher = mock.patch.object(spatial, "_index", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = raster.TileCache(8)
+
+    def render(self):
+        state = CanvasState.objects.get(room=self.room)
+        self.cache.png(state, 0, 0, 0)
+        return self.cache._tiles[(self.room.pk, 0, 0, 0)]
+
+    def painted(self, tile, x, y):
+        start = y * raster.TILE_SIZE * 4 + x * 4
+        return tile.pixels[start : start + 4] != b"\x00" * 4
+
+    def test_tiles_draw_only_the_records_under_them_outside_the_cache_lock(self):
+        drawn = []
+        draw_tile = raster.Tile.draw
+
+        def draw(tile, record):
+            self.assertFalse(self.cache._lock.locked())
+            drawn.append(record)
+            return draw_tile(tile, record)
+
+        with mock.patch.object(raster.Tile, "draw", draw):
+            tile = self.render()
+
+        self.assertEqual(drawn, [_segment(10, 20)])
+        self.assertTrue(self.painted(tile, 15, 1))
+
+    def test_erased_strokes_disappear_from_cached_tiles(self):
+        self.assertTrue(self.painted(self.render(), 15, 1))
+        CanvasState.erase(self.room.pk, (14, -1, 16, 1))
+        self.assertFalse(self.painted(self.render(), 15, 1))
+
+    def test_room_bounds_are_evicted_like_tiles(self):
+        state = CanvasState.objects.get(room=self.room)
+        self.assertEqual(self.cache.bounds(state), [8, -2, 5012, 2])
+
+        for room_id in range(1000, 1008):
+            other = mock.Mock(room_id=room_id, version=0, iter_data=list)
+            self.assertIsNone(self.cache.bounds(other))
+        self.assertEqual(len(self.cache._bounds), 8)
+        self.assertNotIn(self.room.pk, self.cache._bounds)
+
+
+class SpatialIndexTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user("owner@example.com")
+        self.room = Room.objects.create(name="Sketches", created_by=user)
+        self.diagonal = {
+            "from": {"x": 0, "y": 0},
+            "to": {"x": 100, "y": 100},
+            "color": "#000000",
+            "size": 2,
+        }
+        CanvasState.append(self.room.pk, [self.diagonal, _segment(10, 20)])
+
+        self.index = spatial.SpatialIndex(8, 16)
+        patcher = mock.patch.object(spatial, "_index", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def state(self):
+        return CanvasState.objects.get(room=self.room)
+
+    def test_hits_need_the_stroke_not_just_its_bounds(self):
+        state = self.state()
+        self.assertEqual(
+            self.index.within(state, (80, 0, 100, 20)), [self.diagonal]
+        )
+        self.assertEqual(self.index.hit(state, (80, 0, 100, 20)), [])
+        self.assertEqual(self.index.hit(state, (0, -1, 15, 1)), [0, 1])
+
+    def test_erase_indexes_before_taking_the_row_lock(self):
+        added = []
+        add, hit = spatial.GridIndex.add, self.index.hit
+
+        def add_spy(grid, record):
+            added.append(record)
+            return add(grid, record)
+
+        def locked_hit(state, bbox):
+            before = len(added)
+            result = hit(state, bbox)
+            self.assertEqual(len(added), before)
+            return result
+
+        with (
+            mock.patch.object(spatial.GridIndex, "add", add_spy),
+            mock.patch.object(self.index, "hit", locked_hit),
+        ):
+            version, erased = CanvasState.erase(self.room.pk, (12, -1, 14, 1))
+
+        self.assertEqual((version, erased), (2, 1))
+        self.assertEqual(len(added), 2)
+        self.assertEqual(
+            self.index.within(self.state(), (0, -5, 100, 5)), [self.diagonal]
+        )
+
+
+class ListRoomsViewTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user("owner@example.com")
+        self.rooms = [
+            Room.objects.create(name=name, created_by=user, is_private=n % 2)
+            for n, name in enumerate(["alpha", "alps", "beta", "gamma", "alto"])
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.url = reverse("list_rooms")
+
+    def codes(self, rooms):
+        return [room["code"] for room in rooms]
+
+    def test_cursor_pages_cover_every_room_once_newest_first(self):
+        seen, url = [], self.url + "?page_size=2"
+        while url:
+            page = self.client.get(url).data
+            self.assertLessEqual(len(page["results"]), 2)
+            seen += self.codes(page["results"])
+            url = page["next"]
+
+        newest_first = sorted(
+            self.rooms, key=lambda room: (room.created_at, room.pk), reverse=True
+        )
+        self.assertEqual(seen, [room.code for room in newest_first])
+
+    def test_bad_cursors_are_not_found(self):
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_filters_and_member_counts(self):
+        response = self.client.get(self.url, {"name": "al", "is_private": "false"})
+        self.assertEqual(
+            sorted(room["name"] for room in response.data["results"]),
+            ["alpha", "alto"],
+        )
+
+        store = presence.InMemoryPresenceBackend()
+        asyncio.run(store.join(self.rooms[0].code, "ann", "c.ann"))
+        with mock.patch("rooms.views.get_presence_store", return_value=store):
+            response = self.client.get(self.url, {"members": "true"})
+        members = {room["code"]: room["members"] for room in response.data["results"]}
+        self.assertEqual(members[self.rooms[0].code], 1)
+        self.assertEqual(members[self.rooms[2].code], 0)
+
+
+class RoomCacheInvalidationTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user("owner@example.com")
+        self.rooms = [
+            Room.objects.create(name=name, created_by=user) for name in "ABC"
+        ]
+        self.cache = room_cache.RoomMetaCache(hosts=["redis://cache"])
+        self.cache._sync_redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(room_cache, "_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bulk_delete_invalidates_once_after_commit(self):
+        redis_client = self.cache._sync_redis
+        for room in self.rooms:
+            redis_client.set(self.cache._key(room.code), "{}")
+        pubsub = redis_client.pubsub()
+        pubsub.subscribe(room_cache.INVALIDATE_CHANNEL)
+        pubsub.get_message()
+
+        with (
+            mock.patch.object(
+                redis_client, "pipeline", wraps=redis_client.pipeline
+            ) as pipeline,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            Room.objects.all().delete()
+            self.assertEqual(len(redis_client.keys()), 3)
+
+        self.assertEqual(redis_client.keys(), [])
+        self.assertEqual(pipeline.call_count, 1)
+        published = set()
+        while message := pubsub.get_message():
+            published.add(message["data"].decode())
+        self.assertEqual(published, {room.code for room in self.rooms})
+
+    def test_redis_errors_are_logged_not_raised(self):
+        broken = mock.Mock()
+        broken.pipeline.return_value.execute.side_effect = redis.ConnectionError()
+        self.cache._sync_redis = broken
+
+        with (
+            self.assertLogs("rooms.room_cache", "ERROR"),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            self.rooms[0].save()
+
+
+class RoomLifecycleTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user("owner@example.com")
+        self.room = Room.objects.create(name="Sketches", created_by=user)
+        CanvasState.append(self.room.pk, [_segment(0, 1), _segment(1, 2)])
+
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        overridden = self.settings(ROOM_ARCHIVE_DIR=archive_dir)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+        # Deleting rooms invalidates the room cache after commit
+        cache = room_cache.RoomMetaCache(hosts=["redis://cache"])
+        cache._sync_redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(room_cache, "_cache", cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = lifecycle.archive_path(self.room.pk)
+
+    def test_restore_continues_the_version_and_removes_the_file(self):
+        before = CanvasState.objects.get(room=self.room)
+        data = before.load_data()
+        self.assertTrue(lifecycle.archive_room(self.room.pk))
+        self.assertTrue(os.path.exists(self.path))
+        self.assertFalse(CanvasState.objects.filter(room=self.room).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            state = CanvasState.for_room(self.room.pk)
+
+        self.assertEqual(state.version, before.version + 1)
+        self.assertEqual(state.load_data(), data)
+        self.room.refresh_from_db()
+        self.assertIsNone(self.room.canvas_archived_at)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_missing_archive_keeps_the_room_archived(self):
+        lifecycle.archive_room(self.room.pk)
+        os.remove(self.path)
+
+        with self.assertRaises(lifecycle.ArchiveMissing):
+            CanvasState.for_room(self.room.pk)
+
+        self.room.refresh_from_db()
+        self.assertIsNotNone(self.room.canvas_archived_at)
+        self.assertFalse(CanvasState.objects.filter(room=self.room).exists())
+
+    def test_expired_rooms_lose_their_files_only_after_commit(self):
+        lifecycle.archive_room(self.room.pk)
+        Room.objects.filter(pk=self.room.pk).update(
+            last_activity_at=timezone.now() - timedelta(days=2)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(lifecycle.delete_expired_rooms(timedelta(days=1)), 1)
+            self.assertFalse(Room.objects.filter(pk=self.room.pk).exists())
+            self.assertTrue(os.path.exists(self.path))
+
+        self.assertFalse(os.path.exists(self.path))
+
+
+class RoomConsumerTests(SimpleTestCase):
+    databases = {"default"}
+
+    async def test_disconnect_after_a_failed_connect(self):
+        consumer = RoomConsumer()
+        consumer.scope = {
+            "url_route": {"kwargs": {"room_code": "R"}},
+            "user": AnonymousUser(),
+        }
+        consumer.channel_layer = InMemoryChannelLayer()
+        consumer.channel_name = await consumer.channel_layer.new_channel()
+        meta = {"exists": True, "max_members": 10}
+        cache = mock.Mock(get=mock.AsyncMock(return_value=meta))
+
+        with (
+            self.settings(WS_AUTH_REQUIRED=False),
+            mock.patch("rooms.consumers.get_room_cache", return_value=cache),
+            mock.patch(
+                "rooms.consumers.get_presence_store", side_effect=RuntimeError
+            ),
+            self.assertRaises(RuntimeError),
+        ):
+            await consumer.connect()
+
+        await consumer.disconnect(1006)
+        self.assertNotIn("R", ratelimit._ROOMS)
+
+    async def test_erase_in_a_deleted_room_is_answered_with_not_found(self):
+        consumer = RoomConsumer()
+        consumer.room_code = "gone"
+        consumer.draw_coalescer = None
+        consumer.outbound = mock.Mock()
+        writer = mock.Mock(flush=mock.AsyncMock())
+
+        with (
+            mock.patch("rooms.consumers.get_stroke_log_writer", return_value=writer),
+            mock.patch.object(metrics, "group_send") as group_send,
+        ):
+            await consumer.on_erase({"bbox": (0, 0, 10, 10)})
+
+        consumer.outbound.put.assert_called_once_with(
+            messages.ROOM_NOT_FOUND.prepared
+        )
+        group_send.assert_not_called()
+
+
+class RateLimitTests(SimpleTestCase):
+    def test_buckets_refill_at_their_rate_up_to_the_burst(self):
+        bucket = ratelimit.TokenBucket(rate=2, burst=3, now=0)
+        for _ in range(3):
+            self.assertEqual(bucket.delay(0), 0.0)
+            bucket.spend()
+        self.assertAlmostEqual(bucket.delay(0), 0.5)
+        self.assertAlmostEqual(bucket.delay(0.25), 0.25)
+        self.assertEqual(bucket.delay(100), 0.0)
+        self.assertEqual(bucket.tokens, 3)
+
+    def test_room_bucket_limits_and_nothing_is_spent_while_waiting(self):
+        connection = ratelimit.TokenBucket(rate=10, burst=10, now=0)
+        room = ratelimit.TokenBucket(rate=1, burst=1, now=0)
+        budget = ratelimit.Budget("draw", "drop", connection, room)
+
+        self.assertEqual(budget.acquire(0), 0.0)
+        self.assertAlmostEqual(budget.acquire(0), 1.0)
+        self.assertEqual(connection.tokens, 9)
+        self.assertAlmostEqual(budget.acquire(0.5), 0.5)
+        self.assertEqual(budget.acquire(1), 0.0)
+
+    def test_connections_of_a_room_share_its_buckets(self):
+        first = ratelimit.acquire("R", 0)
+        second = ratelimit.acquire("R", 0)
+        self.addCleanup(ratelimit._ROOMS.pop, "R", None)
+
+        self.assertIs(first["draw"].room, second["draw"].room)
+        self.assertIsNot(first["draw"].connection, second["draw"].connection)
+        self.assertIs(first["webrtc_offer"], first["webrtc_candidate"])
+        self.assertIsNone(first[ratelimit.INVALID].room)
+
+        ratelimit.release("R")
+        self.assertIn("R", ratelimit._ROOMS)
+        ratelimit.release("R")
+        self.assertNotIn("R", ratelimit._ROOMS)
+
+    async def test_invalid_frames_are_charged_before_any_reply(self):
+        consumer = RoomConsumer()
+        consumer.room_code = "R"
+        consumer.binary = False
+        consumer.outbound = mock.Mock()
+        consumer.budgets = ratelimit.acquire("R", time.monotonic())
+        self.addCleanup(ratelimit.release, "R")
+        burst = settings.WS_RATE_LIMITS[ratelimit.INVALID]["burst"]
+
+        with mock.patch.object(lifecycle, "get_activity_tracker") as tracker:
+            for _ in range(burst + 5):
+                await consumer.receive(text_data="{not json")
+            await consumer.receive(text_data='{"type": "nope"}')
+
+        frames = [call.args[0] for call in consumer.outbound.put.call_args_list]
+        self.assertEqual(frames.count(messages.INVALID_JSON.prepared), burst)
+        limited = [json.loads(f["text"]) for f in frames[burst:]]
+        self.assertEqual(len(limited), 1)
+        self.assertEqual(limited[0]["code"], "rate_limited")
+        self.assertEqual(limited[0]["limit"], ratelimit.INVALID)
+        tracker.assert_not_called()
+
+
+class PresenceBackendTests:
+    """
+    Cases run against every presence backend; subclasses provide
+    ``make_store``. The clock is ``rooms.presence._now_ms``, moved by
+    ``advance``.
+    """
+
+    def setUp(self):
+        # Near the real clock: Redis expires keys by it (PEXPIREAT)
+        self.now = int(time.time() * 1000)
+        patcher = mock.patch.object(presence, "_now_ms", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = self.make_store()
+
+    def advance(self, seconds):
+        self.now += int(seconds * 1000)
+
+    async def test_join_and_leave(self):
+        self.assertEqual(await self.store.join("R", "ann", "c.ann"), (True, ["ann"]))
+        joined, users = await self.store.join("R", "bob", "c.bob")
+        self.assertTrue(joined)
+        self.assertEqual(sorted(users), ["ann", "bob"])
+        self.assertEqual(await self.store.channel_for("R", "bob"), "c.bob")
+
+        self.assertEqual(await self.store.leave("R", "bob", "c.bob"), ["ann"])
+        self.assertEqual(await self.store.members("R"), ["ann"])
+        self.assertIsNone(await self.store.channel_for("R", "bob"))
+        self.assertEqual(await self.store.counts(["R", "empty"]), {"R": 1, "empty": 0})
+        self.assertEqual(self.store.counts_sync(["R", "empty"]), {"R": 1, "empty": 0})
+
+    async def test_full_room_rejects_newcomers_only(self):
+        await self.store.join("R", "ann", "c.ann", max_members=1)
+        self.assertEqual(
+            await self.store.join("R", "bob", "c.bob", max_members=1),
+            (False, ["ann"]),
+        )
+        # Reconnecting under the same name is not a newcomer
+        joined, _ = await self.store.join("R", "ann", "c.ann2", max_members=1)
+        self.assertTrue(joined)
+
+    async def test_members_expire_without_heartbeat(self):
+        await self.store.join("R", "ann", "c.ann")
+        await self.store.join("R", "bob", "c.bob")
+        self.advance(self.store.ttl / 2)
+        await self.store.heartbeat("R", "ann", "c.ann")
+        self.advance(self.store.ttl / 2 + 1)
+
+        self.assertEqual(await self.store.counts(["R"]), {"R": 1})
+        self.assertIsNone(await self.store.channel_for("R", "bob"))
+        joined, users = await self.store.join("R", "cat", "c.cat")
+        self.assertEqual(sorted(users), ["ann", "cat"])
+
+    async def test_heartbeat_brings_back_an_expired_member(self):
+        await self.store.join("R", "ann", "c.ann")
+        self.advance(self.store.ttl + 1)
+        self.assertEqual(await self.store.members("R"), [])
+
+        await self.store.heartbeat("R", "ann", "c.ann")
+        self.assertEqual(await self.store.counts(["R"]), {"R": 1})
+        self.assertEqual(await self.store.channel_for("R", "ann"), "c.ann")
+
+    async def test_old_socket_closing_after_a_reconnect(self):
+        await self.store.join("R", "ann", "c.old")
+        await self.store.join("R", "ann", "c.new")
+
+        self.assertEqual(await self.store.leave("R", "ann", "c.old"), ["ann"])
+        self.assertEqual(await self.store.channel_for("R", "ann"), "c.new")
+        # Nor does its last heartbeat take the name back
+        await self.store.heartbeat("R", "ann", "c.old")
+        self.assertEqual(await self.store.channel_for("R", "ann"), "c.new")
+
+    async def test_joining_again_under_a_new_name_drops_the_old_one(self):
+        await self.store.join("R", "ann", "c.1")
+        await self.store.join("R", "keep", "c.2")
+        joined, users = await self.store.join("R", "bob", "c.1", replaces="ann")
+
+        self.assertTrue(joined)
+        self.assertEqual(sorted(users), ["bob", "keep"])
+        self.assertIsNone(await self.store.channel_for("R", "ann"))
+        # Never another connection's entry
+        await self.store.join("R", "eve", "c.1", replaces="keep")
+        self.assertEqual(await self.store.channel_for("R", "keep"), "c.2")
+
+
+class InMemoryPresenceTests(PresenceBackendTests, SimpleTestCase):
+    def make_store(self):
+        return presence.InMemoryPresenceBackend(ttl=30)
+
+
+class FakeRedisPresenceBackend(presence.RedisPresenceBackend):
+    """
+    RedisPresenceBackend on fakeredis; hosts with the same URL share data.
+    """
+
+    def _connect(self, url):
+        return fakeredis.FakeAsyncRedis.from_url(url)
+
+    def _connect_sync(self, url):
+        return fakeredis.FakeRedis.from_url(url)
+
+
+class RedisPresenceTests(PresenceBackendTests, SimpleTestCase):
+    """
+    The Lua scripts and pipelines of RedisPresenceBackend, with a fake
+    Redis server of its own per test.
+    """
+
+    def make_store(self):
+        return FakeRedisPresenceBackend(hosts=[f"redis://{self.id()}/0"], ttl=30)
+
+    async def asyncTearDown(self):
+        if self.store._listener is not None:
+            self.store._listener.cancel()
+
+    async def test_rooms_shard_over_hosts(self):
+        store = FakeRedisPresenceBackend(
+            hosts=[f"redis://{self.id()}-{n}/0" for n in range(2)], ttl=30
+        )
+        for code in ("R1", "R2", "R3", "R4"):
+            await store.join(code, "ann", f"c.{code}")
+        self.assertEqual(
+            await store.counts(["R1", "R2", "R3", "R4"]),
+            {"R1": 1, "R2": 1, "R3": 1, "R4": 1},
+        )
+        self.assertEqual(len({id(client) for client in store._clients}), 2)
+        store._listener.cancel()
+
+    async def test_lost_invalidations_resubscribe_and_drop_the_caches(self):
+        self.store._client("R")
+        client = self.store._clients[0]
+        broken = mock.Mock(
+            subscribe=mock.AsyncMock(side_effect=redis.ConnectionError),
+            aclose=mock.AsyncMock(),
+        )
+        pubsubs = [broken, client.pubsub()]
+        self.store._cache["R"] = (time.monotonic() + 60, ["ghost"])
+
+        with (
+            mock.patch.object(client, "pubsub", side_effect=pubsubs),
+            mock.patch.object(presence, "LISTEN_RETRY", 0.01),
+            self.assertLogs("rooms.presence", "WARNING"),
+        ):
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if not self.store._cache:
+                    break
+
+        self.assertEqual(self.store._cache, {})
+        broken.aclose.assert_awaited_once()
+        await self.store.members("R")
+        await client.publish(presence.INVALIDATE_CHANNEL, "R")
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if "R" not in self.store._cache:
+                break
+        self.assertNotIn("R", self.store._cache)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    WS_AUTH_REQUIRED=False,
+    WS_LOG_SAMPLING={"default": 0.0},
+)
+class RoomSocketTests(TestCase):
+    """
+    The WebSocket protocol end to end in this process: the ASGI routing
+    and JWT middleware of whiteboard_backend.asgi, the in-memory channel
+    layer and presence, as in benchmarks.ws_settings.
+    """
+
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(
+                presence, "_store", presence.InMemoryPresenceBackend(ttl=30)
+            ),
+            mock.patch.object(
+                room_cache, "_cache", room_cache.RoomMetaCache(hosts=[])
+            ),
+            mock.patch.object(canvas, "_writer", None),
+            mock.patch.object(lifecycle, "get_activity_tracker"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        user = get_user_model().objects.create_user("owner@example.com")
+        self.room = Room.objects.create(name="Sketches", created_by=user)
+        self.app = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def connect(self, username, subprotocols=None, **join):
+        client = WebsocketCommunicator(
+            self.app, f"/ws/room/{self.room.code}/", subprotocols=subprotocols
+        )
+        connected, subprotocol = await client.connect()
+        self.assertTrue(connected)
+        if subprotocols:
+            self.assertEqual(subprotocol, protocol.MSGPACK_SUBPROTOCOL)
+        await self.send(client, {"type": "join", "username": username, **join})
+        return client
+
+    async def send(self, client, frame):
+        if protocol.MSGPACK_SUBPROTOCOL in client.scope["subprotocols"]:
+            await client.send_to(bytes_data=msgpack.packb(frame))
+        else:
+            await client.send_json_to(frame)
+
+    async def received(self, client):
+        """
+        Every frame sent to ``client`` until it goes quiet, decoded; a
+        close is returned as the ``websocket.close`` message itself.
+        """
+        frames = []
+        while not await client.receive_nothing(timeout=0.2):
+            message = await client.receive_output()
+            if message["type"] == "websocket.close":
+                frames.append(message)
+            elif message.get("bytes") is not None:
+                frames.append(msgpack.unpackb(message["bytes"]))
+            else:
+                frames.append(json.loads(message["text"]))
+        return frames
+
+    async def test_joining_with_since_catches_up_on_the_canvas(self):
+        await database_sync_to_async(CanvasState.append)(
+            self.room.pk, [_segment(0, 1), _segment(1, 2)]
+        )
+        client = await self.connect("ann", since=0)
+
+        # The sync goes straight out, the member list through the group
+        frames = {frame["type"]: frame for frame in await self.received(client)}
+        self.assertEqual(frames["user_list"]["users"], ["ann"])
+        self.assertEqual(
+            frames["canvas_sync"],
+            {
+                "type": "canvas_sync",
+                "version": 1,
+                "full": False,
+                "data": [_segment(0, 1), _segment(1, 2)],
+            },
+        )
+        await client.disconnect()
+
+    async def test_offers_reach_only_their_target(self):
+        clients = [await self.connect(name) for name in ("ann", "bob", "cid")]
+        for client in clients:
+            await self.received(client)
+
+        await self.send(
+            clients[0],
+            {
+                "type": "webrtc_offer",
+                "sender": "ann",
+                "target": "cid",
+                "payload": {"sdp": "x"},
+            },
+        )
+        self.assertEqual(await self.received(clients[0]), [])
+        self.assertEqual(await self.received(clients[1]), [])
+        self.assertEqual(
+            await self.received(clients[2]),
+            [
+                {
+                    "type": "webrtc_offer",
+                    "payload": {"sdp": "x"},
+                    "sender": "ann",
+                    "target": "cid",
+                }
+            ],
+        )
+        for client in clients:
+            await client.disconnect()
+
+    async def test_msgpack_clients_get_draw_batches(self):
+        binary = await self.connect(
+            "ann", [protocol.MSGPACK_SUBPROTOCOL], features=["draw_batch"]
+        )
+        legacy = await self.connect("bob")
+        await self.received(binary)
+        await self.received(legacy)
+
+        for x in range(2):
+            await self.send(
+                legacy, {"type": "draw", "from": [x, 0], "to": [x + 1, 0]}
+            )
+
+        self.assertEqual(
+            await self.received(binary),
+            [
+                {
+                    "type": "draw_batch",
+                    "strokes": [
+                        {"points": [0, 0, 1, 0, 2, 0], "color": "#000000", "size": 4}
+                    ],
+                }
+            ],
+        )
+        self.assertEqual(
+            [frame["type"] for frame in await self.received(legacy)],
+            ["draw", "draw"],
+        )
+        await binary.disconnect()
+        await legacy.disconnect()
+
+    async def test_erases_are_broadcast_with_the_new_version(self):
+        ann = await self.connect("ann")
+        bob = await self.connect("bob")
+        await self.send(ann, {"type": "draw", "from": [0, 0], "to": [1, 0]})
+        await self.received(ann)
+        await self.received(bob)
+
+        await self.send(ann, {"type": "erase", "bbox": [-1, -1, 2, 1]})
+        erase = {"type": "erase", "bbox": [-1, -1, 2, 1], "version": 2, "count": 1}
+        self.assertEqual(await self.received(ann), [erase])
+        self.assertEqual(await self.received(bob), [erase])
+        await ann.disconnect()
+        await bob.disconnect()
+
+    async def test_full_rooms_turn_the_next_member_away(self):
+        self.room.max_members = 1
+        await self.room.asave()
+        ann = await self.connect("ann")
+        bob = await self.connect("bob")
+
+        frames = await self.received(bob)
+        self.assertEqual(frames[0]["code"], "room_full")
+        self.assertEqual(frames[-1]["type"], "websocket.close")
+        self.assertEqual(
+            await self.received(ann), [{"type": "user_list", "users": ["ann"]}]
+        )
+        await ann.disconnect()
+
+    async def test_bad_tokens_are_closed_with_4401(self):
+        client = WebsocketCommunicator(
+            self.app, f"/ws/room/{self.room.code}/?token=not-a-token"
+        )
+        with self.settings(WS_AUTH_REQUIRED=True):
+            self.assertEqual(await client.connect(), (False, 4401))
+
+
+@skipUnless(shutil.which("redis-server"), "needs redis-server")
+class MultiWorkerRoomTests(SimpleTestCase):
+    """
+    Two workers (python -m whiteboard_backend.server) on localhost sharing
+    a local Redis: a room whose members are split over both must behave
+    exactly like one whose members all use the same worker. Everything
+    that works within one process is covered by RoomSocketTests.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.processes = []
+        redis_port = _free_port()
+        cls.redis = subprocess.Popen(
+            ["redis-server", "--port", str(redis_port), "--save", ""],
+            stdout=subprocess.DEVNULL,
+        )
+        fd, cls.db = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        cls.env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE="benchmarks.ws_settings",
+            BENCH_LAYER="redis",
+            BENCH_DB=cls.db,
+            REDIS_URL=f"redis://127.0.0.1:{redis_port}/0",
+            WEB_DRAIN_TIMEOUT="5",
+            WS_RECONNECT_JITTER_MS="100",
+        )
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import django; django.setup();"
+                "from benchmarks.ws_load import setup_rooms; setup_rooms(3, 10)",
+            ],
+            cwd=ROOT,
+            env=cls.env,
+            check=True,
+        )
+        cls.urls = [cls.start_worker() for _ in range(2)]
+
+    @classmethod
+    def tearDownClass(cls):
+        for process in cls.processes + [cls.redis]:
+            process.terminate()
+            process.wait(timeout=20)
+        os.unlink(cls.db)
+        super().tearDownClass()
+
+    @classmethod
+    def start_worker(cls):
+        port = _free_port()
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "whiteboard_backend.server",
+                "--bind",
+                "127.0.0.1",
+                "--port",
+                str(port),
+                "--workers",
+                "1",
+            ],
+            cwd=ROOT,
+            env=cls.env,
+            stdout=subprocess.DEVNULL,
+        )
+        cls.processes.append(process)
+        asyncio.run(wait_for_port(port))
+        return f"ws://127.0.0.1:{port}"
+
+    async def session(self, room, urls):
+        """
+        Members u0..u3 connect to ``urls`` in turn and join ``room``; u0
+        draws, u1 chats and u2 sends u3 an offer. Returns what each saw.
+        """
+        clients = []
+        for url in urls:
+            clients.append(await SocketClient.connect(url, f"/ws/room/{room}/"))
+        received = [[] for _ in clients]
+        readers = [
+            asyncio.ensure_future(_collect(client, frames))
+            for client, frames in zip(clients, received)
+        ]
+        for index, client in enumerate(clients):
+            await client.send({"type": "join", "username": f"u{index}"})
+        await asyncio.sleep(0.5)
+
+        for x in range(3):
+            await clients[0].send(
+                {"type": "draw", "from": {"x": x, "y": 0}, "to": {"x": x + 1, "y": 0}}
+            )
+        await clients[1].send({"type": "chat", "username": "u1", "text": "hello"})
+        await clients[2].send(
+            {
+                "type": "webrtc_offer",
+                "sender": "u2",
+                "target": "u3",
+                "payload": {"sdp": "x"},
+            }
+        )
+        await asyncio.sleep(1)
+
+        for reader in readers:
+            reader.cancel()
+        for client in clients:
+            await client.close()
+        return [_summary(frames) for frames in received]
+
+    def test_room_split_over_workers_matches_single_worker(self):
+        single = asyncio.run(self.session("BENCH0", [self.urls[0]] * 4))
+        split = asyncio.run(self.session("BENCH1", self.urls * 2))
+
+        self.assertEqual(split, single)
+        everyone = ["u0", "u1", "u2", "u3"]
+        self.assertEqual([seen["users"] for seen in split], [everyone] * 4)
+        self.assertEqual(split[1]["draws"], [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(split[0]["chats"], [("u1", "hello")])
+        self.assertEqual(split[3]["offers"], [("u2", {"sdp": "x"})])
+
+    def test_drain_hints_reconnect_and_flushes_canvas(self):
+        url = self.start_worker()
+        process = self.processes[-1]
+
+        async def draw_then_drain():
+            client = await SocketClient.connect(url, "/ws/room/BENCH2/")
+            await client.send({"type": "join", "username": "leaving"})
+            for x in range(3):
+                await client.send(
+                    {
+                        "type": "draw",
+                        "from": {"x": x, "y": 0},
+                        "to": {"x": x + 1, "y": 0},
+                    }
+                )
+            await asyncio.sleep(0.1)
+            process.send_signal(signal.SIGTERM)
+
+            frames = []
+            await asyncio.wait_for(_collect(client, frames), timeout=10)
+            return frames, client.close_code
+
+        started = time.monotonic()
+        frames, close_code = asyncio.run(draw_then_drain())
+        self.assertEqual(process.wait(timeout=20), 0)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(frames[-1]["type"], "reconnect")
+        self.assertEqual(close_code, 4012)
+
+        # The segments were written before the worker exited; a client
+        # reconnecting to the other worker catches up from them
+        async def rejoin():
+            client = await SocketClient.connect(self.urls[0], "/ws/room/BENCH2/")
+            frames = []
+            reader = asyncio.ensure_future(_collect(client, frames))
+            await client.send({"type": "join", "username": "back", "since": 0})
+            await asyncio.sleep(0.5)
+            reader.cancel()
+            await client.close()
+            return _summary(frames)
+
+        self.assertEqual(asyncio.run(rejoin())["sync"], [(0, 1), (1, 2), (2, 3)])
@@ -0,0 +1,74 @@
+"""
+Deferred flushes on the event loop.
+
+Buffers in this app (draw coalescing, the stroke log, room activity, ICE
+candidates) publish or write what they collected a short while after
+the first item arrives. ``FlushTimer`` is that timer. The flush it
+starts runs as a task kept referenced until it finishes, so it cannot
+be garbage collected half way, and whatever it raises is logged instead
+of surfacing as "Task exception was never retrieved".
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger("rooms.timers")
+
+_tasks = set()
+
+
+def _done(task):
+    _tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.error(
+            "deferred flush failed",
+            exc_info=(type(exc), exc, exc.__traceback__),
+            extra={"ws": {"task": task.get_name()}},
+        )
+
+
+def spawn(coro, name=None):
+    """
+    Run ``coro`` in the background; it stays referenced until done and
+    its exception, if any, is logged.
+    """
+    task = asyncio.ensure_future(coro)
+    if name:
+        task.set_name(name)
+    _tasks.add(task)
+    task.add_done_callback(_done)
+    return task
+
+
+class FlushTimer:
+    """
+    Runs ``flush(*args)`` ``delay`` seconds after ``schedule`` is first
+    called, once per round; ``cancel`` is for flushes that happen early.
+    """
+
+    def __init__(self, delay, flush, *args):
+        self.delay = delay
+        self.flush = flush
+        self.args = args
+        self._handle = None
+
+    @property
+    def scheduled(self):
+        return self._handle is not None
+
+    def schedule(self):
+        if self._handle is None:
+            loop = asyncio.get_running_loop()
+            self._handle = loop.call_later(self.delay, self._fire)
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _fire(self):
+        self._handle = None
+        spawn(self.flush(*self.args), name=self.flush.__qualname__)
@@ -1,9 +1,38 @@
-from django.urls import path
-from .views import CreateRoomView, CanvasStateView, ListRoomsView, JoinRoomView
+from django.urls import path, re_path
+from .views import (
+    CreateRoomView,
+    CanvasExportView,
+    CanvasStateView,
+    CanvasTilesView,
+    CanvasTileView,
+    ListRoomsView,
+    JoinRoomView,
+    RoomDebugLoggingView,
+)
 
 urlpatterns = [
     path("create/", CreateRoomView.as_view(), name="create_room"),
     path("list/", ListRoomsView.as_view(), name="list_rooms"),
     path("join/", JoinRoomView.as_view(), name="join_room"),
     path("<str:code>/canvas/", CanvasStateView.as_view(), name="canvas_state"),
+    path(
+        "<str:code>/canvas/export/",
+        CanvasExportView.as_view(),
+        name="canvas_export",
+    ),
+    path(
+        "<str:code>/canvas/tiles/",
+        CanvasTilesView.as_view(),
+        name="canvas_tiles",
+    ),
+    re_path(
+        r"^(?P<code>[^/]+)/canvas/tiles/(?P<z>\d+)/(?P<x>-?\d+)/(?P<y>-?\d+)\.png$",
+        CanvasTileView.as_view(),
+        name="canvas_tile",
+    ),
+    path(
+        "<str:code>/debug-logging/",
+        RoomDebugLoggingView.as_view(),
+        name="room_debug_logging",
+    ),
 ]
@@ -1,10 +1,43 @@
+import json
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.generics import RetrieveAPIView, UpdateAPIView, ListAPIView
-from rest_framework import status
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from . import eventlog
+from .lifecycle import ArchiveMissing
 from .models import Room, CanvasState
-from .serializers import RoomSerializer, CanvasStateSerializer
+from .pagination import CreatedCursorPagination
+from .presence import get_presence_store
+from .raster import TILE_SIZE, get_tile_cache
+from .renderers import CanvasCodecRenderer
+from .serializers import (
+    CanvasStateSerializer,
+    DebugLoggingSerializer,
+    RoomSerializer,
+)
+from .spatial import get_spatial_index, parse_bbox
+
+
+class CanvasUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The room's archived canvas cannot be restored right now."
+    default_code = "canvas_unavailable"
+
+
+def _for_room(room_id):
+    try:
+        return CanvasState.for_room(room_id)
+    except ArchiveMissing:
+        raise CanvasUnavailable()
 
 
 class CreateRoomView(APIView):
@@ -25,9 +58,56 @@ class CreateRoomView(APIView):
 
 
 class ListRoomsView(ListAPIView):
-    queryset = Room.objects.all().order_by("-created_at")
+    """
+    Rooms newest first, one cursor page at a time.
+
+    Query parameters: ``is_private``, ``created_by`` (user id), ``name``
+    (prefix), ``page_size``, ``cursor`` and ``members=true`` to add each
+    room's live member count from the presence store.
+    """
+
     serializer_class = RoomSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedCursorPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        # Only the columns RoomSerializer reads, never the password
+        rooms = Room.objects.only(
+            "code", "name", "is_private", "max_members", "created_by", "created_at"
+        )
+
+        if "is_private" in params:
+            is_private = serializers.BooleanField().to_internal_value(
+                params["is_private"]
+            )
+            rooms = rooms.filter(is_private=is_private)
+
+        if "created_by" in params:
+            created_by = serializers.IntegerField().to_internal_value(
+                params["created_by"]
+            )
+            rooms = rooms.filter(created_by_id=created_by)
+
+        if params.get("name"):
+            rooms = rooms.filter(name__startswith=params["name"])
+
+        return rooms
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        data = self.get_serializer(page, many=True).data
+
+        with_members = request.query_params.get("members", "false")
+        if serializers.BooleanField().to_internal_value(with_members):
+            counts = get_presence_store().counts_sync(
+                [room["code"] for room in data]
+            )
+            for room in data:
+                room["members"] = counts.get(room["code"], 0)
+
+        return self.get_paginated_response(data)
+
 
 class JoinRoomView(APIView):
     permission_classes = [IsAuthenticated]
@@ -54,7 +134,210 @@ class CanvasStateView(RetrieveAPIView, UpdateAPIView):
     serializer_class = CanvasStateSerializer
     permission_classes = [IsAuthenticated]
     lookup_url_kwarg = "code"
+    # JSON stays the default for existing clients
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [CanvasCodecRenderer]
 
     def get_object(self):
         room = Room.objects.get(code=self.kwargs["code"])
-        return CanvasState.objects.get_or_create(room=room)[0]
+        return _for_room(room.pk)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Full canvas, or with ``?since=<version>`` only the operations after
+        that version. An ``If-None-Match`` matching the current version
+        short-circuits to 304 before any canvas data is loaded.
+
+        Clients accepting ``application/x-whiteboard-canvas`` get the data
+        as a rooms.canvas_codec blob, with the version and the ``full``
+        flag in the X-Canvas-Version and X-Canvas-Full headers.
+
+        ``?bbox=x0,y0,x1,y1`` limits the data to the records overlapping
+        that area, looked up in the room's spatial index.
+        """
+        state = self.get_object()
+        bbox = request.query_params.get("bbox")
+        since = request.query_params.get("since")
+
+        # Partial responses carry their own ETag, so one never revalidates
+        # a cached copy of another
+        etag = state.etag
+        if bbox is not None:
+            try:
+                bbox = parse_bbox(bbox)
+            except ValueError as e:
+                return Response(
+                    {"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST
+                )
+            area = ",".join(str(edge) for edge in bbox)
+            etag = f'"{state.room_id}-{state.version}-bbox-{area}"'
+        elif since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response(
+                    {"detail": "since must be an integer version."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            etag = f'"{state.room_id}-{state.version}-since-{since}"'
+
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept",
+            "X-Canvas-Version": str(state.version),
+            "X-Canvas-Full": "true",
+        }
+
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if bbox is not None:
+            return Response(
+                {
+                    "data": get_spatial_index().within(state, bbox),
+                    "version": state.version,
+                    "bbox": list(bbox),
+                },
+                headers=headers,
+            )
+
+        if since is None:
+            return Response(self.get_serializer(state).data, headers=headers)
+
+        full, data = state.ops_since(since)
+        headers["X-Canvas-Full"] = "true" if full else "false"
+        return Response(
+            {"data": data, "version": state.version, "full": full},
+            headers=headers,
+        )
+
+
+def _export_chunks(state, chunk_size=64 * 1024):
+    """
+    The canvas as a JSON array, in chunks of about ``chunk_size`` bytes.
+    """
+    buffer = ["["]
+    buffered = 1
+    for index, record in enumerate(state.iter_data()):
+        text = json.dumps(record, separators=(",", ":"))
+        buffer.append("," + text if index else text)
+        buffered += len(text) + 1
+        if buffered >= chunk_size:
+            yield "".join(buffer).encode()
+            buffer, buffered = [], 0
+    buffer.append("]")
+    yield "".join(buffer).encode()
+
+
+async def _iterate_in_thread(iterator):
+    # Database reads stay off the event loop, one chunk at a time; a
+    # synchronous iterator would be read into memory whole under ASGI.
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+class CanvasExportView(APIView):
+    """
+    Download the whole canvas as a JSON array, streamed so that neither
+    the records nor the JSON text of a large board are held in memory.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, code):
+        state = _canvas_state(code)
+
+        response = StreamingHttpResponse(
+            _iterate_in_thread(_export_chunks(state)),
+            content_type="application/json",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{code}-v{state.version}.json"'
+        )
+        response["X-Canvas-Version"] = str(state.version)
+        return response
+
+
+def _canvas_state(code):
+    room = Room.objects.filter(code=code).first()
+    if room is None:
+        raise Http404("Room not found.")
+    return _for_room(room.pk)
+
+
+class CanvasTilesView(APIView):
+    """
+    Tile manifest for late joiners: load the tiles of the returned
+    ``version``, then join the room WebSocket with ``"since": version``
+    to receive only the strokes drawn after it.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, code):
+        state = _canvas_state(code)
+        url = reverse("canvas_tile", kwargs={"code": code, "z": 0, "x": 0, "y": 0})
+        return Response(
+            {
+                "version": state.version,
+                "tile_size": TILE_SIZE,
+                "max_zoom": settings.CANVAS_TILE_MAX_ZOOM,
+                "bounds": get_tile_cache().bounds(state),
+                "tile_url": url.replace("/0/0/0.png", "/{z}/{x}/{y}.png")
+                + f"?v={state.version}",
+            }
+        )
+
+
+class CanvasTileView(APIView):
+    """
+    One PNG tile. URLs carrying the current canvas version as ``?v=`` are
+    immutable and cached for a year; other requests revalidate by ETag.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, code, z, x, y):
+        z = int(z)
+        if z > settings.CANVAS_TILE_MAX_ZOOM:
+            raise Http404("Zoom level out of range.")
+
+        state = _canvas_state(code)
+        etag = f'"{state.room_id}-{state.version}-{z}-{x}-{y}"'
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            png = get_tile_cache().png(state, z, int(x), int(y))
+            response = HttpResponse(png, content_type="image/png")
+
+        response["ETag"] = etag
+        response["X-Canvas-Version"] = str(state.version)
+        if request.query_params.get("v") == str(state.version):
+            response["Cache-Control"] = "private, max-age=31536000, immutable"
+        else:
+            response["Cache-Control"] = "private, no-cache"
+        return response
+
+
+class RoomDebugLoggingView(APIView):
+    """
+    Toggle full payload logging for one room on every worker that serves
+    it, without a restart. It turns itself off after WS_DEBUG_LOG_TTL
+    seconds.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, code):
+        serializer = DebugLoggingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        enabled = serializer.validated_data["enabled"]
+        ttl = settings.WS_DEBUG_LOG_TTL if enabled else 0
+        eventlog.store_debug(code, ttl)
+        async_to_sync(get_channel_layer().group_send)(
+            f"room_{code}", {"type": "log_control", "ttl": ttl}
+        )
+        return Response({"room": code, "debug": enabled, "expires_in": ttl})
@@ -0,0 +1,155 @@
+"""
+Verification of Google Sign-In ID tokens against cached signing certs.
+
+``id_token.verify_oauth2_token`` downloads Google's certs on every call.
+Here they are fetched through one pooled ``requests.Session`` and kept for
+the max-age Google sends in Cache-Control (hours), refreshed in the
+background shortly before they expire, so a login normally verifies
+without leaving the process. A token signed with a key id the cache does
+not know (Google rotated its keys) triggers one early refetch, at most
+once per GOOGLE_CERTS_MIN_REFRESH seconds.
+
+With GOOGLE_CERTS_FILE set, certs are read from that JSON file
+(``{"kid": "-----BEGIN CERTIFICATE-----..."}``) instead, for tests and
+offline development.
+"""
+
+import base64
+import json
+import re
+import threading
+import time
+
+from django.conf import settings
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# Used when Google sends no max-age
+DEFAULT_MAX_AGE = 3600
+# Refresh this long (at most a tenth of the max-age) before the cached
+# certs expire
+REFRESH_AHEAD = 300
+
+_max_age = re.compile(r"max-age=(\d+)")
+_session = None
+
+
+def get_session():
+    global _session
+    if _session is None:
+        import requests
+
+        _session = requests.Session()
+    return _session
+
+
+def fetch_google_certs():
+    """
+    ``(certs, max_age)`` from Google's cert endpoint.
+    """
+    response = get_session().get(GOOGLE_CERTS_URL, timeout=5)
+    response.raise_for_status()
+    match = _max_age.search(response.headers.get("Cache-Control", ""))
+    return response.json(), int(match.group(1)) if match else DEFAULT_MAX_AGE
+
+
+def file_certs_provider(path):
+    def fetch():
+        with open(path) as fh:
+            return json.load(fh), DEFAULT_MAX_AGE
+
+    return fetch
+
+
+class CertCache:
+    def __init__(self, fetch, min_refresh):
+        self.fetch = fetch
+        self.min_refresh = min_refresh
+        self.certs = None
+        self.expires = 0.0
+        self.refresh_at = 0.0
+        self.fetched = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _refresh(self):
+        certs, max_age = self.fetch()
+        now = time.monotonic()
+        self.certs = certs
+        self.fetched = now
+        self.expires = now + max_age
+        self.refresh_at = self.expires - min(REFRESH_AHEAD, max_age / 10)
+
+    def _refresh_in_background(self):
+        try:
+            with self._lock:
+                self._refresh()
+        except Exception:
+            # The certs in hand stay valid until they expire; the next
+            # login past that point fetches in the foreground
+            pass
+        finally:
+            self._refreshing = False
+
+    def get(self, kid=None):
+        """
+        Current certs, fetching them if they expired or lack ``kid``.
+        """
+        now = time.monotonic()
+        certs = self.certs
+        stale = certs is None or now >= self.expires
+        rotated = (
+            not stale
+            and kid is not None
+            and kid not in certs
+            and now - self.fetched >= self.min_refresh
+        )
+        if stale or rotated:
+            with self._lock:
+                # Another thread may have refreshed while this one waited
+                if self.certs is certs:
+                    self._refresh()
+                return self.certs
+
+        if now >= self.refresh_at and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return certs
+
+
+_cache = None
+
+
+def get_cert_cache():
+    global _cache
+    if _cache is None:
+        if settings.GOOGLE_CERTS_FILE:
+            fetch = file_certs_provider(settings.GOOGLE_CERTS_FILE)
+        else:
+            fetch = fetch_google_certs
+        _cache = CertCache(fetch, settings.GOOGLE_CERTS_MIN_REFRESH)
+    return _cache
+
+
+def _key_id(token):
+    try:
+        header = token.split(".", 1)[0]
+        header += "=" * (-len(header) % 4)
+        return json.loads(base64.urlsafe_b64decode(header)).get("kid")
+    except (ValueError, AttributeError):
+        return None
+
+
+def verify_id_token(token, audience):
+    """
+    Claims of a valid Google ID token for ``audience``; raises ValueError
+    otherwise.
+    """
+    from google.auth import jwt
+
+    certs = get_cert_cache().get(_key_id(token))
+    idinfo = jwt.decode(token, certs=certs, audience=audience)
+    if idinfo.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer: {idinfo.get('iss')}")
+    return idinfo
@@ -0,0 +1,81 @@
+"""
+Password hashing off the event loop.
+
+Checking or setting a password costs a PBKDF2 run of a few hundred
+milliseconds. Sync views under daphne share one thread, so every login
+used to hold up every other API request behind it. The login and register
+views are async instead and hand their ORM-and-hash work to a pool of
+AUTH_HASH_WORKERS threads per process; hashlib releases the GIL while it
+iterates, so hashes run in parallel with each other and with the event
+loop. At most AUTH_HASH_QUEUE more calls wait for a thread. Past that the
+caller gets Overloaded, answered with a 503, rather than a queue that
+grows until clients time out.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from whiteboard_backend import metrics
+
+# Seconds clients are told to wait after being shed
+RETRY_AFTER = 1
+
+
+class Overloaded(Exception):
+    pass
+
+
+def _run(fn, args, submitted, op):
+    started = time.perf_counter()
+    metrics.AUTH_HASH_WAIT_SECONDS.observe(started - submitted, op=op)
+    # Pool threads live outside the request cycle that normally recycles
+    # connections; do it around each call, as channels does for consumers
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+        metrics.AUTH_HASH_SECONDS.observe(time.perf_counter() - started, op=op)
+
+
+class HashPool:
+    def __init__(self, workers, queue):
+        self.limit = workers + queue
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="auth-hash")
+
+    async def run(self, op, fn, *args):
+        """
+        ``fn(*args)`` on a pool thread; raises Overloaded when the pool and
+        its queue are full.
+        """
+        with self._lock:
+            if self.pending >= self.limit:
+                metrics.AUTH_HASH_SHED.inc(op=op)
+                raise Overloaded(op)
+            self.pending += 1
+        metrics.AUTH_HASH_PENDING.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, _run, fn, args, time.perf_counter(), op
+            )
+        finally:
+            with self._lock:
+                self.pending -= 1
+            metrics.AUTH_HASH_PENDING.dec()
+
+
+_pool = None
+
+
+def get_hash_pool():
+    global _pool
+    if _pool is None:
+        _pool = HashPool(settings.AUTH_HASH_WORKERS, settings.AUTH_HASH_QUEUE)
+    return _pool
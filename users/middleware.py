@@ -0,0 +1,128 @@
+"""
+JWT authentication for WebSocket connections.
+
+Clients pass the same access token the REST API uses, either in the query
+string (``?token=<access>``) or as a ``jwt.<access>`` subprotocol offered
+next to ``wb.jwt.v1`` (browsers cannot set headers on WebSockets; the
+server answers with ``wb.jwt.v1`` so the token is never echoed).
+
+Verified tokens are kept in a per-process LRU until they expire, so a
+reconnecting client costs a dictionary lookup instead of a signature
+check. ``scope["user"]`` is a stateless simplejwt TokenUser built from
+the token claims; the database is only read for tokens issued before
+they carried a ``username`` claim, once per token.
+"""
+
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+
+AUTH_SUBPROTOCOL = "wb.jwt.v1"
+TOKEN_SUBPROTOCOL_PREFIX = "jwt."
+
+
+def token_from_scope(scope):
+    for subprotocol in scope.get("subprotocols") or ():
+        if subprotocol.startswith(TOKEN_SUBPROTOCOL_PREFIX):
+            return subprotocol[len(TOKEN_SUBPROTOCOL_PREFIX) :]
+
+    query = scope.get("query_string", b"")
+    if b"token=" in query:
+        tokens = parse_qs(query.decode("latin-1")).get("token")
+        if tokens:
+            return tokens[0]
+    return None
+
+
+class VerifiedTokens:
+    """
+    LRU of ``raw token -> (exp, user)`` for tokens that passed validation.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+
+    def get(self, raw, now):
+        entry = self._entries.get(raw)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[raw]
+            return None
+        self._entries.move_to_end(raw)
+        return entry[1]
+
+    def put(self, raw, exp, user):
+        self._entries[raw] = (exp, user)
+        self._entries.move_to_end(raw)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+@database_sync_to_async
+def _username(user_id):
+    from django.contrib.auth import get_user_model
+
+    User = get_user_model()
+    return (
+        User.objects.filter(pk=user_id, is_active=True)
+        .values_list(User.USERNAME_FIELD, flat=True)
+        .first()
+    )
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Sets ``scope["user"]`` from the connection's access token, or to an
+    AnonymousUser when there is none or it does not validate.
+    """
+
+    def __init__(self, inner):
+        super().__init__(inner)
+        self.verified = VerifiedTokens(settings.WS_JWT_CACHE_SIZE)
+
+    async def authenticate(self, raw):
+        from whiteboard_backend import metrics
+
+        now = time.time()
+        user = self.verified.get(raw, now)
+        if user is not None:
+            metrics.WS_AUTH.inc(result="cached")
+            return user
+
+        from rest_framework_simplejwt.exceptions import TokenError
+        from rest_framework_simplejwt.models import TokenUser
+        from rest_framework_simplejwt.settings import api_settings
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        try:
+            token = AccessToken(raw)
+            user_id = token[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            metrics.WS_AUTH.inc(result="invalid")
+            return None
+
+        if "username" not in token:
+            username = await _username(user_id)
+            if username is None:
+                metrics.WS_AUTH.inc(result="invalid")
+                return None
+            token["username"] = username
+
+        user = TokenUser(token)
+        self.verified.put(raw, token["exp"], user)
+        metrics.WS_AUTH.inc(result="verified")
+        return user
+
+    async def __call__(self, scope, receive, send):
+        from django.contrib.auth.models import AnonymousUser
+
+        raw = token_from_scope(scope)
+        user = await self.authenticate(raw) if raw else None
+        scope = dict(scope, user=user or AnonymousUser())
+        return await super().__call__(scope, receive, send)
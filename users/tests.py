@@ -1,3 +1,287 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import os
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from google.auth import crypt, jwt
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users import google, hashing, middleware
+from whiteboard_backend import metrics
+from users.tokens import tokens_for
+
+
+def _signing_key(kid):
+    """
+    A local RSA key standing in for one of Google's, with the
+    ``{kid: certificate}`` entry Google's cert endpoint would list.
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "test")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    signer = crypt.RSASigner.from_string(pem, key_id=kid)
+    return signer, {kid: cert.public_bytes(serialization.Encoding.PEM).decode()}
+
+
+def _id_token(signer, **claims):
+    now = int(time.time())
+    payload = {
+        "iss": "https://accounts.google.com",
+        "aud": "client-id",
+        "iat": now,
+        "exp": now + 3600,
+        "email": "ann@example.com",
+        "name": "Ann Lee",
+        **claims,
+    }
+    return jwt.encode(signer, payload).decode()
+
+
+class TokenFromScopeTests(SimpleTestCase):
+    def test_subprotocol_wins_over_the_query_string(self):
+        scope = {
+            "subprotocols": [middleware.AUTH_SUBPROTOCOL, "jwt.abc"],
+            "query_string": b"token=def",
+        }
+        self.assertEqual(middleware.token_from_scope(scope), "abc")
+        self.assertEqual(
+            middleware.token_from_scope({"query_string": b"room=1&token=def"}), "def"
+        )
+        self.assertIsNone(middleware.token_from_scope({"query_string": b"room=1"}))
+
+
+class VerifiedTokensTests(SimpleTestCase):
+    def test_entries_expire_and_the_least_recent_is_evicted(self):
+        tokens = middleware.VerifiedTokens(2)
+        tokens.put("a", 100, "ann")
+        tokens.put("b", 100, "bob")
+        self.assertEqual(tokens.get("a", 50), "ann")
+        tokens.put("c", 100, "cid")
+
+        self.assertIsNone(tokens.get("b", 50))
+        self.assertEqual(tokens.get("a", 50), "ann")
+        self.assertIsNone(tokens.get("a", 100))
+        self.assertNotIn("a", tokens._entries)
+
+
+class JWTAuthMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("ann@example.com")
+        self.middleware = middleware.JWTAuthMiddleware(self.app)
+
+    async def app(self, scope, receive, send):
+        self.scope = scope
+
+    async def connect(self, raw):
+        scope = {"type": "websocket", "query_string": f"token={raw}".encode()}
+        await self.middleware(scope, None, None)
+        return self.scope["user"]
+
+    async def test_verified_tokens_are_cached_until_they_expire(self):
+        token = tokens_for(self.user).access_token
+        raw = str(token)
+
+        with mock.patch(
+            "rest_framework_simplejwt.tokens.AccessToken", wraps=AccessToken
+        ) as verify:
+            user = await self.connect(raw)
+            self.assertEqual(user.username, "ann@example.com")
+            self.assertEqual(user.id, self.user.pk)
+            self.assertIs(await self.connect(raw), user)
+            self.assertEqual(verify.call_count, 1)
+
+            with mock.patch.object(
+                middleware.time, "time", return_value=token["exp"] + 1
+            ):
+                self.assertTrue((await self.connect(raw)).is_authenticated)
+            self.assertEqual(verify.call_count, 2)
+
+    async def test_tokens_without_a_username_read_it_once(self):
+        raw = str(AccessToken.for_user(self.user))
+
+        with mock.patch.object(
+            middleware, "_username", wraps=middleware._username
+        ) as lookup:
+            self.assertEqual((await self.connect(raw)).username, "ann@example.com")
+            await self.connect(raw)
+        self.assertEqual(lookup.call_count, 1)
+
+    async def test_invalid_tokens_and_inactive_users_are_anonymous(self):
+        self.assertFalse((await self.connect("not-a-token")).is_authenticated)
+        self.assertEqual(len(self.middleware.verified._entries), 0)
+
+        self.user.is_active = False
+        await self.user.asave()
+        raw = str(AccessToken.for_user(self.user))
+        self.assertFalse((await self.connect(raw)).is_authenticated)
+
+
+class GoogleCertsTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.signer, cls.certs = _signing_key("k1")
+
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch.object(google.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fetch = mock.Mock(return_value=(self.certs, 1000))
+        self.cache = google.CertCache(self.fetch, min_refresh=60)
+
+    def test_tokens_signed_with_a_listed_key_verify(self):
+        with mock.patch.object(google, "_cache", self.cache):
+            claims = google.verify_id_token(_id_token(self.signer), "client-id")
+            self.assertEqual(claims["email"], "ann@example.com")
+
+            for token, audience in [
+                (_id_token(self.signer), "other-client"),
+                (_id_token(self.signer, iss="https://evil.example"), "client-id"),
+                (_id_token(self.signer, exp=int(time.time()) - 600), "client-id"),
+            ]:
+                with self.subTest(token=token), self.assertRaises(ValueError):
+                    google.verify_id_token(token, audience)
+
+            other, _ = _signing_key("k1")
+            with self.assertRaises(ValueError):
+                google.verify_id_token(_id_token(other), "client-id")
+
+    def test_certs_are_refreshed_ahead_of_their_max_age(self):
+        self.assertEqual(self.cache.get("k1"), self.certs)
+        self.now = 800
+        self.cache.get("k1")
+        self.assertEqual(self.fetch.call_count, 1)
+
+        # Past refresh_at (a tenth of the max-age early) the fetch runs on
+        # a background thread and the current certs are returned meanwhile
+        self.now = 950
+        with mock.patch.object(google.threading, "Thread") as thread:
+            self.assertEqual(self.cache.get("k1"), self.certs)
+        thread.return_value.start.assert_called_once()
+        thread.call_args.kwargs["target"]()
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertEqual(self.cache.expires, 1950)
+
+        # Expired certs are fetched before answering
+        self.now = 2000
+        self.cache.get("k1")
+        self.assertEqual(self.fetch.call_count, 3)
+
+    def test_unknown_key_ids_refetch_at_most_once_per_min_refresh(self):
+        self.cache.get("k1")
+        self.now = 10
+        self.cache.get("k2")
+        self.assertEqual(self.fetch.call_count, 1)
+
+        self.now = 61
+        self.cache.get("k2")
+        self.cache.get("k2")
+        self.assertEqual(self.fetch.call_count, 2)
+
+
+class GoogleLoginTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.signer, cls.certs = _signing_key("k1")
+
+    def setUp(self):
+        cache = google.CertCache(lambda: (self.certs, 3600), min_refresh=60)
+        for patcher in (
+            mock.patch.object(google, "_cache", cache),
+            mock.patch.dict(os.environ, {"CLIENT_ID": "client-id"}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def login(self):
+        return self.client.post(
+            reverse("google_login"),
+            {"token": _id_token(self.signer, picture="https://p.example/a.png")},
+            format="json",
+        )
+
+    def test_first_login_creates_the_user_and_later_ones_write_nothing(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["user"]["last_name"], "Lee")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.login().status_code, 200)
+        writes = [
+            q["sql"] for q in queries if not q["sql"].lstrip().startswith("SELECT")
+        ]
+        self.assertEqual(writes, [])
+
+    def test_missing_fields_are_filled_in(self):
+        get_user_model().objects.create_user("ann@example.com", first_name="Ann")
+
+        self.assertEqual(self.login().status_code, 200)
+        user = get_user_model().objects.get(email="ann@example.com")
+        self.assertEqual(
+            (user.first_name, user.last_name, user.profile_picture),
+            ("Ann", "Lee", "https://p.example/a.png"),
+        )
+
+
+class HashPoolTests(SimpleTestCase):
+    async def test_calls_past_the_workers_and_queue_are_shed(self):
+        pool = hashing.HashPool(workers=1, queue=1)
+        self.addCleanup(pool._executor.shutdown)
+        release = threading.Event()
+        shed = metrics.AUTH_HASH_SHED.values.get(("login",), 0)
+
+        busy = [
+            asyncio.ensure_future(pool.run("login", release.wait, 5))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual(pool.pending, 2)
+        with self.assertRaises(hashing.Overloaded):
+            await pool.run("login", lambda: None)
+        self.assertEqual(metrics.AUTH_HASH_SHED.values[("login",)], shed + 1)
+
+        release.set()
+        self.assertEqual(await asyncio.gather(*busy), [True, True])
+        self.assertEqual(pool.pending, 0)
+        self.assertEqual(await pool.run("login", lambda: "ok"), "ok")
+
+    def test_shed_logins_are_told_to_retry(self):
+        pool = mock.Mock(run=mock.AsyncMock(side_effect=hashing.Overloaded))
+        with mock.patch("users.views.get_hash_pool", return_value=pool):
+            response = self.client.post(
+                reverse("email_password_login"),
+                {"email": "ann@example.com", "password": "secret"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], str(hashing.RETRY_AFTER))
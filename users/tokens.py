@@ -0,0 +1,12 @@
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+def tokens_for(user):
+    """
+    Refresh token for ``user``. Its claims, copied into every access token
+    derived from it, name the user so WebSocket connections can be
+    authenticated without a database query (see users.middleware).
+    """
+    refresh = RefreshToken.for_user(user)
+    refresh["username"] = user.get_username()
+    return refresh
@@ -1,34 +1,85 @@
-from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status
-from django.contrib.auth.models import User
+from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
-from rest_framework.exceptions import ValidationError
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .hashing import RETRY_AFTER, Overloaded, get_hash_pool
+import json
 import os
 
 
-class RegisterView(APIView):
-    def post(self, request):
-        data = request.data
-        try:
-            validate_password(data["password"])
-            user = User.objects.create_user(
-                username=data["username"],
-                email=data.get("email", ""),
-                password=data["password"],
+# Login and register are plain async views: DRF views are sync only, and
+# these spend most of their time hashing on users.hashing's pool.
+
+
+def _request_data(request):
+    """
+    The JSON object or form fields posted, or None when the body is not
+    a JSON object.
+    """
+    if request.content_type != "application/json":
+        return request.POST
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _busy():
+    response = JsonResponse(
+        {"error": "Server busy, please retry shortly"}, status=503
+    )
+    response["Retry-After"] = str(RETRY_AFTER)
+    return response
+
+
+def _register(data):
+    try:
+        validate_password(data["password"])
+        get_user_model().objects.create_user(
+            email=data["email"],
+            password=data["password"],
+            first_name=data.get("username", ""),
+        )
+    except ValidationError as e:
+        return e.messages
+    except IntegrityError:
+        return ["A user with that email already exists."]
+    return None
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class RegisterView(View):
+    async def post(self, request):
+        data = _request_data(request)
+        if data is None:
+            return JsonResponse({"errors": ["Expected a JSON object."]}, status=400)
+        if not data.get("email") or not data.get("password"):
+            return JsonResponse(
+                {"errors": ["Email and password are required."]}, status=400
             )
-            return Response({"message": "User created"}, status=status.HTTP_201_CREATED)
-        except ValidationError as e:
-            return Response({"errors": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            errors = await get_hash_pool().run("register", _register, data)
+        except Overloaded:
+            return _busy()
+        if errors:
+            return JsonResponse({"errors": errors}, status=400)
+        return JsonResponse({"message": "User created"}, status=201)
 
 
-from google.oauth2 import id_token
-from google.auth.transport import requests
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
-from rest_framework_simplejwt.tokens import RefreshToken
+from .google import verify_id_token
 from .models import CustomUser
+from .tokens import tokens_for
 
 
 @api_view(["POST"])
@@ -39,9 +90,7 @@ def google_login(request):
         return Response({"error": "Token is required"}, status=400)
 
     try:
-        idinfo = id_token.verify_oauth2_token(
-            token, requests.Request(), os.getenv("CLIENT_ID")
-        )
+        idinfo = verify_id_token(token, os.getenv("CLIENT_ID"))
 
         email = idinfo["email"]
         name = idinfo.get("name", "")
@@ -59,15 +108,21 @@ def google_login(request):
                 "profile_picture": picture,
             },
         )
+        # Only fill in what is missing, and only write when that changed
+        changed = []
         if not user.first_name and name:
             user.first_name = name.split(" ")[0]
+            changed.append("first_name")
         if not user.last_name and len(name.split()) > 1:
             user.last_name = " ".join(name.split()[1:])
+            changed.append("last_name")
         if picture and not user.profile_picture:
             user.profile_picture = picture
-        user.save()
+            changed.append("profile_picture")
+        if changed:
+            user.save(update_fields=changed)
 
-        refresh = RefreshToken.for_user(user)
+        refresh = tokens_for(user)
         return Response({
             "refresh": str(refresh),
             "access": str(refresh.access_token),
@@ -85,20 +140,29 @@ def google_login(request):
 from django.contrib.auth import authenticate
 
 
-@api_view(["POST"])
-@permission_classes([AllowAny])
-def email_password_login(request):
-    email = request.data.get("email")
-    password = request.data.get("password")
+def _login(request, email, password):
     user = authenticate(request, email=email, password=password)
+    if user is None:
+        return None
+    refresh = tokens_for(user)
+    return {
+        "refresh": str(refresh),
+        "access": str(refresh.access_token),
+        "user": {"email": user.email, "name": user.first_name},
+    }
+
 
-    if user is not None:
-        refresh = RefreshToken.for_user(user)
-        return Response(
-            {
-                "refresh": str(refresh),
-                "access": str(refresh.access_token),
-                "user": {"email": user.email, "name": user.first_name},
-            }
+@csrf_exempt
+@require_POST
+async def email_password_login(request):
+    data = _request_data(request) or {}
+    try:
+        body = await get_hash_pool().run(
+            "login", _login, request, data.get("email"), data.get("password")
         )
-    return Response({"error": "Invalid credentials"}, status=400)
+    except Overloaded:
+        return _busy()
+
+    if body is not None:
+        return JsonResponse(body)
+    return JsonResponse({"error": "Invalid credentials"}, status=400)
@@ -8,15 +8,20 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from rooms.routing import websocket_urlpatterns
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'whiteboard_backend.settings')
 
+# Set up Django before importing anything that loads models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from rooms.routing import websocket_urlpatterns  # noqa: E402
+from users.middleware import JWTAuthMiddleware  # noqa: E402
+from whiteboard_backend.metrics import MetricsEndpoint  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": MetricsEndpoint(django_asgi_app),
+    "websocket": JWTAuthMiddleware(
         URLRouter(websocket_urlpatterns)
     ),
 })
\ No newline at end of file
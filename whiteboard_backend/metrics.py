@@ -0,0 +1,473 @@
+"""
+Prometheus-style metrics for the HTTP API and the room WebSockets.
+
+Every process keeps its own counters, gauges and histograms in memory.
+When ``METRICS_DIR`` is set, each process also dumps them to
+``<METRICS_DIR>/<pid>.json`` every ``METRICS_FLUSH_SECONDS``, and
+``/metrics`` on any worker sums the files of all workers, so the numbers
+cover every daphne process on the host. Gauges only count processes that
+are still alive. A worker removes its file when it exits and the
+supervisor empties the directory when it starts.
+
+``/metrics`` answers requests bearing ``METRICS_TOKEN`` and clients from
+``METRICS_ALLOWED_NETS`` (none by default); everyone else gets a 403.
+"""
+
+import atexit
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+REGISTRY: dict[str, "Metric"] = {}
+
+# Called before every export to refresh gauges computed on demand
+COLLECTORS = []
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # per-bucket counts, +Inf count, sum
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+# =============================================================
+# METRIC DEFINITIONS
+# =============================================================
+
+WS_CONNECTIONS = Counter(
+    "ws_connections_total", "WebSocket lifecycle events.", ["event"]
+)
+WS_AUTH = Counter(
+    "ws_auth_total",
+    "WebSocket token checks: cached, verified or invalid.",
+    ["result"],
+)
+WS_ACTIVE = Gauge("ws_active_connections", "Open room WebSocket connections.")
+WS_MESSAGES = Counter(
+    "ws_messages_total", "Inbound room WebSocket messages.", ["type"]
+)
+WS_ERRORS = Counter(
+    "ws_errors_total", "Room WebSocket messages that failed.", ["kind"]
+)
+WS_RATE_LIMITED = Counter(
+    "ws_rate_limited_total",
+    "Inbound messages over their rate limit, by action taken.",
+    ["kind", "action"],
+)
+WS_RECEIVE_SECONDS = Histogram(
+    "ws_receive_seconds",
+    "Time from receiving a frame to having dispatched it.",
+    ["type"],
+)
+WS_SEND_SECONDS = Histogram(
+    "ws_send_seconds",
+    "Time from a group event reaching a consumer to its frame being sent.",
+)
+WS_FANOUT = Histogram(
+    "ws_broadcast_fanout",
+    "Room size seen by member-list broadcasts.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+CHANNEL_LAYER_SECONDS = Histogram(
+    "channel_layer_seconds",
+    "Latency of channel layer send and group_send calls.",
+    ["method", "event"],
+)
+WS_SEND_QUEUE = Gauge(
+    "ws_send_queue", "Outbound send queue statistics.", ["stat"]
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "API requests.", ["view", "method", "status"]
+)
+HTTP_SECONDS = Histogram(
+    "http_request_seconds", "API request latency.", ["view", "method"]
+)
+AUTH_HASH_SECONDS = Histogram(
+    "auth_hash_seconds",
+    "Time spent checking or setting a password on the hash pool.",
+    ["op"],
+)
+AUTH_HASH_WAIT_SECONDS = Histogram(
+    "auth_hash_wait_seconds",
+    "Time password work waited for a hash pool thread.",
+    ["op"],
+)
+AUTH_HASH_PENDING = Gauge(
+    "auth_hash_pending", "Password hashes running or queued on the hash pool."
+)
+AUTH_HASH_SHED = Counter(
+    "auth_hash_shed_total",
+    "Requests answered 503 because the hash pool queue was full.",
+    ["op"],
+)
+
+
+async def group_send(channel_layer, group, event):
+    with CHANNEL_LAYER_SECONDS.time(method="group_send", event=event["type"]):
+        await channel_layer.group_send(group, event)
+
+
+async def send(channel_layer, channel, event):
+    with CHANNEL_LAYER_SECONDS.time(method="send", event=event["type"]):
+        await channel_layer.send(channel, event)
+
+
+# =============================================================
+# EXPORT
+# =============================================================
+
+
+def _snapshot():
+    for collect in COLLECTORS:
+        collect()
+    return {
+        "pid": os.getpid(),
+        "metrics": {
+            name: {
+                "kind": metric.kind,
+                "help": metric.documentation,
+                "labels": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "values": metric.dump(),
+            }
+            for name, metric in REGISTRY.items()
+        },
+    }
+
+
+def _snapshot_path():
+    return os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+
+
+def write_snapshot():
+    path = _snapshot_path()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as fh:
+        json.dump(_snapshot(), fh)
+    os.replace(tmp, path)
+
+
+def remove_snapshot():
+    """
+    Remove this process's file, so it is not summed after the process exits.
+    """
+    for path in (_snapshot_path(), f"{_snapshot_path()}.tmp"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def clear_snapshots():
+    """
+    Remove the files every earlier worker left in METRICS_DIR. Called by
+    the supervisor before it starts its workers.
+    """
+    directory = settings.METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.endswith((".json", ".json.tmp")):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load_snapshots():
+    directory = settings.METRICS_DIR
+    if not directory:
+        return [_snapshot()]
+
+    write_snapshot()
+    snapshots = []
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as fh:
+                snapshots.append(json.load(fh))
+        except (OSError, ValueError):
+            continue  # being replaced right now
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        alive = _pid_alive(snapshot["pid"])
+        for name, metric in snapshot["metrics"].items():
+            if metric["kind"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {**metric, "values": {}})
+            for key, value in metric["values"]:
+                key = tuple(key)
+                if metric["kind"] == "histogram":
+                    current = target["values"].get(key)
+                    target["values"][key] = (
+                        value
+                        if current is None
+                        else [a + b for a, b in zip(current, value)]
+                    )
+                else:
+                    target["values"][key] = target["values"].get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render():
+    """
+    Prometheus text exposition of every worker's metrics.
+    """
+    lines = []
+    for name, metric in sorted(_merge(_load_snapshots()).items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in metric["values"].items():
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_labels(metric['labels'], key)} {value}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + ["+Inf"], value[:-1]):
+                cumulative += count
+                le = _labels(metric["labels"], key, f'le="{bound}"')
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            labels = _labels(metric["labels"], key)
+            lines.append(f"{name}_sum{labels} {value[-1]}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_SECONDS)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+_flusher = None
+
+
+def start_flusher():
+    global _flusher
+    if _flusher is None and settings.METRICS_DIR:
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        _flusher = threading.Thread(target=_flush_forever, daemon=True)
+        _flusher.start()
+        atexit.register(remove_snapshot)
+
+
+# =============================================================
+# HTTP INTEGRATION
+# =============================================================
+
+
+class MetricsMiddleware:
+    """
+    Count and time API requests per resolved view. Async-capable, so async
+    views are not pushed onto a thread on its account.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        start_flusher()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, start)
+        return response
+
+    def record(self, request, response, start):
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match and match.url_name else "unmatched"
+        HTTP_SECONDS.observe(
+            time.perf_counter() - start, view=view, method=request.method
+        )
+        HTTP_REQUESTS.inc(
+            view=view, method=request.method, status=response.status_code
+        )
+
+
+def allowed(scope):
+    """
+    Whether a request to ``/metrics`` may read them: it carries
+    ``Authorization: Bearer <METRICS_TOKEN>`` or comes from one of
+    METRICS_ALLOWED_NETS.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        for name, value in scope.get("headers", ()):
+            if name == b"authorization" and hmac.compare_digest(
+                value, f"Bearer {token}".encode()
+            ):
+                return True
+
+    client = scope.get("client")
+    if not client:
+        return False
+    try:
+        address = ipaddress.ip_address(client[0])
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(net) for net in settings.METRICS_ALLOWED_NETS
+    )
+
+
+class MetricsEndpoint:
+    """
+    ASGI wrapper answering ``GET /metrics`` and passing everything else to
+    the wrapped HTTP application.
+    """
+
+    def __init__(self, app, path="/metrics"):
+        self.app = app
+        self.path = path
+        start_flusher()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+
+        if allowed(scope):
+            status = 200
+            # Writes this worker's snapshot and reads everyone else's
+            body = (await sync_to_async(render, thread_sensitive=False)()).encode()
+        else:
+            status = 403
+            body = b"Forbidden\n"
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"text/plain; version=0.0.4"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
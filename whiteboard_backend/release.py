@@ -0,0 +1,100 @@
+"""
+Database migrations as a release step, kept off the server start path.
+
+``manage.py release`` applies migrations while holding a lock, so when
+several replicas or deploy jobs run it at once one of them migrates and
+the others wait, then find nothing left to do. On PostgreSQL the lock is
+a session advisory lock; on other databases it is a Redis lock at the
+channel layer's REDIS_URL. With neither (SQLite in development) the
+migrations run unlocked.
+
+Servers never migrate. A booting worker only asks ``pending_migrations``
+whether the database is behind the code, and refuses to start if it is.
+"""
+
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+# Arbitrary 64-bit key identifying this project's migration lock
+ADVISORY_LOCK_KEY = 0x77625F6D696772
+REDIS_LOCK_KEY = "release:migrate"
+# The Redis lock expires on its own if the release process dies; longer
+# than any migration here should take
+REDIS_LOCK_TTL = 900
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def pending_migrations():
+    """
+    ``app.name`` of every migration on disk not applied to the database.
+    """
+    from django.db.migrations.executor import MigrationExecutor
+
+    executor = MigrationExecutor(connection)
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    return [f"{migration.app_label}.{migration.name}" for migration, _ in plan]
+
+
+def _redis_url():
+    config = settings.CHANNEL_LAYERS["default"].get("CONFIG", {})
+    hosts = [host for host in config.get("hosts", ()) if isinstance(host, str)]
+    return hosts[0] if hosts else None
+
+
+@contextmanager
+def _advisory_lock(timeout):
+    deadline = time.monotonic() + timeout
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [ADVISORY_LOCK_KEY])
+            if cursor.fetchone()[0]:
+                break
+            if time.monotonic() >= deadline:
+                raise LockTimeout("PostgreSQL advisory lock")
+            time.sleep(0.5)
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [ADVISORY_LOCK_KEY])
+
+
+@contextmanager
+def _redis_lock(url, timeout):
+    import redis
+
+    lock = redis.Redis.from_url(url).lock(
+        REDIS_LOCK_KEY, timeout=REDIS_LOCK_TTL, blocking_timeout=timeout
+    )
+    if not lock.acquire():
+        raise LockTimeout("Redis lock")
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+@contextmanager
+def migration_lock(timeout):
+    """
+    Hold the migration lock, waiting up to ``timeout`` seconds for it.
+    Yields the kind of lock held: "postgresql", "redis" or None.
+    """
+    if connection.vendor == "postgresql":
+        with _advisory_lock(timeout):
+            yield "postgresql"
+        return
+
+    url = _redis_url()
+    if url:
+        with _redis_lock(url, timeout):
+            yield "redis"
+        return
+
+    yield None
@@ -0,0 +1,279 @@
+"""
+Multi-worker ASGI server.
+
+The supervisor binds the listening socket once and starts WEB_WORKERS
+daphne workers that all accept from it, so the kernel spreads HTTP and
+WebSocket connections over them and every core gets used. What workers
+share goes through Redis: the channel layer, room presence and the room
+cache. The rest is per-worker buffers, which a drain flushes.
+
+On SIGTERM or SIGINT the supervisor closes its copy of the socket and
+forwards SIGTERM to the workers. Each worker stops accepting, drains its
+room connections (rooms.drain: reconnect hints, then canvas writes),
+waits up to WEB_DRAIN_TIMEOUT seconds for in-flight requests and exits.
+Workers still running after that are killed. A worker that dies while
+the server is running is replaced.
+
+The server does not migrate: ``manage.py release`` does, once per deploy
+(see whiteboard_backend.release). A booting worker only checks that the
+database has every migration applied; if it does not, the worker exits
+with SCHEMA_BEHIND and the supervisor stops instead of restarting it
+(SCHEMA_CHECK=0 skips the check).
+
+    python -m whiteboard_backend.server
+    python -m whiteboard_backend.server --workers 4 --port 8000
+"""
+
+import argparse
+import asyncio
+import contextvars
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger("whiteboard_backend.server")
+
+# Workers that die sooner than this after starting are restarted after
+# the same delay, so a crash at boot does not turn into a fork loop
+RESTART_BACKOFF = 1.0
+
+# Extra time a draining worker gets past WEB_DRAIN_TIMEOUT before SIGKILL
+KILL_GRACE = 5.0
+
+# Exit status when the database is missing migrations
+SCHEMA_BEHIND = 3
+
+
+# =============================================================
+# WORKER
+# =============================================================
+
+
+def check_schema():
+    """
+    Exit unless every migration is applied. Costs a migration graph load
+    and one query, instead of the makemigrations/migrate run the
+    container used to do on every start.
+    """
+    from django.db import connection
+
+    from whiteboard_backend.release import pending_migrations
+
+    pending = pending_migrations()
+    connection.close()
+    if pending:
+        logger.error(
+            "database is missing %d migrations (%s); run manage.py release",
+            len(pending),
+            ", ".join(pending),
+        )
+        sys.exit(SCHEMA_BEHIND)
+
+
+def run_worker(fd, drain_timeout):
+    # Importing daphne.server installs the asyncio Twisted reactor, which
+    # must happen before anything else imports twisted.internet.reactor
+    from daphne.access import AccessLogGenerator
+    from daphne.server import Server
+    from django.conf import settings
+    from twisted.internet import reactor
+    from twisted.internet.endpoints import AdoptedStreamServerEndpoint
+
+    from whiteboard_backend.asgi import application
+
+    if settings.SCHEMA_CHECK:
+        check_schema()
+
+    class Worker(Server):
+        def __init__(self, fd, **kwargs):
+            # Daphne wants endpoint strings, and Twisted no longer parses
+            # "fd:" ones; the inherited socket is adopted in listen()
+            super().__init__(endpoints=[f"fd:fileno={fd}"], **kwargs)
+            self.endpoints = []
+            self.fd = fd
+            self.ports = []
+            self.draining = False
+            reactor.callWhenRunning(self.listen)
+
+        def listen(self):
+            sock = socket.socket(fileno=self.fd)
+            family = sock.family
+            sock.detach()
+            endpoint = AdoptedStreamServerEndpoint(reactor, self.fd, family)
+            listener = endpoint.listen(self.http_factory)
+            listener.addCallback(self.listen_success)
+            listener.addErrback(self.listen_error)
+            self.listeners.append(listener)
+
+        def listen_success(self, port):
+            super().listen_success(port)
+            self.ports.append(port)
+
+        def busy(self):
+            return any(
+                "application_instance" in details
+                and not details["application_instance"].done()
+                for details in self.connections.values()
+            )
+
+        def shutdown(self):
+            if self.draining:
+                return
+            self.draining = True
+            for port in self.ports:
+                port.stopListening()
+            # In a fresh context: the one this callback inherited is whatever
+            # the signal interrupted, possibly one asgiref has marked as
+            # inside sync_to_async, which would refuse the flushes' queries
+            asyncio.get_event_loop().create_task(
+                self.drain(), context=contextvars.Context()
+            )
+
+        async def drain(self):
+            from rooms import drain
+
+            deadline = time.monotonic() + drain_timeout
+            try:
+                left = await drain.drain(drain_timeout)
+                if left:
+                    logger.warning("%d room connections did not close", left)
+                while self.busy() and time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+            except Exception:
+                logger.exception("drain failed")
+            finally:
+                self.stop()
+
+    server = Worker(
+        fd,
+        application=application,
+        action_logger=AccessLogGenerator(sys.stdout),
+        # Signals are handled below instead of stopping the reactor outright
+        signal_handlers=False,
+    )
+
+    def on_signal(signum, frame):
+        reactor.callFromThread(server.shutdown)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    server.run()
+    if server.abort_start:
+        sys.exit(1)
+
+
+# =============================================================
+# SUPERVISOR
+# =============================================================
+
+
+class Supervisor:
+    def __init__(self, host, port, workers, drain_timeout):
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.sock = socket.create_server((host, port), backlog=2048)
+        self.sock.set_inheritable(True)
+        self.fd = self.sock.fileno()
+        self.processes = []
+        self.deadline = None
+        self.returncode = 0
+
+    def spawn(self):
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "whiteboard_backend.server",
+                "--fd",
+                str(self.fd),
+            ],
+            pass_fds=(self.fd,),
+        )
+        process.started = time.monotonic()
+        logger.info("started worker %d", process.pid)
+        return process
+
+    def stop(self, signum, frame):
+        if self.deadline is not None:
+            return
+        logger.info("draining %d workers", len(self.processes))
+        self.deadline = time.monotonic() + self.drain_timeout + KILL_GRACE
+        # Nothing new should queue up on a socket no worker will accept from
+        self.sock.close()
+        for process in self.processes:
+            process.send_signal(signal.SIGTERM)
+
+    def run(self):
+        from whiteboard_backend import metrics
+
+        # Snapshots of the previous run's workers would be summed forever
+        metrics.clear_snapshots()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.processes = [self.spawn() for _ in range(self.workers)]
+
+        while self.processes:
+            time.sleep(0.2)
+            for index, process in enumerate(self.processes):
+                if process.poll() is None:
+                    continue
+                if self.deadline is not None:
+                    continue
+                logger.warning(
+                    "worker %d exited with %d", process.pid, process.returncode
+                )
+                if process.returncode == SCHEMA_BEHIND:
+                    # Another worker would not find the database any newer
+                    self.returncode = SCHEMA_BEHIND
+                    self.stop(None, None)
+                    continue
+                if time.monotonic() - process.started < RESTART_BACKOFF:
+                    time.sleep(RESTART_BACKOFF)
+                self.processes[index] = self.spawn()
+
+            if self.deadline is None:
+                continue
+            self.processes = [p for p in self.processes if p.poll() is None]
+            if time.monotonic() > self.deadline:
+                for process in self.processes:
+                    logger.warning("killing worker %d", process.pid)
+                    process.kill()
+                    process.wait()
+                self.processes = []
+        return self.returncode
+
+
+def main():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "whiteboard_backend.settings")
+    from django.conf import settings
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--bind", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS)
+    parser.add_argument(
+        "--fd", type=int, help="run one worker on this inherited listening socket"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)-15s %(levelname)-8s %(message)s"
+    )
+    if args.fd is not None:
+        run_worker(args.fd, settings.WEB_DRAIN_TIMEOUT)
+    else:
+        sys.exit(
+            Supervisor(
+                args.bind, args.port, max(1, args.workers), settings.WEB_DRAIN_TIMEOUT
+            ).run()
+        )
+
+
+if __name__ == "__main__":
+    main()
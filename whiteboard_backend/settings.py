@@ -58,6 +58,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "whiteboard_backend.metrics.MetricsMiddleware",
 ]
 
 
@@ -170,6 +171,225 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Room presence: membership is shared by every worker through Redis,
+# sharded over the channel layer hosts. Entries expire after "ttl"
+# seconds unless the owning connection keeps sending heartbeats.
+PRESENCE = {
+    "BACKEND": os.getenv(
+        "PRESENCE_BACKEND", "rooms.presence.RedisPresenceBackend"
+    ),
+    "CONFIG": {
+        "ttl": int(os.getenv("PRESENCE_TTL", "30")),
+    },
+}
+
+# Room metadata used on the WebSocket path (existence, max_members,
+# is_private): an in-process LRU of "size" rooms in front of Redis keys
+# shared by all workers, both expiring after "ttl" seconds.
+ROOM_CACHE = {
+    "size": int(os.getenv("ROOM_CACHE_SIZE", "1024")),
+    "ttl": int(os.getenv("ROOM_CACHE_TTL", "60")),
+}
+
+# Draw coalescing: segments are buffered per room for this many
+# milliseconds (or until the segment cap is hit) and fanned out as one
+# "draw_batch" event. A window of 0 disables batching.
+DRAW_BATCH_WINDOW_MS = int(os.getenv("DRAW_BATCH_WINDOW_MS", "12"))
+DRAW_BATCH_MAX_SEGMENTS = int(os.getenv("DRAW_BATCH_MAX_SEGMENTS", "64"))
+
+# Canvas persistence: draw segments are appended to the stroke log every
+# CANVAS_LOG_FLUSH_MS, and a room's log is folded into its snapshot once
+# a worker has written CANVAS_COMPACT_THRESHOLD log rows for it. A room
+# whose writes keep failing has its buffered segments dropped after
+# CANVAS_LOG_MAX_RETRIES flushes in a row.
+CANVAS_LOG_FLUSH_MS = int(os.getenv("CANVAS_LOG_FLUSH_MS", "500"))
+CANVAS_COMPACT_THRESHOLD = int(os.getenv("CANVAS_COMPACT_THRESHOLD", "200"))
+CANVAS_LOG_MAX_RETRIES = int(os.getenv("CANVAS_LOG_MAX_RETRIES", "120"))
+
+# Snapshots are stored in the columnar rooms.canvas_codec format,
+# compressed with zlib (1) or, with the zstandard package installed,
+# zstd (2).
+CANVAS_COMPRESSION = int(os.getenv("CANVAS_COMPRESSION", "1"))
+
+# Rendered 256px PNG tiles (GET .../canvas/tiles/<z>/<x>/<y>.png) kept per
+# worker; each cached tile holds 256 KB of pixels. Zoom level z shows
+# 2**z canvas units per pixel.
+CANVAS_TILE_CACHE_SIZE = int(os.getenv("CANVAS_TILE_CACHE_SIZE", "256"))
+CANVAS_TILE_MAX_ZOOM = int(os.getenv("CANVAS_TILE_MAX_ZOOM", "4"))
+
+# Spatial index behind ?bbox= canvas loads and the "erase" message: a grid
+# of CANVAS_INDEX_CELL_SIZE canvas units per cell, kept in memory for up
+# to CANVAS_INDEX_CACHE_SIZE rooms per worker.
+CANVAS_INDEX_CELL_SIZE = int(os.getenv("CANVAS_INDEX_CELL_SIZE", "256"))
+CANVAS_INDEX_CACHE_SIZE = int(os.getenv("CANVAS_INDEX_CACHE_SIZE", "64"))
+
+# Room lifecycle (rooms.lifecycle): last_activity_at is written once per
+# ROOM_ACTIVITY_FLUSH_SECONDS for all active rooms. Canvases of rooms idle
+# for ROOM_ARCHIVE_AFTER_DAYS move to gzip files in ROOM_ARCHIVE_DIR and
+# come back on first use; rooms idle for ROOM_EXPIRE_AFTER_DAYS are
+# deleted. Either age set to 0 disables that step. Sweeps run from
+# "manage.py room_lifecycle", or in every worker each
+# ROOM_LIFECYCLE_INTERVAL seconds when that is not 0.
+ROOM_ACTIVITY_FLUSH_SECONDS = int(os.getenv("ROOM_ACTIVITY_FLUSH_SECONDS", "60"))
+ROOM_ARCHIVE_AFTER_DAYS = int(os.getenv("ROOM_ARCHIVE_AFTER_DAYS", "14"))
+ROOM_EXPIRE_AFTER_DAYS = int(os.getenv("ROOM_EXPIRE_AFTER_DAYS", "180"))
+ROOM_ARCHIVE_DIR = os.getenv("ROOM_ARCHIVE_DIR", str(BASE_DIR / "canvas_archive"))
+ROOM_LIFECYCLE_INTERVAL = int(os.getenv("ROOM_LIFECYCLE_INTERVAL", "0"))
+
+# ICE candidates trickled to the same peer within this many milliseconds
+# are deduplicated and delivered as one "webrtc_candidates" frame. An
+# end-of-candidates marker flushes immediately; 0 disables batching.
+ICE_BATCH_WINDOW_MS = int(os.getenv("ICE_BATCH_WINDOW_MS", "25"))
+
+# Room WebSockets authenticate with the REST API's JWT access token
+# (users.middleware). Verified tokens are cached per worker, up to
+# WS_JWT_CACHE_SIZE, until they expire. With WS_AUTH_REQUIRED=0 anonymous
+# sockets are still accepted and name themselves in "join".
+WS_AUTH_REQUIRED = os.getenv("WS_AUTH_REQUIRED", "1") == "1"
+WS_JWT_CACHE_SIZE = int(os.getenv("WS_JWT_CACHE_SIZE", "10000"))
+
+# Worker processes per host for ``python -m whiteboard_backend.server``.
+# They share state through Redis, so the channel layer and presence
+# backend must be the Redis ones (the defaults) when there is more than
+# one. On SIGTERM each worker tells its WebSocket clients to reconnect
+# after a random delay of up to WS_RECONNECT_JITTER_MS, flushes buffered
+# canvas writes and gets WEB_DRAIN_TIMEOUT seconds to finish.
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+WEB_DRAIN_TIMEOUT = float(os.getenv("WEB_DRAIN_TIMEOUT", "10"))
+WS_RECONNECT_JITTER_MS = int(os.getenv("WS_RECONNECT_JITTER_MS", "2000"))
+
+# Migrations are a release step (manage.py release), not part of server
+# start: it migrates under a PostgreSQL advisory lock or a Redis lock,
+# waiting up to RELEASE_LOCK_TIMEOUT seconds for a concurrent release.
+# Server workers only check at boot that no migration is pending;
+# SCHEMA_CHECK=0 skips even that.
+RELEASE_LOCK_TIMEOUT = float(os.getenv("RELEASE_LOCK_TIMEOUT", "300"))
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "1") == "1"
+
+# Per-connection outbound queue. When a client falls WS_SEND_QUEUE_SIZE
+# frames behind, the policy decides what happens: "coalesce" replaces the
+# queued draw frames with one canvas_resync frame, "drop" discards the
+# oldest draw frame, "disconnect" closes the socket (code 4008). Chat,
+# signaling and presence frames are never dropped.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_QUEUE_POLICY = os.getenv("WS_SEND_QUEUE_POLICY", "coalesce")
+
+# Inbound rate limits (rooms.ratelimit): token buckets per connection,
+# and per room within each worker, refilled at "rate" messages per second
+# up to "burst". A room_rate of 0 leaves the room unlimited. Over the
+# limit a message is dropped ("drop") or the socket is closed ("close",
+# code 4029). Clients are told with a "rate_limited" error frame carrying
+# retry_after. "invalid" covers frames that are malformed or of no known
+# type. WS_RATE_LIMIT=0 turns limiting off.
+WS_RATE_LIMIT = os.getenv("WS_RATE_LIMIT", "1") == "1"
+WS_RATE_LIMITS = {
+    "draw": {
+        "rate": int(os.getenv("WS_DRAW_RATE", "240")),
+        "burst": int(os.getenv("WS_DRAW_BURST", "480")),
+        "room_rate": int(os.getenv("WS_ROOM_DRAW_RATE", "2400")),
+        "room_burst": int(os.getenv("WS_ROOM_DRAW_BURST", "4800")),
+        "action": "drop",
+    },
+    "erase": {
+        "rate": 5,
+        "burst": 20,
+        "room_rate": 50,
+        "room_burst": 100,
+        "action": "drop",
+    },
+    "chat": {
+        "rate": int(os.getenv("WS_CHAT_RATE", "2")),
+        "burst": int(os.getenv("WS_CHAT_BURST", "10")),
+        "room_rate": 20,
+        "room_burst": 50,
+        "action": "drop",
+    },
+    "webrtc": {
+        "rate": 50,
+        "burst": 200,
+        "room_rate": 0,
+        "room_burst": 0,
+        "action": "drop",
+    },
+    "join": {
+        "rate": 0.2,
+        "burst": 3,
+        "room_rate": 5,
+        "room_burst": 20,
+        "action": "close",
+    },
+    "invalid": {
+        "rate": 5,
+        "burst": 20,
+        "room_rate": 0,
+        "room_burst": 0,
+        "action": "drop",
+    },
+}
+
+# Room WebSocket logging. Records go through a queue to a background
+# thread and are written as JSON lines. Inbound frames are logged as
+# sampled summaries (fraction per message type); POST
+# /api/rooms/<code>/debug-logging/ turns on full payload logs per room
+# for WS_DEBUG_LOG_TTL seconds.
+WS_LOG_SAMPLING = {
+    "default": float(os.getenv("WS_LOG_SAMPLE_RATE", "1.0")),
+    "draw": float(os.getenv("WS_LOG_DRAW_SAMPLE_RATE", "0.01")),
+    "webrtc_candidate": float(os.getenv("WS_LOG_CANDIDATE_SAMPLE_RATE", "0.1")),
+}
+WS_DEBUG_LOG_TTL = int(os.getenv("WS_DEBUG_LOG_TTL", "3600"))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "rooms_background": {
+            "class": "rooms.eventlog.BackgroundHandler",
+        },
+    },
+    "loggers": {
+        "rooms": {
+            "handlers": ["rooms_background"],
+            "level": os.getenv("WS_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+# Prometheus metrics served on /metrics. With several daphne workers,
+# point METRICS_DIR at a directory shared by all of them (the supervisor
+# empties it on start) so every worker's scrape reports the sum over the
+# host.
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+# Scrapers send the header "Authorization: Bearer <METRICS_TOKEN>". Without
+# a token nobody may scrape, unless their network is listed in
+# METRICS_ALLOWED_NETS (comma separated CIDRs, none by default). Behind a
+# reverse proxy on the same host every client appears as loopback, so
+# only list networks whose addresses the server sees unproxied.
+METRICS_ALLOWED_NETS = [
+    net.strip()
+    for net in os.getenv("METRICS_ALLOWED_NETS", "").split(",")
+    if net.strip()
+]
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or None
+
+# Google Sign-In: ID tokens are verified against Google's certs, cached
+# for their Cache-Control max-age (users.google). An unknown key id
+# refetches them at most every GOOGLE_CERTS_MIN_REFRESH seconds.
+# GOOGLE_CERTS_FILE reads certs from a JSON file instead (tests, offline).
+GOOGLE_CERTS_FILE = os.getenv("GOOGLE_CERTS_FILE")
+GOOGLE_CERTS_MIN_REFRESH = int(os.getenv("GOOGLE_CERTS_MIN_REFRESH", "60"))
+
+# Login and register check and hash passwords on a pool of
+# AUTH_HASH_WORKERS threads per process (users.hashing), keeping PBKDF2
+# off the event loop. Up to AUTH_HASH_QUEUE more requests wait for a
+# thread; beyond that they are answered 503 with Retry-After.
+AUTH_HASH_WORKERS = int(
+    os.getenv("AUTH_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+AUTH_HASH_QUEUE = int(os.getenv("AUTH_HASH_QUEUE", "32"))
+
 APPEND_SLASH = True
 
 from datetime import timedelta
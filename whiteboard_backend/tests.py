@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import fakeredis
+import redis
+from django.test import SimpleTestCase, TestCase
+
+from whiteboard_backend import metrics, release
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    async def scrape(self, client="127.0.0.1", headers=()):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def app(scope, receive, send):
+            raise AssertionError("not for the wrapped app")
+
+        endpoint = metrics.MetricsEndpoint(app)
+        await endpoint(
+            {
+                "type": "http",
+                "path": "/metrics",
+                "client": (client, 50000),
+                "headers": list(headers),
+            },
+            None,
+            send,
+        )
+        return sent[0]["status"], sent[1]["body"].decode()
+
+    async def test_only_listed_networks_read_without_a_token(self):
+        status, _ = await self.scrape()
+        self.assertEqual(status, 403)
+
+        with self.settings(METRICS_ALLOWED_NETS=["127.0.0.0/8"]):
+            status, body = await self.scrape()
+        self.assertEqual(status, 200)
+        self.assertIn("# TYPE ws_connections_total counter", body)
+
+    async def test_other_clients_need_the_token(self):
+        with self.settings(METRICS_TOKEN="s3cret"):
+            status, _ = await self.scrape("10.0.0.5")
+            self.assertEqual(status, 403)
+            status, _ = await self.scrape(
+                "10.0.0.5", [(b"authorization", b"Bearer wrong")]
+            )
+            self.assertEqual(status, 403)
+            status, _ = await self.scrape(
+                "10.0.0.5", [(b"authorization", b"Bearer s3cret")]
+            )
+            self.assertEqual(status, 200)
+
+        with self.settings(METRICS_ALLOWED_NETS=["10.0.0.0/8"]):
+            status, _ = await self.scrape("10.0.0.5")
+            self.assertEqual(status, 200)
+            status, _ = await self.scrape("127.0.0.1")
+            self.assertEqual(status, 403)
+
+    def test_snapshot_files_are_removed_on_exit_and_supervisor_start(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with self.settings(METRICS_DIR=directory):
+            metrics.write_snapshot()
+            own = f"{os.getpid()}.json"
+            self.assertEqual(os.listdir(directory), [own])
+            metrics.remove_snapshot()
+            self.assertEqual(os.listdir(directory), [])
+
+            for name in ("1.json", "2.json.tmp", "notes.txt"):
+                open(os.path.join(directory, name), "w").close()
+            metrics.clear_snapshots()
+            self.assertEqual(os.listdir(directory), ["notes.txt"])
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(
+            metrics._labels(["view", "method"], ['a"b\\c\nd', "GET"]),
+            '{view="a\\"b\\\\c\\nd",method="GET"}',
+        )
+
+
+class MigrationLockTests(TestCase):
+    def test_sqlite_without_redis_runs_unlocked(self):
+        self.assertEqual(release.pending_migrations(), [])
+        with self.settings(CHANNEL_LAYERS={"default": {"CONFIG": {"hosts": [None]}}}):
+            with release.migration_lock(timeout=0) as kind:
+                self.assertIsNone(kind)
+
+    def test_redis_lock_waits_for_the_holder(self):
+        server = fakeredis.FakeServer()
+        layers = {"default": {"CONFIG": {"hosts": ["redis://release"]}}}
+        with (
+            self.settings(CHANNEL_LAYERS=layers),
+            mock.patch.object(
+                redis.Redis,
+                "from_url",
+                lambda url: fakeredis.FakeRedis(server=server),
+            ),
+        ):
+            with release.migration_lock(timeout=1) as kind:
+                self.assertEqual(kind, "redis")
+                with self.assertRaises(release.LockTimeout):
+                    with release.migration_lock(timeout=0.1):
+                        pass
+
+            with release.migration_lock(timeout=0.1) as kind:
+                self.assertEqual(kind, "redis")
+
+    def test_postgresql_advisory_lock_polls_until_free(self):
+        connection = mock.MagicMock(vendor="postgresql")
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.side_effect = [(False,), (True,)]
+
+        with (
+            mock.patch.object(release, "connection", connection),
+            mock.patch.object(release.time, "sleep") as sleep,
+        ):
+            with release.migration_lock(timeout=5) as kind:
+                self.assertEqual(kind, "postgresql")
+        sleep.assert_called_once()
+        self.assertEqual(
+            [call.args[0] for call in cursor.execute.call_args_list],
+            [
+                "SELECT pg_try_advisory_lock(%s)",
+                "SELECT pg_try_advisory_lock(%s)",
+                "SELECT pg_advisory_unlock(%s)",
+            ],
+        )
+
+        cursor.fetchone.side_effect = None
+        cursor.fetchone.return_value = (False,)
+        with (
+            mock.patch.object(release, "connection", connection),
+            self.assertRaises(release.LockTimeout),
+        ):
+            with release.migration_lock(timeout=0):
+                pass